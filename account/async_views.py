@@ -0,0 +1,262 @@
+import json
+import math
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.settings import api_settings
+# Импорты с account
+from account.authentication import ClientJWTAuthentication
+from account.models import User, email_ci
+from account.serializers import (
+    UsernameEmailSerializer, EmailCodeSerializer,
+    PasswordSerializer, UsernamePasswordSerializer,
+    acheck_availability,
+)
+from account.tasks import asend_code
+from account.throttling import LoginThrottle, RegistrationThrottle, OtpThrottle
+from account.issuance import TokenPair, token_response
+from account.tokens import RefreshToken
+from account.utils import (
+    acheck_code_in_redis, registration_flow, login_flow,
+    ahash_password, aauthenticate_user,
+)
+
+# Async-версии вьюх регистрации, входа, refresh и проверки авторизации для ASGI.
+# Без пула потоков на каждый запрос: Redis через redis.asyncio, ORM через aget/aexists/asave,
+# письмо с кодом - в аутбокс вместе с кодом (без аутбокса публикация в Celery - в отдельном потоке),
+# хеширование пароля - в пуле password_hasher.
+# Включаются settings.ASYNC_AUTH_VIEWS, контракт (URL, тела, куки) тот же, что у views.py.
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    http_method_names = ['post', 'options']
+    throttle_classes = []
+
+    def get_data(self, request):
+        if request.content_type == 'application/json':
+            try:
+                return json.loads(request.body or b'{}')
+            except ValueError:
+                return None
+        return request.POST
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.data = self.get_data(request)
+        if request.data is None:
+            return json_response({'detail': 'JSON parse error'}, status.HTTP_400_BAD_REQUEST)
+        for throttle in [throttle_class() for throttle_class in self.throttle_classes]:
+            if not await throttle.aallow_request(request, self):
+                wait = math.ceil(throttle.wait())
+                response = json_response(
+                    {'detail': f'Request was throttled. Expected available in {wait} seconds.'},
+                    status.HTTP_429_TOO_MANY_REQUESTS,
+                )
+                response['Retry-After'] = str(wait)
+                return response
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as e:
+            # например ServiceOverloaded из пула хеширования
+            return json_response({'detail': e.detail}, e.status_code)
+
+    def client_type(self, request):
+        return request.headers.get('X-Client-Type', 'web')
+
+
+# Регистрация — email
+class AsyncRegistrationEmailView(AsyncAPIView):
+    throttle_classes = [RegistrationThrottle]
+
+    async def post(self, request):
+        serializer = UsernameEmailSerializer(data=request.data, context={'check_availability': False})
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        email = serializer.validated_data['email']
+        username = serializer.validated_data['username']
+        try:
+            await acheck_availability(email, username)
+        except serializers.ValidationError as e:
+            return json_response({'non_field_errors': e.detail}, status.HTTP_400_BAD_REQUEST)
+
+        await asend_code(email, purpose='registration')
+        reg_token = await registration_flow.acreate({'email': email, 'username': username})
+        return json_response({'message': 'Код отправлен на почту', 'reg_token': reg_token})
+
+
+# Регистрация — код
+class AsyncRegistrationCodeView(AsyncAPIView):
+    throttle_classes = [OtpThrottle]
+
+    async def post(self, request):
+        serializer = EmailCodeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        reg_token = request.data.get('reg_token')
+        if not reg_token:
+            return json_response({'message': 'Нужен токен регистрации'}, status.HTTP_403_FORBIDDEN)
+
+        reg_data = await registration_flow.aget(reg_token)
+        if not reg_data:
+            return json_response({'message': 'Истёк токен регистрации'}, status.HTTP_403_FORBIDDEN)
+
+        if not await acheck_code_in_redis(reg_data['email'], serializer.validated_data['code']):
+            return json_response({'message': 'Неверный код'}, status.HTTP_403_FORBIDDEN)
+
+        await registration_flow.aupdate(reg_token, ttl=1800, code_verified=1)
+        return json_response({'message': 'Код принят, придумайте пароль!', 'reg_token': reg_token})
+
+
+# Регистрация — пароль
+class AsyncRegistrationPasswordView(AsyncAPIView):
+    async def post(self, request):
+        serializer = PasswordSerializer(data=request.data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        reg_token = request.data.get('reg_token')
+        reg_data = await registration_flow.aget(reg_token)
+        if not reg_data or not reg_data.get('code_verified'):
+            return json_response({'message': 'Регистрация не подтверждена'}, status.HTTP_403_FORBIDDEN)
+
+        # PBKDF2 - чистый CPU, уводим с event loop в пул хеширования
+        password = await ahash_password(serializer.validated_data['password'])
+        try:
+            user = await User.objects.acreate(username=reg_data['username'], email=reg_data['email'], password=password)
+        except IntegrityError:
+            # ник или почту заняли, пока шла регистрация
+            return json_response({'message': 'Этот ник или почта уже используется'}, status.HTTP_400_BAD_REQUEST)
+        await registration_flow.adelete(reg_token)
+
+        return token_response(
+            {'message': 'Аккаунт создан!'},
+            await TokenPair.afor_user(user, request),
+            self.client_type(request),
+            status=status.HTTP_201_CREATED,
+            response_class=json_response,
+        )
+
+
+# Вход — логин + пароль
+class AsyncLoginView(AsyncAPIView):
+    throttle_classes = [LoginThrottle]
+
+    async def post(self, request):
+        serializer = UsernamePasswordSerializer(data=request.data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        user = await aauthenticate_user(
+            User,
+            username=serializer.validated_data['username'],
+            password=serializer.validated_data['password']
+        )
+        if not user:
+            return json_response({'message': 'Неверный логин или пароль'}, status.HTTP_403_FORBIDDEN)
+
+        await asend_code(user.email, purpose='login')
+        login_token = await login_flow.acreate({'email': user.email})
+        return json_response({'message': 'Код отправлен на почту', 'login_token': login_token})
+
+
+# Вход - код
+class AsyncLoginCodeView(AsyncAPIView):
+    throttle_classes = [OtpThrottle]
+
+    async def post(self, request):
+        serializer = EmailCodeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        login_token = request.data.get('login_token')
+        login_data = await login_flow.aget(login_token)
+        if not login_data:
+            return json_response({'message': 'Истёк токен или не указан'}, status.HTTP_403_FORBIDDEN)
+        email = login_data['email']
+
+        if not await acheck_code_in_redis(email, serializer.validated_data['code']):
+            return json_response({'message': 'Неверный код'}, status.HTTP_403_FORBIDDEN)
+
+        user = await User.objects.aget(email_ci(email))
+        tokens = await TokenPair.afor_user(user, request)
+        await login_flow.adelete(login_token)
+
+        return token_response(
+            {'message': 'Успешный вход!', 'user_id': user.id, 'username': user.username},
+            tokens,
+            self.client_type(request),
+            response_class=json_response,
+        )
+
+
+# Кастомная выдача access токена
+class AsyncTokenRefreshView(AsyncAPIView):
+    """
+    /token/refresh/
+    - web: читает refresh_token из куков и кладет новые токены обратно в куки
+    - mobile: читает refresh_token из заголовка (или тела) и возвращает токены в json
+    """
+
+    async def post(self, request):
+        web = self.client_type(request) == 'web'
+        if web:
+            raw_token = request.COOKIES.get('refresh_token')
+        else:
+            raw_token = request.headers.get('X-Refresh-Token') or request.data.get('refresh')
+        if not raw_token:
+            return json_response({'message': 'Нет refresh_token'}, status.HTTP_401_UNAUTHORIZED)
+
+        try:
+            refresh = RefreshToken(raw_token, check_blacklist=False)
+            await refresh.acheck_blacklist()
+        except TokenError as e:
+            return json_response({'detail': e.args[0], 'code': 'token_not_valid'}, status.HTTP_401_UNAUTHORIZED)
+
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        if user_id:
+            user = await User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).afirst()
+            if not api_settings.USER_AUTHENTICATION_RULE(user):
+                return json_response({
+                    'detail': 'No active account found for the given token.',
+                    'code': 'no_active_account',
+                }, status.HTTP_401_UNAUTHORIZED)
+
+        tokens = TokenPair(str(refresh.access_token))
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                await refresh.ablacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            await refresh.aoutstand()
+            tokens.refresh = str(refresh)
+
+        # старый refresh уже в blacklist, поэтому в вебе новый тоже кладём в куку
+        return token_response(
+            {}, tokens, 'web' if web else 'mobile', response_class=json_response, keys=('access', 'refresh'),
+        )
+
+
+# Проверка авторизации
+class AsyncCheckAuthView(View):
+    async def get(self, request):
+        try:
+            auth = await ClientJWTAuthentication().aauthenticate(request)
+        except AuthenticationFailed as e:
+            return json_response({'detail': e.detail}, status.HTTP_401_UNAUTHORIZED)
+        if auth is None:
+            return json_response(
+                {'detail': 'Authentication credentials were not provided.'}, status.HTTP_401_UNAUTHORIZED
+            )
+        user, _ = auth
+        return json_response({
+            'message': 'Вы авторизованы!',
+            'user_id': user.id,
+            'username': user.username
+        })
@@ -1,6 +1,82 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from account.metrics import timed
+from account.utils import user_cache, session_registry
 
-class CookieJWTAuthentication(JWTAuthentication):
+
+class CachedUserJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication без SELECT пользователя на каждый запрос.
+    Режим задаётся settings.JWT_USER_LOOKUP:
+    - 'db'     - как в simplejwt, пользователь читается из БД
+    - 'cache'  - LRU/TTL кеш в памяти процесса; save сбрасывает его только в своём процессе,
+                 другие воркеры видят старого пользователя до JWT_USER_CACHE_TTL
+    - 'claims' - пользователь собирается из claims токена (TokenUser), БД не трогаем
+    В любом режиме токен, выданный до выхода везде (SessionRegistry), отклоняется.
+    """
+
+    def get_user(self, validated_token):
+        mode = getattr(settings, 'JWT_USER_LOOKUP', 'db')
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if session_registry.is_revoked(user_id, validated_token.get('iat')):
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        if user_id is None or mode == 'db':
+            return super().get_user(validated_token)
+
+        if mode == 'claims':
+            return api_settings.TOKEN_USER_CLASS(validated_token)
+
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+            return user
+
+        self.check_user(user, validated_token)
+        return user
+
+    async def aget_user(self, validated_token):
+        # То же, что get_user, но через async ORM
+        mode = getattr(settings, 'JWT_USER_LOOKUP', 'db')
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        if await session_registry.ais_revoked(user_id, validated_token.get('iat')):
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+
+        if mode == 'claims':
+            return api_settings.TOKEN_USER_CLASS(validated_token)
+
+        user = user_cache.get(user_id) if mode == 'cache' else None
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            if mode == 'cache':
+                user_cache.set(user_id, user)
+
+        self.check_user(user, validated_token)
+        return user
+
+    def check_user(self, user, validated_token) -> None:
+        # те же проверки, что делает simplejwt после SELECT
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+
+class CookieJWTAuthentication(CachedUserJWTAuthentication):
     def authenticate(self, request):
         access_token = request.COOKIES.get('access_token')
         if access_token is None:
@@ -9,4 +85,65 @@ class CookieJWTAuthentication(JWTAuthentication):
             validation_token = self.get_validated_token(access_token)
             return self.get_user(validation_token), validation_token
         except Exception:
-            return None
\ No newline at end of file
+            return None
+
+
+class ClientJWTAuthentication(CachedUserJWTAuthentication):
+    """
+    Одна проверка JWT вместо цепочки JWTAuthentication + CookieJWTAuthentication.
+    Источник токена выбирается по X-Client-Type:
+    - mobile - заголовок Authorization
+    - web    - кука access_token (без куки смотрим заголовок, например из swagger)
+    Токен декодируется один раз, результат кешируется на запросе.
+    """
+
+    def authenticate(self, request):
+        django_request = request._request
+        if hasattr(django_request, '_jwt_auth'):
+            return django_request._jwt_auth
+        result = self._authenticate(request)
+        django_request._jwt_auth = result
+        return result
+
+    @timed('jwt_authenticate')
+    def _authenticate(self, request):
+        try:
+            validated_token = self.get_request_token(request)
+            if validated_token is None:
+                return None
+            return self.get_user(validated_token), validated_token
+        except AuthenticationFailed:
+            if self._from_cookie(request):
+                # протухшая кука - анонимный запрос, как и раньше
+                return None
+            raise
+
+    @timed('jwt_authenticate')
+    async def aauthenticate(self, request):
+        """Для async-вьюх: принимает обычный django HttpRequest."""
+        try:
+            validated_token = self.get_request_token(request)
+            if validated_token is None:
+                return None
+            return await self.aget_user(validated_token), validated_token
+        except AuthenticationFailed:
+            if self._from_cookie(request):
+                return None
+            raise
+
+    def _from_cookie(self, request) -> bool:
+        # META напрямую: request.headers собирает словарь всех заголовков
+        client_type = request.META.get('HTTP_X_CLIENT_TYPE', 'web')
+        return client_type != 'mobile' and 'access_token' in request.COOKIES
+
+    def get_request_token(self, request):
+        if self._from_cookie(request):
+            return self.get_validated_token(request.COOKIES['access_token'])
+
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        return self.get_validated_token(raw_token)
@@ -0,0 +1,37 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+@contextmanager
+def read_replica():
+    """
+    Чтения внутри блока идут на реплику, если она настроена (DATABASES['replica']).
+    Только для данных, которым не страшно отставание репликации, например публичные профили:
+    вход, проверка кода и всё, что читает только что записанное, остаются на основной БД.
+    """
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and 'replica' in settings.DATABASES:
+            return 'replica'
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплика - копия default, объекты из обеих баз можно связывать
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # схема приезжает на реплику репликацией
+        return db != 'replica'
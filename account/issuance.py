@@ -0,0 +1,85 @@
+from django.conf import settings
+from rest_framework.response import Response
+from rest_framework_simplejwt.settings import api_settings
+from account.tokens import RefreshToken
+
+
+class TokenPair:
+    """
+    Выданная пара уже в виде строк: каждый токен подписывается ровно один раз,
+    дальше строки идут и в JSON, и в куки без повторного encode.
+    refresh может быть None - refresh без ротации.
+    С request выдача - вход с устройства: refresh попадает в реестр сессий.
+    """
+
+    def __init__(self, access: str, refresh: str = None):
+        self.access = access
+        self.refresh = refresh
+
+    @classmethod
+    def for_user(cls, user, request=None):
+        refresh = RefreshToken.for_user(user)
+        if request is not None:
+            refresh.device = session_device(request)
+            refresh.outstand()
+        return cls(str(refresh.access_token), str(refresh))
+
+    @classmethod
+    async def afor_user(cls, user, request):
+        refresh = RefreshToken.for_user(user)
+        refresh.device = session_device(request)
+        await refresh.aoutstand()
+        return cls(str(refresh.access_token), str(refresh))
+
+
+def session_device(request) -> dict:
+    # что показать пользователю в списке сессий
+    return {
+        'client': request.headers.get('X-Client-Type', 'web'),
+        'user_agent': request.META.get('HTTP_USER_AGENT', '')[:200],
+        'ip': request.META.get('REMOTE_ADDR'),
+    }
+
+
+def set_token_cookies(response, tokens: TokenPair):
+    if tokens.refresh is not None:
+        response.set_cookie(
+            key='refresh_token',
+            value=tokens.refresh,
+            httponly=True,
+            secure=settings.JWT_COOKIE_SECURE,
+            samesite=settings.JWT_COOKIE_SAMESITE,
+            max_age=int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()),
+            domain=settings.JWT_COOKIE_DOMAIN,
+        )
+    response.set_cookie(
+        key='access_token',
+        value=tokens.access,
+        httponly=True,
+        secure=settings.JWT_COOKIE_SECURE,
+        samesite=settings.JWT_COOKIE_SAMESITE,
+        max_age=int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()),
+        domain=settings.JWT_COOKIE_DOMAIN,
+    )
+    return response
+
+
+def delete_token_cookies(response):
+    # домен тот же, что при установке, иначе браузер куки не удалит
+    response.delete_cookie('access_token', domain=settings.JWT_COOKIE_DOMAIN, samesite=settings.JWT_COOKIE_SAMESITE)
+    response.delete_cookie('refresh_token', domain=settings.JWT_COOKIE_DOMAIN, samesite=settings.JWT_COOKIE_SAMESITE)
+    return response
+
+
+def token_response(body: dict, tokens: TokenPair, client_type: str, status=200, response_class=Response,
+                   keys=('access_token', 'refresh_token')):
+    """
+    Ответ с токенами: mobile - строки в JSON под ключами `keys`, web - HttpOnly куки.
+    response_class - Response для DRF-вьюх или json_response для async-вьюх.
+    """
+    if client_type == 'mobile':
+        body = {**body, keys[0]: tokens.access}
+        if tokens.refresh is not None:
+            body[keys[1]] = tokens.refresh
+        return response_class(body, status=status)
+    return set_token_cookies(response_class(body, status=status), tokens)
@@ -0,0 +1,118 @@
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from redis.exceptions import ResponseError
+from account.utils import registration_flow, login_flow
+from account.utils.auth_utils import otp_store
+from account.utils.redis_client import get_redis, AUTH_CACHE
+
+# префикс ключа -> TTL, который ему положен
+KEY_TTLS = {
+    registration_flow.prefix: registration_flow.ttl,
+    login_flow.prefix: login_flow.ttl,
+    'verify_code': otp_store.ttl,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает ключи reg:/login:/verify_code: в Redis и память на них; находит осиротевшие '
+        '(без TTL, в том числе старого pickle-формата) и с --expire выставляет им положенный TTL. '
+        'По умолчанию смотрит и auth, и default: до переезда в auth ключи жили в default (db 0)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--expire', action='store_true', help='Выставить TTL осиротевшим ключам')
+        parser.add_argument('--alias', nargs='+', default=[AUTH_CACHE, 'default'], choices=list(caches),
+                            help='алиасы кеша, в Redis которых искать ключи')
+
+    def handle(self, *args, **options):
+        targets, seen = [], set()
+        for alias in options['alias']:
+            redis = get_redis(alias)
+            if redis is None:
+                raise CommandError(f'Аудит ключей работает только с django-redis, а {alias} - нет')
+            # алиасы на одной базе Redis с одним префиксом ключей считаем один раз
+            kwargs = redis.connection_pool.connection_kwargs
+            location = (kwargs.get('host'), kwargs.get('port'), kwargs.get('path'), kwargs.get('db'),
+                        caches[alias].make_key(''))
+            if location not in seen:
+                seen.add(location)
+                targets.append((alias, redis))
+
+        self.memory_usage = True
+        self.stdout.write(
+            f'{"alias":<10}{"prefix":<14}{"keys":>8}{"no ttl":>8}{"legacy":>8}{"bytes":>12}{"bytes/key":>11}'
+        )
+        totals = []
+        for alias, redis in targets:
+            for prefix, ttl in KEY_TTLS.items():
+                stats = self.audit(redis, caches[alias], prefix, ttl, options)
+                totals.append((prefix, stats))
+                avg = stats['bytes'] / stats['keys'] if stats['keys'] else 0
+                self.stdout.write(
+                    f'{alias:<10}{prefix:<14}{stats["keys"]:>8}{stats["no_ttl"]:>8}{stats["legacy"]:>8}'
+                    f'{stats["bytes"]:>12}{avg:>11.0f}'
+                )
+
+        # на активный flow приходится его hash и, пока код не введён, hash с кодом
+        flows = sum(stats['keys'] for prefix, stats in totals if prefix != 'verify_code')
+        if flows:
+            total = sum(stats['bytes'] for prefix, stats in totals)
+            self.stdout.write(f'Память на активный flow: {total / flows:.0f} байт')
+        if not self.memory_usage:
+            self.stdout.write('MEMORY USAGE не поддерживается сервером, размеры - длина DUMP')
+        orphans = sum(stats['no_ttl'] for prefix, stats in totals)
+        if orphans and not options['expire']:
+            self.stdout.write(self.style.WARNING(f'Осиротевших ключей: {orphans}, выставить TTL: --expire'))
+        elif orphans:
+            self.stdout.write(self.style.SUCCESS(f'TTL выставлен {orphans} ключам'))
+
+    def audit(self, redis, cache, prefix, ttl, options):
+        stats = {'keys': 0, 'no_ttl': 0, 'legacy': 0, 'bytes': 0}
+        batch = []
+        for key in redis.scan_iter(match=cache.make_key(f'{prefix}:*'), count=options['batch_size']):
+            batch.append(key)
+            if len(batch) >= options['batch_size']:
+                self.audit_batch(redis, batch, ttl, stats, options)
+                batch = []
+        if batch:
+            self.audit_batch(redis, batch, ttl, stats, options)
+        return stats
+
+    def audit_batch(self, redis, keys, ttl, stats, options):
+        pipe = redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+            pipe.ttl(key)
+        replies = pipe.execute()
+        sizes = self.sizes(redis, keys)
+
+        pipe = redis.pipeline(transaction=False)
+        for key, key_type, key_ttl, size in zip(keys, replies[::2], replies[1::2], sizes):
+            if key_ttl == -2:  # истёк, пока шёл аудит
+                continue
+            stats['keys'] += 1
+            stats['bytes'] += size or 0
+            # состояние flow и кода - hash; строка осталась от pickle-формата с TIMEOUT None
+            stats['legacy'] += key_type != b'hash'
+            stats['no_ttl'] += key_ttl == -1
+            if options['expire'] and key_ttl == -1:
+                pipe.expire(key, ttl)
+        if options['expire']:
+            pipe.execute()
+
+    def sizes(self, redis, keys):
+        if self.memory_usage:
+            pipe = redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.memory_usage(key)
+            try:
+                return pipe.execute()
+            except ResponseError:
+                self.memory_usage = False
+        # запасной вариант: размер сериализованного значения без накладных расходов Redis
+        pipe = redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.dump(key)
+        return [len(value) if value else 0 for value in pipe.execute()]
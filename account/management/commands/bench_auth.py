@@ -0,0 +1,80 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from account.authentication import (
+    CachedUserJWTAuthentication, CookieJWTAuthentication, ClientJWTAuthentication,
+)
+from account.models import User
+from account.tokens import RefreshToken
+from account.utils import user_cache
+
+
+def run_authenticators(authenticators, request):
+    # Тот же цикл, что в rest_framework.request.Request._authenticate
+    for authenticator in authenticators:
+        try:
+            user_auth = authenticator.authenticate(request)
+        except APIException:
+            return None
+        if user_auth is not None:
+            return user_auth
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает стоимость аутентификации: старая цепочка из двух классов против ClientJWTAuthentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--iterations', type=int, default=2000)
+        parser.add_argument('--lookup', choices=['db', 'cache', 'claims'], default='db')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        with override_settings(JWT_USER_LOOKUP=options['lookup']), transaction.atomic():
+            user = User.objects.create(username='bench_auth_user', email='bench@example.com')
+            access = str(RefreshToken.for_user(user).access_token)
+            factory = APIRequestFactory()
+
+            def web():
+                request = factory.get('/api/is_authentificated/')
+                request.COOKIES['access_token'] = access
+                return request
+
+            def mobile():
+                return factory.get(
+                    '/api/is_authentificated/',
+                    HTTP_X_CLIENT_TYPE='mobile', HTTP_AUTHORIZATION=f'Bearer {access}',
+                )
+
+            def mobile_bad():
+                return factory.get(
+                    '/api/is_authentificated/',
+                    HTTP_X_CLIENT_TYPE='mobile', HTTP_AUTHORIZATION='Bearer broken.token.value',
+                )
+
+            chains = {
+                'chain': [CachedUserJWTAuthentication(), CookieJWTAuthentication()],
+                'single': [ClientJWTAuthentication()],
+            }
+            self.stdout.write(f'{"scenario":<12}{"chain":>14}{"single":>14}{"speedup":>10}')
+            for name, make_request in (('web', web), ('mobile', mobile), ('mobile_bad', mobile_bad)):
+                results = {}
+                for chain_name, authenticators in chains.items():
+                    user_cache.clear()
+                    run_authenticators(authenticators, Request(make_request()))  # прогрев
+                    elapsed = 0.0
+                    for _ in range(iterations):
+                        request = Request(make_request())
+                        start = time.perf_counter()
+                        run_authenticators(authenticators, request)
+                        elapsed += time.perf_counter() - start
+                    results[chain_name] = elapsed / iterations * 1e6
+                self.stdout.write(
+                    f'{name:<12}{results["chain"]:>11.1f} us{results["single"]:>11.1f} us'
+                    f'{results["chain"] / results["single"]:>9.2f}x'
+                )
+            transaction.set_rollback(True)
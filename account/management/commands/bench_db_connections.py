@@ -0,0 +1,74 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Цена соединения с БД на запрос: новое соединение против соединения из пула/постоянного. '
+        'Пересчитывает экономию на заданный RPS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--iterations', type=int, default=200)
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--rps', type=int, default=200, help='Запросов в секунду, на которые пересчитать экономию')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        iterations = options['iterations']
+
+        def fresh():
+            # как без пула и CONN_MAX_AGE = 0: connect + запрос + close на каждый HTTP-запрос
+            raw = connection.Database.connect(**connection.get_connection_params())
+            cursor = raw.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            raw.close()
+
+        def configured():
+            # как сейчас настроено: то же, что Django делает на границе запроса -
+            # при CONN_MAX_AGE = 0 закрывает (с пулом - возвращает в пул), иначе оставляет открытым
+            connection.close_if_unusable_or_obsolete()
+            connection.ensure_connection()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+
+        def reused():
+            # постоянное соединение (CONN_MAX_AGE) или уже выданное из пула
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+
+        pooled = bool(connection.settings_dict.get('OPTIONS', {}).get('pool'))
+        self.stdout.write(
+            f'{connection.vendor} {connection.settings_dict.get("HOST") or connection.settings_dict["NAME"]}, '
+            f'pool: {"да" if pooled else "нет"}, CONN_MAX_AGE: {connection.settings_dict["CONN_MAX_AGE"]}'
+        )
+        self.stdout.write(f'{"mode":<12}{"p50 ms":>9}{"p95 ms":>9}{"mean ms":>9}')
+        means = {}
+        for name, fn in (('fresh', fresh), ('configured', configured), ('reused', reused)):
+            fn()  # прогрев (в том числе открытие пула)
+            timings = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+            means[name] = sum(timings) / len(timings)
+            self.stdout.write(
+                f'{name:<12}{percentile(timings, 0.5) * 1000:>9.3f}{percentile(timings, 0.95) * 1000:>9.3f}'
+                f'{means[name] * 1000:>9.3f}'
+            )
+        connection.close()
+
+        per_request = means['fresh'] - means['configured']
+        self.stdout.write(
+            f'Текущая настройка экономит {per_request * 1000:.3f} мс на запрос; при {options["rps"]} req/s это '
+            f'{per_request * options["rps"]:.3f} с суммарной задержки за каждую секунду'
+        )
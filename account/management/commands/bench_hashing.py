@@ -0,0 +1,58 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from account.exceptions import ServiceOverloaded
+from account.utils.password_hashing import PasswordHashingExecutor
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест хеширования паролей: inline в потоке запроса против пула с 503 при переполнении'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--requests', type=int, default=200)
+        parser.add_argument('-c', '--concurrency', type=int, default=32, help='Одновременных "запросов"')
+        parser.add_argument('--kind', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--max-pending', type=int, default=16)
+
+    def handle(self, *args, **options):
+        pool = PasswordHashingExecutor(
+            kind=options['kind'], workers=options['workers'],
+            max_pending=options['max_pending'], timeout=30,
+        )
+        pool.run(make_password, 'warmup')
+
+        modes = {
+            'inline': lambda: make_password('S3cret-password'),
+            'pool': lambda: pool.run(make_password, 'S3cret-password'),
+        }
+        self.stdout.write(f'{"mode":<8}{"ok":>6}{"503":>6}{"rps":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}')
+        for name, fn in modes.items():
+            latencies, shed = [], 0
+
+            def one_request():
+                start = time.perf_counter()
+                try:
+                    fn()
+                except ServiceOverloaded:
+                    return None
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as clients:
+                for result in clients.map(lambda _: one_request(), range(options['requests'])):
+                    if result is None:
+                        shed += 1
+                    else:
+                        latencies.append(result * 1000)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{name:<8}{len(latencies):>6}{shed:>6}{len(latencies) / elapsed:>9.1f}'
+                f'{percentile(latencies, 0.5):>9.0f}{percentile(latencies, 0.95):>9.0f}{percentile(latencies, 0.99):>9.0f}'
+            )
@@ -0,0 +1,243 @@
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack
+from django.conf import settings
+from django.core import mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from account.models import User
+from account.tasks import relay_outbox
+from account.utils import email_outbox, flow_local_cache
+from master.celery import app as celery_app
+
+PASSWORD = 'Bench-Passw0rd'
+CODE_RE = re.compile(r'\b(\d{6})\b')
+
+
+def percentile(values, p):
+    # nearest-rank по отсортированному списку
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+class Lifecycle:
+    """
+    Один виртуальный пользователь: регистрация (3 шага), вход (2 шага),
+    refresh, проверка авторизации и выход - теми же запросами, что шлёт клиент.
+    """
+
+    def __init__(self, stats, client_type, prefix, number):
+        self.stats = stats
+        self.mobile = client_type == 'mobile'
+        self.client = Client(HTTP_X_CLIENT_TYPE=client_type)
+        self.username = f'{prefix}{number}'
+        self.email = f'{prefix}{number}@bench.local'
+
+    def request(self, endpoint, method, url, expected, data=None, **extra):
+        start = time.perf_counter()
+        if method == 'post':
+            response = self.client.post(url, data or {}, content_type='application/json', **extra)
+        else:
+            response = self.client.get(url, **extra)
+        elapsed = time.perf_counter() - start
+        ok = response.status_code == expected
+        self.stats.add(endpoint, elapsed, ok)
+        if not ok:
+            raise RuntimeError(f'{endpoint}: {response.status_code} {response.content[:200]!r}')
+        return response.json() if response.content else {}
+
+    def code(self, timeout=5):
+        # письмо уходит через in-memory backend; при пакетной отправке может прийти чуть позже ответа
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for message in reversed(list(mail.outbox)):
+                if message.to == [self.email]:
+                    mail.outbox.remove(message)
+                    return CODE_RE.search(message.body).group(1)
+            time.sleep(0.005)
+        raise RuntimeError(f'нет письма с кодом для {self.email}')
+
+    def run(self):
+        body = self.request('registration', 'post', reverse('registration_1_step'), 200,
+                            {'username': self.username, 'email': self.email})
+        reg_token = body['reg_token']
+        self.request('registration_code', 'post', reverse('registration_2_step'), 200,
+                     {'code': self.code(), 'reg_token': reg_token})
+        self.request('registration_password', 'post', reverse('registration_3_step'), 201,
+                     {'password': PASSWORD, 'password2': PASSWORD, 'reg_token': reg_token})
+
+        body = self.request('login', 'post', reverse('login_1_step'), 200,
+                            {'username': self.username, 'password': PASSWORD})
+        tokens = self.request('login_code', 'post', reverse('login_2_step'), 200,
+                              {'code': self.code(), 'login_token': body['login_token']})
+
+        auth = {}
+        refresh = {}
+        if self.mobile:
+            refresh = {'refresh': tokens['refresh_token']}
+        tokens = self.request('token_refresh', 'post', reverse('token_refresh'), 200, refresh)
+        if self.mobile:
+            auth = {'HTTP_AUTHORIZATION': f'Bearer {tokens["access"]}'}
+        self.request('check_auth', 'get', reverse('check_auth'), 200, **auth)
+        self.request('logout', 'post', reverse('logout'), 202,
+                     {'refresh_token': tokens.get('refresh')} if self.mobile else {}, **auth)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, elapsed, ok):
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон полного цикла: регистрация, вход, refresh, check-auth, logout. '
+        'Письма - in-memory backend, Celery - eager, БД - из DATABASES (SQLite/Postgres). '
+        'Печатает RPS и p50/p95/p99 по каждому эндпоинту.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--users', type=int, default=200, help='сколько полных циклов прогнать')
+        parser.add_argument('-c', '--concurrency', type=int, default=8, help='параллельных клиентов (потоков)')
+        parser.add_argument('--client', choices=['mobile', 'web'], default='mobile')
+        parser.add_argument('--fake-redis', action='store_true',
+                            help='кеш на fakeredis вместо настоящего Redis (нужен fakeredis[lua])')
+        parser.add_argument('--real-hasher', action='store_true',
+                            help='настоящий PBKDF2 вместо быстрого MD5 (тогда меряется в основном хеширование)')
+        parser.add_argument('--keep-throttling', action='store_true', help='не отключать лимиты запросов')
+        parser.add_argument('--keep-users', action='store_true', help='не удалять созданных пользователей')
+        parser.add_argument('--flow-local-cache', action='store_true',
+                            help='включить FLOW_LOCAL_CACHE и показать, сколько чтений flow обошлось без Redis')
+
+    def handle(self, *args, **options):
+        prefix = f'bench{uuid.uuid4().hex[:6]}_'
+        with ExitStack() as stack:
+            stack.enter_context(override_settings(**self.settings_overrides(options)))
+            eager = celery_app.conf.task_always_eager
+            celery_app.conf.task_always_eager = True
+            stack.callback(setattr, celery_app.conf, 'task_always_eager', eager)
+            mail.outbox = []
+            try:
+                stats, wall = self.run_load(options, prefix)
+            finally:
+                if not options['keep_users']:
+                    User.objects.filter(username__startswith=prefix).delete()
+        self.report(stats, wall, options)
+
+    def settings_overrides(self, options):
+        overrides = {
+            'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        }
+        if options['fake_redis']:
+            try:
+                import fakeredis
+            except ImportError:
+                raise CommandError('Для --fake-redis установите fakeredis[lua]')
+            # кеши из настроек проекта (сериализатор, пул, таймауты) - подменяется только соединение
+            overrides['CACHES'] = {}
+            for alias, config in settings.CACHES.items():
+                if config['BACKEND'] != 'django_redis.cache.RedisCache':
+                    overrides['CACHES'][alias] = config
+                    continue
+                cache_options = config.get('OPTIONS', {})
+                overrides['CACHES'][alias] = {
+                    **config,
+                    'OPTIONS': {
+                        **cache_options,
+                        'CONNECTION_POOL_KWARGS': {
+                            **cache_options.get('CONNECTION_POOL_KWARGS', {}),
+                            'connection_class': fakeredis.FakeConnection,
+                        },
+                        'ASYNC_CONNECTION_CLASS': 'fakeredis.aioredis.FakeConnection',
+                    },
+                }
+        if not options['real_hasher']:
+            overrides['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+        if options['flow_local_cache']:
+            overrides['FLOW_LOCAL_CACHE'] = True
+        if not options['keep_throttling']:
+            overrides['REST_FRAMEWORK'] = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+        return overrides
+
+    def run_load(self, options, prefix):
+        stats = Stats()
+        numbers = iter(range(options['users']))
+        numbers_lock = threading.Lock()
+        failures = []
+
+        def worker():
+            try:
+                while True:
+                    with numbers_lock:
+                        number = next(numbers, None)
+                    if number is None:
+                        return
+                    try:
+                        Lifecycle(stats, options['client'], prefix, number).run()
+                    except RuntimeError as e:
+                        failures.append(str(e))
+            finally:
+                connections.close_all()
+
+        done = threading.Event()
+
+        def relay():
+            # с аутбоксом письма уходят не из запроса, а через relay - крутим его рядом, как в production
+            while not done.is_set():
+                if not sum(relay_outbox(purpose) for purpose in settings.EMAIL_QUEUES):
+                    time.sleep(0.002)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        relay_thread = threading.Thread(target=relay) if email_outbox.enabled else None
+        start = time.perf_counter()
+        if relay_thread:
+            relay_thread.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        done.set()
+        if relay_thread:
+            relay_thread.join()
+
+        for failure in failures[:5]:
+            self.stderr.write(failure)
+        return stats, wall
+
+    def report(self, stats, wall, options):
+        total = sum(len(values) for values in stats.latencies.values())
+        self.stdout.write(
+            f'{options["users"]} циклов, {options["concurrency"]} потоков, клиент {options["client"]}: '
+            f'{total} запросов за {wall:.2f} с, {total / wall:.1f} req/s'
+        )
+        self.stdout.write(
+            f'{"endpoint":<24}{"count":>7}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+        )
+        for endpoint, values in stats.latencies.items():
+            values = sorted(values)
+            self.stdout.write(
+                f'{endpoint:<24}{len(values):>7}{stats.errors[endpoint]:>8}{len(values) / wall:>9.1f}'
+                f'{percentile(values, 50) * 1000:>9.2f}{percentile(values, 95) * 1000:>9.2f}'
+                f'{percentile(values, 99) * 1000:>9.2f}'
+            )
+        for flow in ('reg', 'login'):
+            flow_stats = flow_local_cache.stats(flow)
+            if flow_stats['hit'] + flow_stats['miss'] + flow_stats['bypass']:
+                self.stdout.write(
+                    f'flow {flow} из памяти: {flow_stats["hit"]} чтений без Redis, {flow_stats["miss"]} промахов, '
+                    f'{flow_stats["bypass"]} до подписки (hit rate {flow_stats["hit_rate"]:.0%})'
+                )
@@ -0,0 +1,81 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+from account.issuance import TokenPair
+from account.metrics import stage_duration
+from account.models import User
+from account.utils import login_flow
+from account.utils.auth_utils import otp_store
+from account.views import LoginCodeAPIView, CustomTokenRefreshView
+
+
+def signatures(fn):
+    # сколько раз за вызов сработала подпись JWT (счётчик jwt_sign из account.metrics)
+    before = stage_duration.count(stage='jwt_sign')
+    result = fn()
+    return stage_duration.count(stage='jwt_sign') - before, result
+
+
+def generate_pem(algorithm):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if algorithm == 'EdDSA':
+        key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    ).decode()
+
+
+class Command(BaseCommand):
+    help = 'Сколько подписей JWT делает вход и refresh, и сколько стоит выдача пары для HS256/EdDSA/RS256'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--iterations', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create(username='bench_sign_user', email='bench_sign@example.com')
+            self.signatures_per_response(user)
+            self.issuance_cost(user, options['iterations'])
+            transaction.set_rollback(True)
+
+    def signatures_per_response(self, user):
+        factory = APIRequestFactory()
+        self.stdout.write(f'{"response":<24}{"signatures":>12}')
+        for client_type in ('mobile', 'web'):
+            login_token = login_flow.create({'email': user.email})
+            otp_store.set(user.email, '123456')
+            request = factory.post(
+                '/api/login/verification/', {'code': '123456', 'login_token': login_token},
+                format='json', HTTP_X_CLIENT_TYPE=client_type,
+            )
+            count, response = signatures(lambda: LoginCodeAPIView.as_view()(request))
+            self.stdout.write(f'{"login " + client_type:<24}{count:>12}')
+
+            if client_type == 'mobile':
+                refresh = response.data['refresh_token']
+                request = factory.post('/api/token/refresh/', {'refresh': refresh}, format='json',
+                                       HTTP_X_CLIENT_TYPE='mobile')
+            else:
+                request = factory.post('/api/token/refresh/', {}, format='json')
+                request.COOKIES['refresh_token'] = response.cookies['refresh_token'].value
+            count, _ = signatures(lambda: CustomTokenRefreshView.as_view()(request))
+            self.stdout.write(f'{"refresh " + client_type:<24}{count:>12}')
+
+    def issuance_cost(self, user, iterations):
+        self.stdout.write(f'\n{"algorithm":<12}{"pair us":>10}{"per sign us":>14}')
+        for algorithm in ('HS256', 'EdDSA', 'RS256'):
+            keys = [] if algorithm == 'HS256' else [{'kid': 'bench', 'private_key': generate_pem(algorithm)}]
+            with override_settings(JWT_SIGNING_KEYS=keys):
+                TokenPair.for_user(user)  # прогрев: сборка связки ключей
+                start = time.perf_counter()
+                count, _ = signatures(lambda: [TokenPair.for_user(user) for _ in range(iterations)])
+                elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{algorithm:<12}{elapsed / iterations * 1e6:>10.1f}{elapsed / count * 1e6:>14.1f}'
+            )
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from account.utils.openapi_schema import render_schema, schema_dir, schema_path, write_schema_artifact
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает OpenAPI-схему в OPENAPI_SCHEMA_DIR (yaml, json и их .gz), /api/schema/ отдаёт её как файл. '
+        'Запускать при деплое с теми же настройками, что и сервер (ASYNC_AUTH_VIEWS меняет вьюхи). '
+        'Схема не изменилась - файлы и ETag остаются прежними.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='ничего не писать, код 1, если собранная схема устарела (для CI)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rendered = render_schema()
+        elapsed = time.perf_counter() - start
+
+        if options['check']:
+            stale = [fmt for fmt, body in rendered.items() if not schema_path(fmt).is_file()
+                     or schema_path(fmt).read_bytes() != body]
+            if stale:
+                raise CommandError(f'Схема в {schema_dir()} устарела: python manage.py build_openapi_schema')
+            self.stdout.write(f'Схема в {schema_dir()} актуальна')
+            return
+
+        if write_schema_artifact(rendered):
+            sizes = ', '.join(f'{fmt} {len(body)} байт' for fmt, body in rendered.items())
+            self.stdout.write(self.style.SUCCESS(f'Схема записана в {schema_dir()}: {sizes}'))
+        else:
+            self.stdout.write(f'Схема не изменилась, {schema_dir()} не тронут')
+        self.stdout.write(f'Генерация заняла {elapsed * 1000:.0f} мс - столько раньше стоил каждый GET /api/schema/')
@@ -0,0 +1,51 @@
+import sys
+import time
+from django.core.management.base import BaseCommand
+from account.db_routers import read_replica
+from account.models import User
+from account.utils import USER_FIELDS, detect_format, write_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоковая выгрузка пользователей в JSONL/CSV (формат import_users): iterator() пачками, '
+        'пароли - хеши как есть. Читает с реплики, если она настроена.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="файл .jsonl или .csv, '-' - stdout")
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='по умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--after-id', type=int, default=0, help='выгрузить только пользователей с id больше')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        stream = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        # в stdout идут данные, поэтому отчёт - в stderr
+        report = self.stderr if path == '-' else self.stdout
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+
+        def rows():
+            # на Postgres iterator() - серверный курсор: в памяти не больше одной пачки
+            users = (
+                User.objects.filter(pk__gt=options['after_id']).order_by('pk')
+                .values_list(*USER_FIELDS).iterator(chunk_size=batch_size)
+            )
+            for number, row in enumerate(users, start=1):
+                yield row
+                if number % (batch_size * 10) == 0:
+                    self.stderr.write(f'{number} строк, {number / (time.perf_counter() - start):.0f} строк/с')
+
+        with read_replica():
+            try:
+                count = write_users(stream, fmt, rows())
+            finally:
+                if stream is not sys.stdout:
+                    stream.close()
+
+        elapsed = time.perf_counter() - start
+        report.write(self.style.SUCCESS(
+            f'Выгружено {count} пользователей за {elapsed:.1f} c ({count / max(elapsed, 1e-9):.0f} строк/с)'
+        ))
@@ -0,0 +1,47 @@
+import os
+from datetime import date
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Создаёт ключ подписи JWT (EdDSA или RS256) для settings.JWT_SIGNING_KEYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', choices=['EdDSA', 'RS256'], default='EdDSA')
+        parser.add_argument('--kid', default=date.today().strftime('%Y-%m-%d'))
+        parser.add_argument('--out-dir', default='keys', help='куда положить <kid>.pem и <kid>.pub.pem')
+
+    def handle(self, *args, **options):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+        if options['algorithm'] == 'EdDSA':
+            private_key = ed25519.Ed25519PrivateKey.generate()
+        else:
+            private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+        out_dir = Path(options['out_dir'])
+        out_dir.mkdir(parents=True, exist_ok=True)
+        private_path = out_dir / f'{options["kid"]}.pem'
+        public_path = out_dir / f'{options["kid"]}.pub.pem'
+        # 0600 сразу при создании: между write и chmod ключ не бывает читаем другими,
+        # O_EXCL не даёт перезаписать существующий ключ
+        try:
+            fd = os.open(private_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        except FileExistsError:
+            raise CommandError(f'{private_path} уже существует')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(private_key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            ))
+        public_path.write_bytes(private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        ))
+
+        self.stdout.write(f'Ключ: {private_path}, публичный: {public_path}')
+        self.stdout.write('Добавьте первым в JWT_SIGNING_KEYS:')
+        self.stdout.write(f"    {{'kid': '{options['kid']}', 'private_key_path': '{private_path.resolve()}'}},")
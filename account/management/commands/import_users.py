@@ -0,0 +1,200 @@
+import sys
+import time
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from account.models import User, emails_ci
+from account.utils import detect_format, read_users, user_bloom
+from account.utils.redis_client import get_redis, AUTH_CACHE
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+
+def parse_bool(value, default=True) -> bool:
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def text(row: dict, field: str) -> str:
+    """Поле как строка: в JSONL бывают числа ("username": 123), вложенные объекты - строка битая."""
+    value = row.get(field)
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        raise ValueError(f'{field}: ожидается строка')
+    return str(value).strip()
+
+
+def parse_date(row: dict, field: str):
+    value = text(row, field)
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'{field} не в формате ISO 8601')
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def build_user(row: dict) -> User:
+    """User из строки файла без записи в БД; ValueError/ValidationError - строка битая."""
+    username = text(row, 'username')
+    email = text(row, 'email')
+    if not username or not email:
+        raise ValueError('нужны username и email')
+    User.username_validator(username)
+    validate_email(email)
+
+    password = text(row, 'password')
+    if not password:
+        # без пароля - вход только по коду из почты, как у регистрации без password-set
+        password = make_password(None)
+    elif not password.startswith('!'):
+        # хеш должен быть в формате одного из PASSWORD_HASHERS; повторно не хешируем
+        identify_hasher(password)
+
+    return User(
+        username=username,
+        email=email,
+        password=password,
+        first_name=text(row, 'first_name'),
+        last_name=text(row, 'last_name'),
+        bio=text(row, 'bio') or None,
+        is_active=parse_bool(row.get('is_active')),
+        is_staff=parse_bool(row.get('is_staff'), default=False),
+        is_superuser=parse_bool(row.get('is_superuser'), default=False),
+        date_joined=parse_date(row, 'date_joined') or timezone.now(),
+        last_login=parse_date(row, 'last_login'),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоковая загрузка пользователей из JSONL/CSV: bulk_create пачками, пароли - готовые хеши '
+        'Django без перехеширования, без писем и PBKDF2. Существующие ник/почта пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="файл .jsonl или .csv, '-' - stdin")
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='по умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='только проверить строки, в БД не писать')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        self.counts = {'read': 0, 'created': 0, 'valid': 0, 'exists': 0, 'invalid': 0}
+        self.bloom_failed = False
+        self.start = time.perf_counter()
+        batch = []
+        try:
+            for number, row in read_users(stream, fmt):
+                self.counts['read'] += 1
+                try:
+                    if row is None:
+                        raise ValueError('строка не разбирается')
+                    batch.append(build_user(row))
+                except (ValueError, ValidationError) as e:
+                    self.invalid(number, e)
+                    continue
+                if len(batch) >= options['batch_size']:
+                    self.flush(batch, options)
+                    batch = []
+            if batch:
+                self.flush(batch, options)
+        finally:
+            # stdin открыт не нами - не закрываем
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - self.start
+        counts = self.counts
+        created = f'создали бы {counts["valid"]} (--dry-run)' if options['dry_run'] else f'создано {counts["created"]}'
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {counts["read"]}, {created}, уже были {counts["exists"]}, '
+            f'битых {counts["invalid"]} за {elapsed:.1f} c ({counts["read"] / elapsed:.0f} строк/с)'
+        ))
+        if self.bloom_failed:
+            self.stderr.write(self.style.WARNING(
+                'Bloom-фильтр обновлён не для всех: выполните python manage.py rebuild_user_bloom'
+            ))
+
+    def invalid(self, number, error):
+        self.counts['invalid'] += 1
+        if self.counts['invalid'] <= 20:
+            message = '; '.join(error.messages) if isinstance(error, ValidationError) else str(error)
+            self.stderr.write(f'строка {number}: {message}')
+
+    def flush(self, batch, options):
+        # повторы внутри пачки - берём первую строку
+        usernames, emails, unique = set(), set(), []
+        for user in batch:
+            email = user.email.lower()
+            if user.username in usernames or email in emails:
+                self.counts['exists'] += 1
+                continue
+            usernames.add(user.username)
+            emails.add(email)
+            unique.append(user)
+
+        # конкурентная регистрация может занять ник между проверкой и вставкой - тогда проверяем заново
+        for _ in range(3):
+            unique = self.without_taken(unique)
+            if options['dry_run'] or not unique:
+                break
+            try:
+                with transaction.atomic():
+                    User.objects.bulk_create(unique, batch_size=options['batch_size'])
+                break
+            except IntegrityError:
+                continue
+        else:
+            raise CommandError('Не удалось вставить пачку: ники или почты постоянно заняты параллельно')
+
+        if options['dry_run']:
+            # в БД ничего не пишем: это только прогноз, его покажет итог
+            self.counts['valid'] += len(unique)
+        else:
+            self.counts['created'] += len(unique)
+            self.add_to_bloom(unique)
+        elapsed = time.perf_counter() - self.start
+        self.stderr.write(f'{self.counts["read"]} строк, {self.counts["read"] / elapsed:.0f} строк/с')
+
+    def without_taken(self, users):
+        if not users:
+            return users
+        # один запрос на пачку по индексам username и LOWER(email)
+        taken = User.objects.filter(
+            Q(username__in=[user.username for user in users])
+            | emails_ci(user.email for user in users)
+        ).values_list('username', 'email')
+        taken_usernames = {username for username, _ in taken}
+        taken_emails = {email.lower() for _, email in taken}
+        free = [
+            user for user in users
+            if user.username not in taken_usernames and user.email.lower() not in taken_emails
+        ]
+        self.counts['exists'] += len(users) - len(free)
+        return free
+
+    def add_to_bloom(self, users):
+        # bulk_create не шлёт post_save - новые ники и почты добавляем в Bloom-фильтр сами
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            return
+        pipe = redis.pipeline(transaction=False)
+        for user in users:
+            user_bloom.add(pipe, user.email, user.username)
+        try:
+            pipe.execute()
+        except Exception:
+            # пачка уже в БД; фильтр догоним перестройкой после загрузки
+            self.bloom_failed = True
@@ -0,0 +1,48 @@
+import time
+from datetime import timezone as dt_timezone
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from account.utils import blacklist_jti
+
+OUTSTANDING_TABLE = 'token_blacklist_outstandingtoken'
+BLACKLISTED_TABLE = 'token_blacklist_blacklistedtoken'
+
+
+class Command(BaseCommand):
+    help = 'Переносит неистёкшие JTI из SQL-таблиц simplejwt token_blacklist в Redis-blacklist'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать строки')
+
+    def handle(self, *args, **options):
+        tables = connection.introspection.table_names()
+        if OUTSTANDING_TABLE not in tables or BLACKLISTED_TABLE not in tables:
+            self.stdout.write('Таблиц token_blacklist нет в БД, переносить нечего')
+            return
+
+        # Модели token_blacklist абстрактные, пока приложение не в INSTALLED_APPS, поэтому сырой SQL
+        sql = (
+            f'SELECT o.jti, o.expires_at FROM {BLACKLISTED_TABLE} b '
+            f'JOIN {OUTSTANDING_TABLE} o ON o.id = b.token_id '
+            f'WHERE o.expires_at > %s'
+        )
+        migrated = 0
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [timezone.now()])
+            while rows := cursor.fetchmany(options['batch_size']):
+                for jti, expires_at in rows:
+                    if isinstance(expires_at, str):
+                        expires_at = parse_datetime(expires_at)
+                    if timezone.is_naive(expires_at):
+                        expires_at = timezone.make_aware(expires_at, dt_timezone.utc)
+                    if not options['dry_run']:
+                        blacklist_jti(jti, expires_at.timestamp())
+                    migrated += 1
+
+        elapsed = time.perf_counter() - start
+        action = 'Найдено' if options['dry_run'] else 'Перенесено'
+        self.stdout.write(self.style.SUCCESS(f'{action} {migrated} токенов за {elapsed:.2f} c'))
@@ -0,0 +1,46 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from account.models import User
+from account.utils import user_bloom
+from account.utils.redis_client import get_redis, AUTH_CACHE, auth_cache
+from account.utils.user_bloom import BLOOM_KEY, BLOOM_READY_KEY
+
+
+class Command(BaseCommand):
+    help = 'Заново строит Bloom-фильтр занятых ников и почт (после него фильтру начинают доверять)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            raise CommandError('Bloom-фильтр работает только с django-redis')
+
+        # строим во временном ключе и подменяем атомарно, чтобы проверки не видели полупустой фильтр
+        tmp_key = f'{BLOOM_KEY}:rebuild'
+        redis.delete(auth_cache.make_key(tmp_key))
+
+        start = time.perf_counter()
+        count = 0
+        last_id = User.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        pipe = redis.pipeline(transaction=False)
+        users = User.objects.filter(pk__lte=last_id).values_list('email', 'username')
+        for email, username in users.iterator(chunk_size=options['batch_size']):
+            user_bloom.add(pipe, email, username, key=tmp_key)
+            count += 1
+            if count % options['batch_size'] == 0:
+                pipe.execute()
+        pipe.execute()
+        if count:
+            redis.rename(auth_cache.make_key(tmp_key), auth_cache.make_key(BLOOM_KEY))
+
+        # зарегистрированные во время перестройки попали в старый ключ - докидываем
+        for email, username in User.objects.filter(pk__gt=last_id).values_list('email', 'username'):
+            user_bloom.add(pipe, email, username)
+            count += 1
+        pipe.set(auth_cache.make_key(BLOOM_READY_KEY), 1)
+        pipe.execute()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f'В фильтре {count} пользователей, {elapsed:.1f} c'))
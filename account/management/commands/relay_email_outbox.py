@@ -0,0 +1,79 @@
+import os
+import signal
+import socket
+import time
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from account.tasks import relay_outbox
+from account.utils import email_outbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Relay аутбокса писем с кодами: разбирает email:outbox:<purpose> пачками и отправляет '
+        'по SMTP или задачами Celery, недоставленное повторяет. За проход - одна пачка на назначение, '
+        'коды входа первыми: поток регистраций не задерживает вход. Для полной изоляции - '
+        'отдельный процесс на --purpose. На назначение - только один relay: второй не стартует.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--purpose', nargs='+', choices=list(settings.EMAIL_QUEUES),
+                            default=list(settings.EMAIL_QUEUES), help='какие аутбоксы разбирать')
+        parser.add_argument('--via', choices=['smtp', 'celery'], default='smtp')
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=0.2, help='секунд сна, когда аутбокс пуст')
+        parser.add_argument('--once', action='store_true', help='один проход и выход')
+
+    def handle(self, *args, **options):
+        if not email_outbox.enabled:
+            raise CommandError('Аутбокс выключен: нужен EMAIL_OUTBOX = True и кеш auth на django-redis')
+        # порядок приоритета - как в EMAIL_QUEUES (login первым), а не как в аргументах
+        options['purpose'] = [purpose for purpose in settings.EMAIL_QUEUES if purpose in options['purpose']]
+
+        # :processing у назначения общий: второй relay потерял бы чужую пачку при ack
+        # и отправил бы её повторно при recover, поэтому назначение держит один relay
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.locked = []
+        try:
+            for purpose in options['purpose']:
+                if not email_outbox.lock(purpose, self.owner):
+                    raise CommandError(f'{purpose}: уже разбирает relay {email_outbox.lock_owner(purpose)}')
+                self.locked.append(purpose)
+            self.relay(options)
+        finally:
+            for purpose in self.locked:
+                email_outbox.unlock(purpose, self.owner)
+
+    def relay(self, options):
+        # пачки, которые предыдущий процесс забрал, но не успел отправить
+        for purpose in options['purpose']:
+            if recovered := email_outbox.recover(purpose):
+                self.stdout.write(f'{purpose}: возвращено в очередь {recovered} писем после падения')
+
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while self.running:
+            relayed = 0
+            for purpose in options['purpose']:
+                if not email_outbox.renew(purpose, self.owner):
+                    # лок истёк (relay завис дольше RELAY_LOCK_TTL) - назначение мог забрать другой
+                    self.locked.remove(purpose)
+                    raise CommandError(f'{purpose}: лок relay потерян, выходим')
+                try:
+                    relayed += relay_outbox(purpose, via=options['via'], batch_size=options['batch_size'],
+                                            max_batches=1)
+                except Exception as e:
+                    # пачка уже стоит на повтор, relay продолжает работать
+                    self.stderr.write(f'{purpose}: не отправлено ({e!r}), повтор позже')
+            if options['once']:
+                break
+            if not relayed:
+                time.sleep(options['interval'])
+        for purpose in options['purpose']:
+            self.stdout.write(f'{purpose}: {email_outbox.depth(purpose)}')
+
+    def stop(self, *args):
+        # доотправляем текущую пачку и выходим
+        self.running = False
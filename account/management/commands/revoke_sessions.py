@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from account.models import User, email_ci
+from account.utils import session_registry
+
+
+class Command(BaseCommand):
+    help = 'Выход на всех устройствах за пользователя (смена пароля, компрометация): все его токены перестают работать'
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='+', help='Ники или почты')
+
+    def handle(self, *args, **options):
+        for login in options['users']:
+            user = User.objects.filter(username=login).first() or User.objects.filter(email_ci(login)).first()
+            if user is None:
+                raise CommandError(f'Пользователь {login} не найден')
+            revoked = session_registry.revoke_all(user.pk)
+            self.stdout.write(self.style.SUCCESS(f'{user.username}: отозвано сессий {revoked}, старые токены недействительны'))
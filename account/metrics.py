@@ -0,0 +1,314 @@
+import functools
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Лёгкие метрики в формате Prometheus (без prometheus_client). Пишутся в память процесса,
+# при METRICS_STORE = 'redis' фоновый поток раз в METRICS_FLUSH_INTERVAL сливает приросты
+# в общие hash `metrics:<name>` кеша default, и /metrics любого воркера отдаёт сумму по всем.
+# При 'memory' каждый процесс отдаёт только свои значения - годится для одного процесса.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REGISTRY = []
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs)
+    return '{' + body + '}'
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        metrics_flusher.ensure_started()
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Значение в этом процессе."""
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def snapshot(self) -> dict:
+        """Плоский вид для хранения в hash: поле - JSON значений меток."""
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    def render(self, snapshot=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for field, value in sorted((snapshot if snapshot is not None else self.snapshot()).items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, json.loads(field))} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        metrics_flusher.ensure_started()
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # счётчики по корзинам (+Inf последней), сумма, количество
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        """Число наблюдений в этом процессе."""
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return series[2] if series else 0
+
+    def snapshot(self) -> dict:
+        """Плоский вид для хранения в hash: поле - JSON [значения меток, корзина | sum | count]."""
+        flat = {}
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                for index, bucket_count in enumerate(counts):
+                    flat[json.dumps([key, index])] = bucket_count
+                flat[json.dumps([key, 'sum'])] = total
+                flat[json.dumps([key, 'count'])] = count
+        return flat
+
+    def render(self, snapshot=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        series = {}
+        for field, value in (snapshot if snapshot is not None else self.snapshot()).items():
+            key, part = json.loads(field)
+            item = series.setdefault(tuple(key), {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0})
+            if isinstance(part, int):
+                item['buckets'][part] = _number(value)
+            else:
+                item[part] = _number(value)
+        for key, item in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), item['buckets']):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', bound)])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {item["sum"]}')
+            lines.append(f'{self.name}_count{labels} {item["count"]}')
+        return lines
+
+
+class MetricsFlusher:
+    """
+    Сливает приросты метрик процесса в Redis (METRICS_STORE = 'redis'): HINCRBY/HINCRBYFLOAT
+    в `metrics:<name>` одним pipeline. Фоновый поток - один на процесс, после fork
+    поднимается заново. Не долетевшее из-за ошибки Redis уйдёт следующим сбросом;
+    при остановке воркера теряется не больше METRICS_FLUSH_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+        self._flushed = {}
+
+    @property
+    def enabled(self) -> bool:
+        return getattr(settings, 'METRICS_STORE', 'memory') == 'redis'
+
+    def key(self, metric) -> str:
+        from django.core.cache import cache
+        return cache.make_key(f'metrics:{metric.name}')
+
+    def ensure_started(self):
+        if self._pid == os.getpid() or not self.enabled:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # унаследованные после fork значения сливает сам родитель, здесь - только приросты
+            self._flushed = {id(metric): metric.snapshot() for metric in REGISTRY}
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.warning('Метрики не слиты в Redis, повтор через %s с', settings.METRICS_FLUSH_INTERVAL,
+                               exc_info=True)
+
+    def flush(self):
+        from account.utils.redis_client import get_redis
+        redis = get_redis()
+        if redis is None:
+            return
+        with self._lock:
+            pipe = redis.pipeline(transaction=False)
+            snapshots = {}
+            for metric in REGISTRY:
+                snapshot = snapshots[id(metric)] = metric.snapshot()
+                flushed = self._flushed.get(id(metric), {})
+                for field, value in snapshot.items():
+                    delta = value - flushed.get(field, 0)
+                    if not delta:
+                        continue
+                    if isinstance(delta, int):
+                        pipe.hincrby(self.key(metric), field, delta)
+                    else:
+                        pipe.hincrbyfloat(self.key(metric), field, delta)
+            pipe.execute()
+            self._flushed = snapshots
+
+    def read(self) -> dict:
+        """Суммы по всем процессам: id метрики -> плоский snapshot."""
+        from account.utils.redis_client import get_redis
+        pipe = get_redis().pipeline(transaction=False)
+        for metric in REGISTRY:
+            pipe.hgetall(self.key(metric))
+        return {
+            id(metric): {field.decode(): value for field, value in values.items()}
+            for metric, values in zip(REGISTRY, pipe.execute())
+        }
+
+
+metrics_flusher = MetricsFlusher()
+
+
+stage_duration = Histogram(
+    'auth_stage_duration_seconds', 'Длительность этапов auth-flow', ['stage'],
+)
+stage_errors = Counter(
+    'auth_stage_errors_total', 'Исключения на этапах auth-flow', ['stage'],
+)
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Длительность запросов по вьюхам', ['view', 'method', 'status'],
+)
+# hit - ответили из памяти без Redis, miss - пошли в Redis, bypass - подписка не поднята
+flow_local_cache_reads = Counter(
+    'auth_flow_local_cache_total', 'Чтения состояния flow через кеш в памяти процесса', ['flow', 'result'],
+)
+
+
+class timed:
+    """
+    Замер этапа: `with timed('redis_otp_verify'):` или декоратор `@timed('jwt_sign')`
+    (в том числе для async-функций). Пишет в auth_stage_duration_seconds{stage}.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_duration.observe(time.perf_counter() - self._start, stage=self.stage)
+        if exc_type is not None:
+            stage_errors.inc(stage=self.stage)
+        return False
+
+    def __call__(self, func):
+        if iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timed(self.stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def render_metrics() -> str:
+    lines = []
+    snapshots = {}
+    if metrics_flusher.enabled:
+        # свои приросты - сразу, чтобы ответ не отставал хотя бы по этому воркеру
+        try:
+            metrics_flusher.flush()
+            snapshots = metrics_flusher.read()
+        except Exception:
+            logger.warning('Метрики из Redis недоступны, отдаём значения процесса', exc_info=True)
+    for metric in REGISTRY:
+        lines.extend(metric.render(snapshots.get(id(metric))))
+
+    # счётчики доставки писем общие для всех воркеров и лежат в Redis (email:stats)
+    from account.tasks import email_stats
+    try:
+        stats = email_stats()
+    except Exception:
+        stats = {}
+    for name, value in sorted(stats.items()):
+        metric = f'auth_email_{name}_total'
+        lines += [f'# TYPE {metric} counter', f'{metric} {value}']
+
+    # глубина аутбокса: растущий pending - relay не успевает или лежит
+    from account.utils import email_outbox
+    if email_outbox.enabled:
+        lines.append('# TYPE auth_email_outbox gauge')
+        try:
+            for purpose in settings.EMAIL_QUEUES:
+                for state, value in email_outbox.depth(purpose).items():
+                    lines.append(f'auth_email_outbox{{purpose="{purpose}",state="{state}"}} {value}')
+        except Exception:
+            pass
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_allowed(request) -> bool:
+    """Доступ к /metrics: адрес из METRICS_ALLOWED_IPS или `Authorization: Bearer <METRICS_TOKEN>`."""
+    token = settings.METRICS_TOKEN
+    header = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in settings.METRICS_ALLOWED_IPS)
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
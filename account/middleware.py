@@ -0,0 +1,41 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from account.metrics import request_duration
+
+
+class MetricsMiddleware:
+    """
+    Время каждого запроса в http_request_duration_seconds{view, method, status}.
+    Умеет и sync, и async: async-вьюхи под ASGI не уходят из-за него в поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    def observe(self, request, response, start):
+        # имя маршрута, а не путь: id и токены в URL не раздувают число серий
+        match = request.resolver_match
+        request_duration.observe(
+            time.perf_counter() - start,
+            view=match.view_name if match else 'unmatched',
+            method=request.method,
+            status=str(response.status_code),
+        )
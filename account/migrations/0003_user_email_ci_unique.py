@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:18
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def check_email_duplicates(apps, schema_editor):
+    # До индекса почта не была уникальной: дубли без учёта регистра сломали бы AddConstraint
+    # невнятной ошибкой БД. Какой из аккаунтов оставить, решает человек, поэтому только сообщаем.
+    User = apps.get_model('account', 'User')
+    duplicates = (
+        User.objects.exclude(email='')
+        .values(email_lower=django.db.models.functions.text.Lower('email'))
+        .annotate(count=models.Count('id'))
+        .filter(count__gt=1)
+        .values_list('email_lower', flat=True)
+    )
+    duplicates = list(duplicates[:20])
+    if duplicates:
+        raise RuntimeError(
+            'Почта без учёта регистра повторяется у нескольких пользователей, '
+            'объедините или переименуйте их и повторите migrate: ' + ', '.join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0002_user_bio'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_email_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), condition=models.Q(('email', ''), _negated=True), name='user_email_ci_unique'),
+        ),
+    ]
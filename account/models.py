@@ -1,5 +1,30 @@
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact, In
 from django.contrib.auth.models import AbstractUser
 
+
+def email_ci(email: str) -> Q:
+    """
+    Поиск по почте без учёта регистра через индекс user_email_ci_unique: LOWER("email") = ...
+    Индекс частичный: SQLite и Postgres берут его, только если WHERE включает его условие email <> ''.
+    """
+    return Q(Exact(Lower('email'), email.lower())) & ~Q(email='')
+
+
+def emails_ci(emails) -> Q:
+    """То же для списка: LOWER("email") IN (...)."""
+    return Q(In(Lower('email'), [email.lower() for email in emails])) & ~Q(email='')
+
+
 class User(AbstractUser):
     bio = models.CharField(max_length=100, blank=True, null=True)
+
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Почта уникальна без учёта регистра; пустые (например у createsuperuser) не считаем
+            models.UniqueConstraint(
+                Lower('email'), name='user_email_ci_unique', condition=~Q(email=''),
+            ),
+        ]
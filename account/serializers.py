@@ -1,5 +1,12 @@
 from rest_framework import serializers
-from account.models import User
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer as BaseTokenObtainPairSerializer,
+    TokenRefreshSerializer as BaseTokenRefreshSerializer,
+)
+from django.db.models import Q
+from account.models import User, email_ci
+from account.utils import user_bloom
+from account.tokens import RefreshToken
 
 
 class PasswordSerializer(serializers.ModelSerializer):
@@ -27,16 +34,43 @@ class EmailCodeSerializer(serializers.Serializer):
             raise serializers.ValidationError("Неверная длина кода")
         return data
 
+def _raise_if_taken(rows, email: str, username: str) -> None:
+    rows = list(rows)
+    if any(row_email.lower() == email.lower() for row_email, _ in rows):
+        raise serializers.ValidationError("Эта почта уже используется")
+    if any(row_username == username for _, row_username in rows):
+        raise serializers.ValidationError("Этот ник уже используется")
+
+
+def _taken_query(email: str, username: str):
+    # один запрос по двум уникальным индексам: LOWER(email) и username
+    return User.objects.filter(
+        email_ci(email) | Q(username=username)
+    ).values_list('email', 'username')[:2]
+
+
+def check_availability(email: str, username: str) -> None:
+    # Bloom-фильтр в Redis: заведомо свободные ник и почта не доходят до БД
+    if not user_bloom.might_contain(email=email, username=username):
+        return
+    _raise_if_taken(_taken_query(email, username), email, username)
+
+
+async def acheck_availability(email: str, username: str) -> None:
+    if not await user_bloom.amight_contain(email=email, username=username):
+        return
+    _raise_if_taken([row async for row in _taken_query(email, username)], email, username)
+
+
 class UsernameEmailSerializer(serializers.Serializer):
     username = serializers.CharField(write_only=True)
     email = serializers.EmailField(write_only=True)
     
     def validate(self, data):
         # Проверка на существования аккаунта с таким email и username
-        if User.objects.filter(email=data['email']).exists():
-            raise serializers.ValidationError("Эта почта уже используется")
-        if User.objects.filter(username=data['username']).exists():
-            raise serializers.ValidationError("Этот ник уже используется")
+        # (async-вьюхи передают check_availability=False и делают её сами через acheck_availability)
+        if self.context.get('check_availability', True):
+            check_availability(data['email'], data['username'])
         
         # Проверка на длину ника
         if len(data['username']) < 3:
@@ -60,4 +94,13 @@ class UserSerializer(serializers.ModelSerializer):
         fields = (
             'username',
             'bio',
-        )
\ No newline at end of file
+        )
+
+
+# simplejwt-сериализаторы на нашем RefreshToken (blacklist в Redis)
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    token_class = RefreshToken
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    token_class = RefreshToken
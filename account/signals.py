@@ -0,0 +1,41 @@
+import logging
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from account.models import User
+from account.utils import user_cache, user_bloom, cache_profile, invalidate_profile
+
+logger = logging.getLogger(__name__)
+
+
+def after_commit(action, *args):
+    """
+    Запись в Redis после коммита и без права уронить сохранение: кеш и Bloom-фильтр -
+    не источник истины, а строка в БД к этому моменту уже есть. Ошибку только пишем в лог.
+    """
+    def run():
+        try:
+            action(*args)
+        except Exception:
+            logger.warning('%s для пользователя не выполнено', action.__name__, exc_info=True)
+    transaction.on_commit(run)
+
+
+# Сбрасываем кеш пользователя (JWT-аутентификация, публичный профиль) при любом изменении
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+    after_commit(invalidate_profile, instance.pk)
+
+
+# После коммита кладём свежий профиль в кеш: следующий промах не прочитает отстающую реплику
+@receiver(post_save, sender=User)
+def cache_saved_profile(sender, instance, **kwargs):
+    after_commit(cache_profile, instance)
+
+
+# Новые ник и почта попадают в Bloom-фильтр занятых; пропущенные догонит rebuild_user_bloom
+@receiver(post_save, sender=User)
+def add_user_to_bloom(sender, instance, **kwargs):
+    after_commit(user_bloom.add_user, instance.email, instance.username)
@@ -1,21 +1,245 @@
+import json
+import time
+from smtplib import SMTPServerDisconnected
+from asgiref.sync import sync_to_async
 from celery import shared_task
-from django.core.mail import send_mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
+from account.metrics import timed
+from account.utils.auth_utils import EMAIL_CODE_TTL, set_code_in_redis, aset_code_in_redis
+from account.utils.email_outbox import email_outbox
+from account.utils.redis_client import get_redis
 
-@shared_task
-def send_code_to_email(email: str, code: int) -> None:
-    print(f' КОД ==============================={code}')
+PENDING_EMAILS_KEY = 'email:pending'
+FLUSH_SCHEDULED_KEY = 'email:flush_scheduled'
+EMAIL_STATS_KEY = 'email:stats'
+
+# SMTP-соединение живёт в процессе воркера и переиспользуется между пачками
+_connection = None
+
+
+def build_code_email(email: str, code) -> EmailMessage:
     subject = "Обнаружен вход"
     message = (
         f"Ваш код подтверждения: {code}\n\n"
         "Если вы не пытались войти в аккаунт, мы рекомендуем сменить пароль как можно скорее."
     )
-    from_email = settings.DEFAULT_FROM_EMAIL
-
-    send_mail(
-        subject,
-        message,
-        from_email,
-        [email],
-        fail_silently=False,
-    )
\ No newline at end of file
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [email])
+
+
+class SendError(Exception):
+    """Отправка оборвалась; sent - сколько писем из начала пачки уже ушло."""
+
+    def __init__(self, sent: int):
+        super().__init__(f'отправлено {sent}')
+        self.sent = sent
+
+
+class DeliveryError(Exception):
+    """deliver не отправил пачку целиком; unsent - записи, письма по которым не ушли."""
+
+    def __init__(self, unsent: list):
+        super().__init__(f'не отправлено {len(unsent)}')
+        self.unsent = unsent
+
+
+def send_messages(messages) -> int:
+    """
+    Письма по одному в рамках одного SMTP-соединения: при ошибке известно, сколько
+    уже ушло (SendError.sent), и повтор не отправит их второй раз.
+    """
+    global _connection
+    sent = 0
+    reconnected = False
+    try:
+        if _connection is None:
+            _connection = get_connection(fail_silently=False)
+            _connection.open()
+        for message in messages:
+            try:
+                sent += _connection.send_messages([message])
+            except SMTPServerDisconnected:
+                if reconnected:
+                    raise
+                # сервер закрыл простаивающее соединение - переподключаемся один раз
+                reconnected = True
+                _connection.close()
+                _connection.open()
+                sent += _connection.send_messages([message])
+    except Exception as e:
+        if _connection is not None:
+            _connection.close()
+        _connection = None
+        raise SendError(sent) from e
+    return sent
+
+
+def email_stats() -> dict:
+    """Счётчики доставки, общие для всех воркеров: sent, failed, expired, batches, send_seconds."""
+    redis = get_redis()
+    if redis is None:
+        return {}
+    stats = redis.hgetall(cache.make_key(EMAIL_STATS_KEY))
+    return {k.decode(): float(v) for k, v in stats.items()}
+
+
+def deliver(items) -> int:
+    """
+    Отправляет пачку {email, code, expires_at} одним SMTP-соединением, истёкшие коды пропускает.
+    Ошибка отправки - DeliveryError с неотправленным остатком: что с ним делать, решает вызывающий.
+    """
+    now = time.time()
+    live = [item for item in items if item['expires_at'] > now]
+    redis = get_redis()
+    stats_key = cache.make_key(EMAIL_STATS_KEY)
+    if redis is not None and len(live) < len(items):
+        # код уже истёк - письмо с ним бесполезно
+        redis.hincrby(stats_key, 'expired', len(items) - len(live))
+    if not live:
+        return 0
+    start = time.perf_counter()
+    try:
+        sent = send_messages([build_code_email(item['email'], item['code']) for item in live])
+        error = None
+    except SendError as e:
+        sent, error = e.sent, e
+    if redis is not None:
+        pipe = redis.pipeline()
+        pipe.hincrby(stats_key, 'sent', sent)
+        pipe.hincrby(stats_key, 'batches', 1)
+        pipe.hincrbyfloat(stats_key, 'send_seconds', time.perf_counter() - start)
+        pipe.execute()
+    if error is not None:
+        raise DeliveryError(live[sent:]) from error
+    return sent
+
+
+def email_queue(purpose: str) -> str:
+    # коды входа и регистрации идут в разные очереди, чтобы наплыв регистраций не задерживал вход
+    return settings.EMAIL_QUEUES[purpose]
+
+
+def send_code(email: str, purpose: str = 'login') -> str:
+    """
+    Новый код и письмо с ним. С аутбоксом письмо ложится в Redis тем же вызовом, что и код,
+    и запрос не зависит от брокера; без него (EMAIL_OUTBOX = False, нет Redis) - задача в Celery.
+    """
+    if email_outbox.enabled:
+        return set_code_in_redis(email, purpose=purpose)
+    code = set_code_in_redis(email)
+    queue_code_email(email, code, purpose=purpose)
+    return code
+
+
+async def asend_code(email: str, purpose: str = 'login') -> str:
+    if email_outbox.enabled:
+        return await aset_code_in_redis(email, purpose=purpose)
+    code = await aset_code_in_redis(email)
+    # публикация в брокер блокирующая - в отдельном потоке
+    await sync_to_async(queue_code_email, thread_sensitive=False)(email, code, purpose=purpose)
+    return code
+
+
+@timed('celery_publish')
+def queue_code_email(email: str, code, purpose: str = 'login') -> None:
+    """
+    Ставит отправку кода в очередь своего назначения. Задача живёт не дольше кода:
+    если воркер не успел взять её за EMAIL_CODE_TTL, Celery её отбросит.
+    """
+    expires_at = time.time() + EMAIL_CODE_TTL
+    send_code_to_email.apply_async(
+        (email, code),
+        {'purpose': purpose, 'expires_at': expires_at},
+        queue=email_queue(purpose),
+        expires=EMAIL_CODE_TTL,
+    )
+
+
+@shared_task
+def send_code_to_email(email: str, code: int, purpose: str = 'login', expires_at: float = None) -> None:
+    print(f' КОД ==============================={code}')
+    redis = get_redis()
+    if redis is None:
+        send_messages([build_code_email(email, code)])
+        return
+
+    # Копим письма в очереди назначения и отправляем пачкой по одному SMTP-соединению:
+    # либо когда набралось EMAIL_BATCH_SIZE, либо через EMAIL_BATCH_WINDOW секунд
+    if expires_at is None:
+        expires_at = time.time() + EMAIL_CODE_TTL
+    item = json.dumps({'email': email, 'code': code, 'expires_at': expires_at})
+    pending = redis.rpush(cache.make_key(f'{PENDING_EMAILS_KEY}:{purpose}'), item)
+    if pending >= settings.EMAIL_BATCH_SIZE:
+        flush_pending_emails(purpose)
+    elif redis.set(cache.make_key(f'{FLUSH_SCHEDULED_KEY}:{purpose}'), 1, nx=True, ex=settings.EMAIL_BATCH_WINDOW):
+        flush_pending_emails.apply_async(
+            (purpose,), queue=email_queue(purpose), countdown=settings.EMAIL_BATCH_WINDOW
+        )
+
+
+@shared_task
+def flush_pending_emails(purpose: str = 'login') -> int:
+    redis = get_redis()
+    if redis is None:
+        return 0
+    key = cache.make_key(f'{PENDING_EMAILS_KEY}:{purpose}')
+    stats_key = cache.make_key(EMAIL_STATS_KEY)
+    redis.delete(cache.make_key(f'{FLUSH_SCHEDULED_KEY}:{purpose}'))
+
+    sent = 0
+    while batch := redis.lpop(key, settings.EMAIL_BATCH_SIZE):
+        items = [json.loads(item) for item in batch]
+        try:
+            sent += deliver(items)
+        except Exception as e:
+            # неотправленное - в начало очереди, следующий flush попробует снова; ушедшее не повторяем
+            unsent = e.unsent if isinstance(e, DeliveryError) else items
+            if unsent:
+                redis.lpush(key, *(json.dumps(item) for item in reversed(unsent)))
+            redis.hincrby(stats_key, 'failed', len(unsent))
+            flush_pending_emails.apply_async(
+                (purpose,), queue=email_queue(purpose), countdown=settings.EMAIL_BATCH_WINDOW
+            )
+            raise
+    return sent
+
+
+@shared_task(bind=True, max_retries=3)
+def send_email_batch(self, items) -> int:
+    # пачка из аутбокса при relay_email_outbox --via celery; истёкшие коды deliver отбросит сам
+    try:
+        return deliver(items)
+    except Exception as e:
+        # повторяем только то, что не ушло
+        unsent = e.unsent if isinstance(e, DeliveryError) else items
+        raise self.retry(args=(unsent,), exc=e, countdown=2 ** self.request.retries)
+
+
+def relay_outbox(purpose: str, via: str = 'smtp', batch_size: int = None, max_batches: int = None) -> int:
+    """
+    Один проход relay по аутбоксу назначения: повторы, которым пора, - обратно в очередь,
+    затем до max_batches пачек (None - до опустошения). via='smtp' - отправка прямо отсюда,
+    via='celery' - одна задача send_email_batch на пачку. Возвращает, сколько писем обработано.
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    email_outbox.promote_retries(purpose, batch_size)
+    relayed = batches = 0
+    while (max_batches is None or batches < max_batches) and (items := email_outbox.claim(purpose, batch_size)):
+        batches += 1
+        try:
+            if via == 'celery':
+                send_email_batch.apply_async((items,), queue=email_queue(purpose), expires=EMAIL_CODE_TTL)
+            else:
+                deliver(items)
+        except Exception as e:
+            # брокер или SMTP недоступны: неотправленное - на повтор с задержкой, проход заканчиваем
+            unsent = e.unsent if isinstance(e, DeliveryError) else items
+            email_outbox.retry(purpose, unsent)
+            redis = get_redis()
+            if redis is not None:
+                redis.hincrby(cache.make_key(EMAIL_STATS_KEY), 'failed', len(unsent))
+            raise
+        email_outbox.ack(purpose)
+        relayed += len(items)
+    return relayed
@@ -1,3 +1,800 @@
-from django.test import TestCase
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import jwt
+from aiosmtpd.controller import Controller
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+
+from account.async_views import AsyncCheckAuthView, AsyncLoginCodeView, AsyncLoginView, AsyncTokenRefreshView
+from account.authentication import ClientJWTAuthentication
+from account.exceptions import ServiceOverloaded
+from account.issuance import TokenPair
+from account.metrics import metrics_flusher, metrics_view, render_metrics, stage_errors
+from account.models import User, email_ci, emails_ci
+from account.serializers import _taken_query
+from account.tasks import auth_tasks
+from account.throttling import SlidingWindowThrottle
+from account.tokens import AccessToken, RefreshToken
+from account.utils import FlowState, get_profile, get_profiles, login_flow, user_bloom
+from account.utils.auth_utils import EMAIL_CODE_MAX_ATTEMPTS, otp_store
+from account.utils.email_outbox import email_outbox
+from account.utils.flow_cache import FlowLocalCache
+from account.utils.jwt_keys import get_token_backend
+from account.utils.openapi_schema import load_schema_artifact, write_schema_artifact
+from account.utils.password_hashing import PasswordHashingExecutor
+from account.utils.otp_store import NO_CODE, VERIFIED, WRONG_CODE
+from account.utils.profile_cache import profile_key
+from account.utils.redis_client import AUTH_CACHE, auth_cache, get_redis
+from account.utils.session_registry import session_registry
+from account.utils.user_bloom import BLOOM_READY_KEY
+
+# django-redis поверх fakeredis, базы как в настройках проекта (см. bench_lifecycle --fake-redis)
+FAKE_REDIS_CACHES = {
+    alias: {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f'redis://localhost:6379/{db}',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.FakeConnection},
+            # та же фейковая база для redis.asyncio-клиента async-вьюх
+            'ASYNC_CONNECTION_CLASS': 'fakeredis.aioredis.FakeConnection',
+            'SERIALIZER': 'account.utils.cache_serializers.CompactJSONSerializer',
+        },
+    }
+    for alias, db in (('default', 0), (AUTH_CACHE, 1))
+}
+
+
+class FakeRedisMixin:
+    def setUp(self):
+        super().setUp()
+        override = override_settings(CACHES=FAKE_REDIS_CACHES)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.redis = get_redis(AUTH_CACHE)
+        self.redis_default = get_redis()
+        self.redis.flushall()
+
+
+class OtpStoreTests(FakeRedisMixin, SimpleTestCase):
+    email = 'user@example.com'
+
+    def test_verify_deletes_code(self):
+        otp_store.set(self.email, '123456')
+        self.assertEqual(otp_store.verify(self.email, '123456'), VERIFIED)
+        self.assertFalse(self.redis.exists(otp_store.key(self.email)))
+
+    def test_second_verify_after_success(self):
+        otp_store.set(self.email, '123456')
+        otp_store.verify(self.email, '123456')
+        self.assertEqual(otp_store.verify(self.email, '123456'), NO_CODE)
+
+    def test_wrong_code_counts_attempts_and_burns(self):
+        otp_store.set(self.email, '123456')
+        for attempt in range(1, EMAIL_CODE_MAX_ATTEMPTS):
+            self.assertEqual(otp_store.verify(self.email, '000000'), WRONG_CODE)
+            self.assertEqual(int(self.redis.hget(otp_store.key(self.email), 'attempts')), attempt)
+        # последняя попытка сжигает код, дальше не помогает и верный
+        self.assertEqual(otp_store.verify(self.email, '000000'), NO_CODE)
+        self.assertFalse(self.redis.exists(otp_store.key(self.email)))
+        self.assertEqual(otp_store.verify(self.email, '123456'), NO_CODE)
+
+    async def test_async_verify_shares_attempt_counter(self):
+        otp_store.set(self.email, '123456')
+        for _ in range(EMAIL_CODE_MAX_ATTEMPTS - 2):
+            otp_store.verify(self.email, '000000')
+        # sync и async вьюхи считают попытки в одном hash тем же скриптом
+        self.assertEqual(await otp_store.averify(self.email, '000000'), WRONG_CODE)
+        self.assertEqual(int(self.redis.hget(otp_store.key(self.email), 'attempts')), EMAIL_CODE_MAX_ATTEMPTS - 1)
+        self.assertEqual(await otp_store.averify(self.email, '000000'), NO_CODE)
+        self.assertEqual(await otp_store.averify(self.email, '123456'), NO_CODE)
+
+    def test_login_rejects_right_code_after_lockout(self):
+        otp_store.set(self.email, '123456')
+        for _ in range(EMAIL_CODE_MAX_ATTEMPTS):
+            otp_store.verify(self.email, '000000')
+        login_token = login_flow.create({'email': self.email})
+        response = self.client.post('/api/login/verification/', {'login_token': login_token, 'code': '123456'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['message'], 'Неверный код')
+
+    def test_new_code_resets_attempts(self):
+        otp_store.set(self.email, '123456')
+        otp_store.verify(self.email, '000000')
+        otp_store.set(self.email, '654321')
+        self.assertEqual(self.redis.hget(otp_store.key(self.email), 'attempts'), b'0')
+        self.assertEqual(otp_store.verify(self.email, '654321'), VERIFIED)
+
+    def test_ttl(self):
+        otp_store.set(self.email, '123456')
+        ttl = self.redis.ttl(otp_store.key(self.email))
+        self.assertTrue(0 < ttl <= otp_store.ttl)
+
+    def test_outbox_push_in_same_call(self):
+        outbox = ('email:outbox:test', '{"code": "123456"}')
+        with mock.patch.object(self.redis, 'evalsha', wraps=self.redis.evalsha) as evalsha:
+            otp_store.set(self.email, '123456', outbox=outbox)
+        # код и письмо - один EVALSHA с обоими ключами
+        self.assertEqual(evalsha.call_count, 1)
+        self.assertEqual(evalsha.call_args.args[1:4], (2, otp_store.key(self.email), outbox[0]))
+        self.assertEqual(self.redis.lrange(outbox[0], 0, -1), [outbox[1].encode()])
+        self.assertEqual(self.redis.hget(otp_store.key(self.email), 'code'), b'123456')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RecordingHandler:
+    """aiosmtpd-обработчик: запоминает письма и SMTP-сессии, на адрес из reject отвечает 554."""
+
+    def __init__(self, reject=()):
+        self.reject = set(reject)
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reject & set(envelope.rcpt_tos):
+            return '554 Rejected'
+        self.sessions.add(id(session))
+        self.messages.extend(envelope.rcpt_tos)
+        return '250 OK'
+
+
+@override_settings(EMAIL_BATCH_SIZE=5)
+class EmailBatchTests(FakeRedisMixin, SimpleTestCase):
+    def start_smtp(self, **kwargs):
+        handler = RecordingHandler(**kwargs)
+        controller = Controller(handler, hostname='127.0.0.1', port=free_port())
+        controller.start()
+        self.addCleanup(controller.stop)
+        override = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=controller.port,
+            EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        return handler
+
+    def setUp(self):
+        super().setUp()
+        # SMTP-соединение процесса от прошлого теста не переиспользуем
+        auth_tasks._connection = None
+        self.addCleanup(self.close_connection)
+        # отложенный flush не ставим в брокер - вызываем его сами
+        patcher = mock.patch.object(auth_tasks.flush_pending_emails, 'apply_async')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def close_connection(self):
+        if auth_tasks._connection is not None:
+            auth_tasks._connection.close()
+        auth_tasks._connection = None
+
+    def test_batch_goes_over_one_session(self):
+        handler = self.start_smtp()
+        emails = [f'user{i}@example.com' for i in range(12)]
+        for email in emails:
+            auth_tasks.send_code_to_email(email, '123456')
+        # 10 ушли двумя полными пачками, остаток - отложенным flush
+        self.assertEqual(len(handler.messages), 10)
+        auth_tasks.flush_pending_emails('login')
+
+        self.assertEqual(sorted(handler.messages), sorted(emails))
+        self.assertEqual(len(handler.sessions), 1)
+        stats = auth_tasks.email_stats()
+        self.assertEqual(stats['sent'], 12)
+        self.assertEqual(stats['batches'], 3)
+
+    def test_failed_send_requeues_only_unsent(self):
+        handler = self.start_smtp(reject={'bad@example.com'})
+        emails = ['a@example.com', 'b@example.com', 'bad@example.com', 'c@example.com']
+        for email in emails:
+            auth_tasks.send_code_to_email(email, '123456')
+        with self.assertRaises(auth_tasks.DeliveryError):
+            auth_tasks.flush_pending_emails('login')
+
+        self.assertEqual(handler.messages, emails[:2])
+        pending_key = auth_tasks.cache.make_key(f'{auth_tasks.PENDING_EMAILS_KEY}:login')
+        pending = self.redis_default.lrange(pending_key, 0, -1)
+        self.assertEqual([json.loads(item)['email'] for item in pending], emails[2:])
+        stats = auth_tasks.email_stats()
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(stats['failed'], 2)
+
+
+@override_settings(EMAIL_OUTBOX=True)
+class RelayFairnessTests(FakeRedisMixin, SimpleTestCase):
+    def fill(self, purpose, count):
+        key = email_outbox.key(purpose)
+        for i in range(count):
+            self.redis.rpush(key, email_outbox.entry(f'{purpose}{i}@example.com', '123456', purpose, 300)[1])
+
+    def test_registration_flood_does_not_starve_login(self):
+        self.fill('registration', 20)
+        self.fill('login', 3)
+        with mock.patch.object(auth_tasks.send_email_batch, 'apply_async') as apply_async:
+            call_command('relay_email_outbox', '--once', '--via', 'celery', '--batch-size', '5',
+                         '--purpose', 'registration', 'login', stdout=io.StringIO())
+        # за проход - одна пачка на назначение, login первым
+        self.assertEqual(apply_async.call_args_list[0].kwargs['queue'], auth_tasks.email_queue('login'))
+        self.assertEqual(email_outbox.depth('login')['pending'], 0)
+        self.assertEqual(email_outbox.depth('registration')['pending'], 15)
+        # лок отпущен после выхода
+        self.assertIsNone(email_outbox.lock_owner('login'))
+
+    def test_second_relay_for_purpose_fails_fast(self):
+        self.fill('login', 3)
+        email_outbox.lock('login', 'other-relay')
+        email_outbox.claim('login', 2)
+        with self.assertRaisesMessage(CommandError, 'other-relay'):
+            call_command('relay_email_outbox', '--once', '--purpose', 'login', stdout=io.StringIO())
+        # чужую пачку в работе не трогаем: ни recover, ни ack
+        self.assertEqual(email_outbox.depth('login')['processing'], 2)
+        self.assertEqual(email_outbox.lock_owner('login'), 'other-relay')
+
+
+class EmailLookupTests(FakeRedisMixin, TestCase):
+    def test_case_insensitive_lookup(self):
+        User.objects.create(username='mixed', email='Mixed@Example.com')
+        self.assertEqual(User.objects.get(email_ci('mixed@example.COM')).username, 'mixed')
+
+    def test_lookups_use_partial_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('план запроса проверяем на SQLite')
+        self.assertIn('user_email_ci_unique', User.objects.filter(email_ci('a@example.com')).explain())
+        self.assertIn('user_email_ci_unique', _taken_query('a@example.com', 'someone').explain())
+        self.assertIn('user_email_ci_unique', User.objects.filter(emails_ci(['A@example.com', 'b@x.io'])).explain())
+
+    def test_no_project_wide_lower_lookup(self):
+        # __lower не регистрируется на всех CharField проекта как побочный эффект импорта
+        from django.db.models import CharField
+        self.assertNotIn('lower', CharField.get_lookups())
+
+
+class UserSignalTests(TestCase):
+    def test_save_survives_redis_outage(self):
+        down = {
+            alias: {**FAKE_REDIS_CACHES[alias], 'LOCATION': f'redis://127.0.0.1:{free_port()}/0', 'OPTIONS': {}}
+            for alias in FAKE_REDIS_CACHES
+        }
+        with override_settings(CACHES=down), self.assertLogs('account.signals', 'WARNING'):
+            with self.captureOnCommitCallbacks(execute=True):
+                user = User.objects.create(username='offline', email='offline@example.com')
+        self.assertTrue(User.objects.filter(pk=user.pk).exists())
+
+    def test_bloom_updated_after_commit(self):
+        with override_settings(CACHES=FAKE_REDIS_CACHES):
+            get_redis(AUTH_CACHE).flushall()
+            auth_cache.set(BLOOM_READY_KEY, 1)
+            with self.captureOnCommitCallbacks() as callbacks:
+                User.objects.create(username='fresh', email='fresh@example.com')
+            self.assertFalse(user_bloom.might_contain(username='fresh'))
+            for callback in callbacks:
+                callback()
+            self.assertTrue(user_bloom.might_contain(username='fresh'))
+
+
+class ThrottleIdentTests(SimpleTestCase):
+    def test_forwarded_for_is_not_trusted_without_proxies(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.2.3.4')
+        self.assertEqual(SlidingWindowThrottle().get_identities(request, None), [('ip', '10.0.0.1')])
+
+    def test_forwarded_for_behind_one_proxy(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 1.2.3.4')
+        with mock.patch('rest_framework.throttling.api_settings.NUM_PROXIES', 1):
+            self.assertEqual(SlidingWindowThrottle().get_identities(request, None), [('ip', '1.2.3.4')])
+
+
+class TokenThrottle(SlidingWindowThrottle):
+    # лимит otp_token (5/min) на один фиксированный ключ
+    scope = 'otp'
+
+    def get_identities(self, request, view):
+        return [('token', 'flow')]
+
+
+class SlidingWindowTests(FakeRedisMixin, SimpleTestCase):
+    start = 1_700_000_000
+
+    def setUp(self):
+        super().setUp()
+        self.now = self.start
+        # часы подменяем только лимитеру: TTL в fakeredis идут по настоящему времени
+        clock = mock.patch('account.throttling.time')
+        clock.start().time.side_effect = lambda: self.now
+        self.addCleanup(clock.stop)
+
+    def allow(self, at):
+        self.now = self.start + at
+        throttle = TokenThrottle()
+        return throttle.allow_request(RequestFactory().post('/'), None), throttle.wait()
+
+    def test_window_boundary(self):
+        for at in range(5):
+            self.assertEqual(self.allow(at), (True, None))
+        # шестой ждёт, пока из окна не выйдет самый старый (t=0)
+        self.assertEqual(self.allow(10), (False, 50.0))
+        self.assertEqual(self.allow(59.999), (False, 0.001))
+        # отклонённые запросы в окно не попадают
+        self.assertEqual(self.redis.zcard(auth_cache.make_key('throttle:otp:token:flow')), 5)
+        self.assertEqual(self.allow(60), (True, None))
+        self.assertEqual(self.allow(60.5), (False, 0.5))
+
+    def test_retry_after_rounds_up(self):
+        data = {'login_token': 'flow', 'code': '123456'}
+        for _ in range(5):
+            self.assertEqual(self.client.post('/api/login/verification/', data).status_code, 403)
+        self.now = self.start + 1.5
+        response = self.client.post('/api/login/verification/', data)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '59')
+
+    async def test_async_retry_after(self):
+        factory = AsyncRequestFactory()
+        data = {'login_token': 'flow', 'code': '123456'}
+        for _ in range(5):
+            response = await AsyncLoginCodeView.as_view()(factory.post('/', data, content_type='application/json'))
+            self.assertEqual(response.status_code, 403)
+        self.now = self.start + 1.5
+        response = await AsyncLoginCodeView.as_view()(factory.post('/', data, content_type='application/json'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '59')
+
+
+class AuditAuthKeysTests(FakeRedisMixin, SimpleTestCase):
+    def test_legacy_keys_in_default_alias(self):
+        # до переезда на алиас auth flow лежали pickle-строкой без TTL в default (db 0)
+        legacy = auth_tasks.cache.make_key('reg:legacy')
+        self.redis_default.set(legacy, b'pickle')
+        out = io.StringIO()
+        call_command('audit_auth_keys', '--expire', stdout=out)
+        self.assertIn('TTL выставлен 1 ключам', out.getvalue())
+        self.assertGreater(self.redis_default.ttl(legacy), 0)
+
+
+@override_settings(METRICS_STORE='redis', METRICS_FLUSH_INTERVAL=3600)
+class MetricsStoreTests(FakeRedisMixin, SimpleTestCase):
+    def test_flush_sends_deltas_and_render_sums_workers(self):
+        metrics_flusher.flush()
+        self.redis_default.flushall()
+        stage_errors.inc(stage='test_stage')
+        metrics_flusher.flush()
+        stage_errors.inc(stage='test_stage')
+        metrics_flusher.flush()
+        key = metrics_flusher.key(stage_errors)
+        field = json.dumps(['test_stage'])
+        self.assertEqual(self.redis_default.hget(key, field), b'2')
+        # прирост другого воркера
+        self.redis_default.hincrby(key, field, 5)
+        self.assertIn('auth_stage_errors_total{stage="test_stage"} 7', render_metrics())
+
+
+@override_settings(METRICS_STORE='memory', METRICS_ALLOWED_IPS=['10.0.0.0/8'], METRICS_TOKEN='secret')
+class MetricsAccessTests(SimpleTestCase):
+    def test_access(self):
+        factory = RequestFactory()
+        self.assertEqual(metrics_view(factory.get('/metrics', REMOTE_ADDR='10.1.2.3')).status_code, 200)
+        self.assertEqual(metrics_view(factory.get('/metrics', REMOTE_ADDR='8.8.8.8')).status_code, 403)
+        request = factory.get('/metrics', REMOTE_ADDR='8.8.8.8', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(metrics_view(request).status_code, 200)
+        request = factory.get('/metrics', REMOTE_ADDR='8.8.8.8', HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(metrics_view(request).status_code, 403)
+
+
+class ProfileCacheTests(FakeRedisMixin, TestCase):
+    def test_miss_does_not_overwrite_saved_profile(self):
+        user = User.objects.create(username='fresh', email='fresh@example.com', bio='new')
+        entry = {'data': {'username': 'fresh', 'bio': 'new'}, 'etag': '"new"'}
+        cache.set(profile_key(user.pk), entry)
+        # промах, начатый до сигнала: прочитал старую строку и пытается заполнить кеш
+        with mock.patch('account.utils.profile_cache.cache.get', return_value=None):
+            get_profile(user.pk)
+        with mock.patch('account.utils.profile_cache.cache.get_many', return_value={}):
+            get_profiles([user.pk, user.pk + 1])
+        self.assertEqual(cache.get(profile_key(user.pk)), entry)
+        self.assertEqual(cache.get(profile_key(user.pk + 1)), 'not_found')
+
+    @override_settings(PROFILE_BULK_MAX_IDS=3)
+    def test_bulk_id_limit(self):
+        user = User.objects.create(username='bulk', email='bulk@example.com')
+        response = self.client.get('/api/users/bulk/', {'ids': f'{user.pk},{user.pk},{user.pk + 1},{user.pk + 2}'})
+        # дубли не считаются: три разных id - ровно лимит
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['not_found'], [user.pk + 1, user.pk + 2])
+        for method, payload in (('get', {'ids': '1,2,3,4'}), ('post', {'ids': [1, 2, 3, 4]})):
+            with self.subTest(method=method), mock.patch('account.views.get_profiles') as get_profiles_mock:
+                if method == 'get':
+                    response = self.client.get('/api/users/bulk/', payload)
+                else:
+                    response = self.client.post('/api/users/bulk/', payload, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['message'], 'Не больше 3 id за запрос')
+                # до кеша и БД запрос не доходит
+                get_profiles_mock.assert_not_called()
+
+
+class SchemaArtifactTests(SimpleTestCase):
+    def test_missing_artifact_is_not_cached(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(OPENAPI_SCHEMA_DIR=directory):
+            self.assertIsNone(load_schema_artifact())
+            write_schema_artifact({'yaml': b'openapi: 3.0.3', 'json': b'{}'})
+            self.assertEqual(load_schema_artifact()['json'].body, b'{}')
+            write_schema_artifact({'yaml': b'openapi: 3.0.3', 'json': b'{"a": 1}'})
+            self.assertEqual(load_schema_artifact()['json'].body, b'{"a": 1}')
+
+
+class UserImportExportTests(FakeRedisMixin, TestCase):
+    def export(self, fmt):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, f'users.{fmt}')
+        call_command('export_users', path, stdout=io.StringIO(), stderr=io.StringIO())
+        return path
+
+    def test_round_trip_keeps_admin_flags_and_last_login(self):
+        for fmt in ('jsonl', 'csv'):
+            with self.subTest(fmt=fmt):
+                User.objects.all().delete()
+                User.objects.create(username='admin', email='admin@example.com', is_staff=True,
+                                    is_superuser=True, last_login=timezone.now())
+                User.objects.create(username='plain', email='plain@example.com')
+                path = self.export(fmt)
+                User.objects.all().delete()
+                call_command('import_users', path, stdout=io.StringIO(), stderr=io.StringIO())
+                admin = User.objects.get(username='admin')
+                self.assertTrue(admin.is_staff and admin.is_superuser)
+                self.assertIsNotNone(admin.last_login)
+                plain = User.objects.get(username='plain')
+                self.assertFalse(plain.is_staff or plain.is_superuser)
+                self.assertIsNone(plain.last_login)
+
+    def test_non_string_values(self):
+        rows = [
+            {'username': 123, 'email': 'num@example.com'},
+            {'username': {'a': 1}, 'email': 'dict@example.com'},
+            {'username': 'late', 'email': 'late@example.com', 'last_login': 5},
+            {'username': 'ok', 'email': 'ok@example.com'},
+        ]
+        stdin = io.StringIO(''.join(json.dumps(row) + '\n' for row in rows))
+        err = io.StringIO()
+        with mock.patch('sys.stdin', stdin):
+            call_command('import_users', '-', stdout=io.StringIO(), stderr=err)
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)), ['123', 'ok'])
+        self.assertIn('строка 2: username: ожидается строка', err.getvalue())
+        self.assertIn('строка 3: last_login не в формате ISO 8601', err.getvalue())
+        # stdin открыт не командой и остаётся открытым
+        self.assertFalse(stdin.closed)
+
+    def test_dry_run_creates_nothing(self):
+        User.objects.create(username='someone', email='someone@example.com')
+        path = self.export('jsonl')
+        User.objects.all().delete()
+        out = io.StringIO()
+        call_command('import_users', path, '--dry-run', stdout=out, stderr=io.StringIO())
+        self.assertFalse(User.objects.exists())
+        self.assertIn('создали бы 1 (--dry-run)', out.getvalue())
+
+
+class SessionTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='owner', email='owner@example.com')
+
+    def login(self, user=None):
+        request = RequestFactory().post('/', HTTP_X_CLIENT_TYPE='mobile', HTTP_USER_AGENT='phone')
+        return TokenPair.for_user(user or self.user, request)
+
+    def post(self, path, tokens, data=None):
+        return self.client.post(path, data or {}, content_type='application/json', HTTP_X_CLIENT_TYPE='mobile',
+                                HTTP_AUTHORIZATION=f'Bearer {tokens.access}')
+
+    def check_auth(self, tokens):
+        return self.client.get('/api/is_authentificated/', HTTP_X_CLIENT_TYPE='mobile',
+                               HTTP_AUTHORIZATION=f'Bearer {tokens.access}').status_code
+
+    def refresh(self, tokens):
+        return self.client.post('/api/token/refresh/', {'refresh': tokens.refresh}, content_type='application/json',
+                                HTTP_X_CLIENT_TYPE='mobile')
+
+    def test_revoke_all_cuts_older_tokens_only(self):
+        old = self.login()
+        self.assertEqual(self.post('/api/logout/all/', old).json()['sessions'], 1)
+        # новый вход сразу после выхода везде, обычно в ту же секунду
+        new = self.login()
+        self.assertEqual(self.check_auth(old), 401)
+        self.assertEqual(self.refresh(old).status_code, 401)
+        self.assertEqual(self.check_auth(new), 200)
+        self.assertEqual(self.refresh(new).status_code, 200)
+
+    def test_watermark_precision(self):
+        session_registry.revoke_all(self.user.pk)
+        revoked_before = auth_cache.get(session_registry._watermark_key(self.user.pk))
+        self.assertTrue(session_registry.is_revoked(self.user.pk, revoked_before - 0.001))
+        self.assertTrue(session_registry.is_revoked(self.user.pk, int(revoked_before)))  # целый iat старых токенов
+        self.assertFalse(session_registry.is_revoked(self.user.pk, revoked_before + 0.001))
+        self.assertFalse(session_registry.is_revoked(self.user.pk + 1, revoked_before - 0.001))
+
+    def test_rotation_moves_session_to_new_jti(self):
+        tokens = self.login()
+        [session] = session_registry.sessions(self.user.pk)
+        response = self.refresh(tokens)
+        self.assertEqual(response.status_code, 200)
+        [rotated] = session_registry.sessions(self.user.pk)
+        self.assertNotEqual(rotated['jti'], session['jti'])
+        self.assertEqual(rotated['user_agent'], 'phone')
+        # старый refresh после ротации - в blacklist
+        self.assertEqual(self.refresh(tokens).status_code, 401)
+
+    def test_session_detail_delete(self):
+        tokens = self.login()
+        other = self.login()
+        [_, jti] = sorted(item['jti'] for item in session_registry.sessions(self.user.pk))
+        revoked = other if RefreshToken(other.refresh)['jti'] == jti else tokens
+        response = self.client.delete(f'/api/sessions/{jti}/', HTTP_X_CLIENT_TYPE='mobile',
+                                      HTTP_AUTHORIZATION=f'Bearer {tokens.access}')
+        self.assertEqual(response.status_code, 204)
+        self.assertNotIn(jti, [item['jti'] for item in session_registry.sessions(self.user.pk)])
+        self.assertEqual(self.refresh(revoked).status_code, 401)
+        response = self.client.delete(f'/api/sessions/{jti}/', HTTP_X_CLIENT_TYPE='mobile',
+                                      HTTP_AUTHORIZATION=f'Bearer {tokens.access}')
+        self.assertEqual(response.status_code, 404)
+
+    def test_logout_with_foreign_refresh(self):
+        victim = self.login(User.objects.create(username='victim', email='victim@example.com'))
+        tokens = self.login()
+        response = self.post('/api/logout/', tokens, {'refresh_token': victim.refresh})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.refresh(victim).status_code, 200)
+
+    def test_logout_own_refresh(self):
+        tokens = self.login()
+        self.assertEqual(self.post('/api/logout/', tokens, {'refresh_token': tokens.refresh}).status_code, 202)
+        self.assertEqual(session_registry.sessions(self.user.pk), [])
+        self.assertEqual(self.refresh(tokens).status_code, 401)
+
+
+def private_pem(algorithm='EdDSA') -> str:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if algorithm == 'EdDSA':
+        key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    ).decode()
+
+
+def public_pem(private: str) -> str:
+    from cryptography.hazmat.primitives import serialization
+
+    key = serialization.load_pem_private_key(private.encode(), password=None)
+    return key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode()
+
+
+class KeyRingTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.old = private_pem('EdDSA')
+        cls.new = private_pem('RS256')
+
+    def sign(self, user_id=1):
+        token = AccessToken()
+        token['user_id'] = user_id
+        return str(token)
+
+    def test_rotation_round_trip(self):
+        with override_settings(JWT_SIGNING_KEYS=[{'kid': 'old', 'private_key': self.old}]):
+            issued_before = self.sign()
+        rotated = [{'kid': 'new', 'private_key': self.new}, {'kid': 'old', 'public_key': public_pem(self.old)}]
+        with override_settings(JWT_SIGNING_KEYS=rotated):
+            issued_after = self.sign()
+            self.assertEqual(jwt.get_unverified_header(issued_after)['kid'], 'new')
+            self.assertEqual(jwt.get_unverified_header(issued_after)['alg'], 'RS256')
+            # выданный старым ключом проверяется его публичной частью
+            self.assertEqual(AccessToken(issued_before)['user_id'], 1)
+            self.assertEqual(AccessToken(issued_after)['user_id'], 1)
+        with override_settings(JWT_SIGNING_KEYS=[{'kid': 'new', 'private_key': self.new}]):
+            with self.assertRaises(TokenError):
+                AccessToken(issued_before)
+
+    def test_legacy_hs256(self):
+        with override_settings(JWT_SIGNING_KEYS=[]):
+            legacy = self.sign()
+        keys = [{'kid': 'new', 'private_key': self.new}]
+        with override_settings(JWT_SIGNING_KEYS=keys, JWT_ACCEPT_HS256=True):
+            self.assertEqual(AccessToken(legacy)['user_id'], 1)
+        with override_settings(JWT_SIGNING_KEYS=keys, JWT_ACCEPT_HS256=False):
+            with self.assertRaises(TokenError):
+                AccessToken(legacy)
+
+    def test_jwks(self):
+        keys = [{'kid': 'new', 'private_key': self.new}, {'kid': 'old', 'public_key': public_pem(self.old)}]
+        with override_settings(JWT_SIGNING_KEYS=keys):
+            response = self.client.get('/.well-known/jwks.json')
+            self.assertEqual(response.status_code, 200)
+            document = response.json()
+            self.assertEqual([key['kid'] for key in document['keys']], ['new', 'old'])
+            self.assertEqual({key['kty'] for key in document['keys']}, {'RSA', 'OKP'})
+            for key in document['keys']:
+                self.assertEqual(key['use'], 'sig')
+                self.assertNotIn('d', key)  # приватная часть не публикуется
+            response = self.client.get('/.well-known/jwks.json', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_only_verify_keys(self):
+        with override_settings(JWT_SIGNING_KEYS=[{'kid': 'old', 'public_key': public_pem(self.old)}]):
+            with self.assertRaises(ImproperlyConfigured):
+                get_token_backend()
+
+
+class AsyncViewTests(FakeRedisMixin, TestCase):
+    factory = AsyncRequestFactory()
+
+    async def call(self, view, data=None, **headers):
+        request = self.factory.post('/', data or {}, content_type='application/json',
+                                    headers={'X-Client-Type': 'mobile', **headers})
+        response = await view.as_view()(request)
+        return response.status_code, json.loads(response.content)
+
+    async def login(self):
+        await User.objects.acreate(username='async', email='async@example.com', password=make_password('pw'))
+        status, body = await self.call(AsyncLoginView, {'username': 'async', 'password': 'pw'})
+        self.assertEqual(status, 200)
+        code = self.redis.hget(otp_store.key('async@example.com'), 'code').decode()
+        status, tokens = await self.call(AsyncLoginCodeView, {'login_token': body['login_token'], 'code': code})
+        self.assertEqual(status, 200)
+        return tokens
+
+    async def test_login(self):
+        tokens = await self.login()
+        request = self.factory.get('/', headers={'X-Client-Type': 'mobile',
+                                                 'Authorization': f'Bearer {tokens["access_token"]}'})
+        response = await AsyncCheckAuthView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['user_id'], (await User.objects.aget(username='async')).pk)
+
+    async def test_wrong_password(self):
+        await User.objects.acreate(username='async', email='async@example.com', password=make_password('pw'))
+        status, _ = await self.call(AsyncLoginView, {'username': 'async', 'password': 'nope'})
+        self.assertEqual(status, 403)
+
+    async def test_refresh_rotates(self):
+        tokens = await self.login()
+        user = await User.objects.aget(username='async')
+        [session] = session_registry.sessions(user.pk)
+        status, rotated = await self.call(AsyncTokenRefreshView, {'refresh': tokens['refresh_token']})
+        self.assertEqual(status, 200)
+        self.assertEqual(set(rotated), {'access', 'refresh'})
+        [new_session] = session_registry.sessions(user.pk)
+        self.assertNotEqual(new_session['jti'], session['jti'])
+        # старый refresh после ротации не принимается
+        status, body = await self.call(AsyncTokenRefreshView, {'refresh': tokens['refresh_token']})
+        self.assertEqual((status, body['code']), (401, 'token_not_valid'))
+
+
+class PasswordHashingExecutorTests(SimpleTestCase):
+    def test_sheds_load_beyond_slots(self):
+        executor = PasswordHashingExecutor(workers=1, max_pending=0, timeout=1)
+        release = threading.Event()
+        busy = executor.submit(release.wait)
+        # слот один и занят - следующий хеш сразу 503, без ожидания в очереди
+        with self.assertRaises(ServiceOverloaded):
+            executor.run(len, 'x')
+        release.set()
+        busy.result()
+        self.assertEqual(executor.run(len, 'x'), 1)
+
+
+class ClientJWTAuthenticationTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username='alice', email='alice@example.com')
+        self.bob = User.objects.create(username='bob', email='bob@example.com')
+
+    def request(self, client_type='web', cookie=None, header=None):
+        request = RequestFactory().get('/', HTTP_X_CLIENT_TYPE=client_type)
+        if cookie is not None:
+            request.COOKIES['access_token'] = cookie
+        if header is not None:
+            request.META['HTTP_AUTHORIZATION'] = f'Bearer {header}'
+        return Request(request)
+
+    def authenticate(self, request):
+        result = ClientJWTAuthentication().authenticate(request)
+        return result and result[0]
+
+    def token(self, user):
+        return str(AccessToken.for_user(user))
+
+    def test_decoded_once_per_request(self):
+        request = self.request(cookie=self.token(self.alice))
+        with mock.patch.object(ClientJWTAuthentication, 'get_validated_token',
+                               wraps=ClientJWTAuthentication().get_validated_token) as validate:
+            self.assertEqual(self.authenticate(request), self.alice)
+            # DRF зовёт аутентификацию снова (например, throttle и permission) - результат с запроса
+            self.assertEqual(self.authenticate(request), self.alice)
+        self.assertEqual(validate.call_count, 1)
+
+    def test_web_cookie_wins_over_header(self):
+        request = self.request(cookie=self.token(self.alice), header=self.token(self.bob))
+        self.assertEqual(self.authenticate(request), self.alice)
+
+    def test_web_without_cookie_uses_header(self):
+        self.assertEqual(self.authenticate(self.request(header=self.token(self.bob))), self.bob)
+
+    def test_mobile_ignores_cookie(self):
+        request = self.request('mobile', cookie=self.token(self.alice), header=self.token(self.bob))
+        self.assertEqual(self.authenticate(request), self.bob)
+        self.assertIsNone(self.authenticate(self.request('mobile', cookie=self.token(self.alice))))
+
+    def test_bad_cookie_is_anonymous_bad_header_fails(self):
+        self.assertIsNone(self.authenticate(self.request(cookie='broken')))
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(self.request('mobile', header='broken'))
+
+
+@override_settings(FLOW_LOCAL_CACHE=True)
+class FlowLocalCacheTests(FakeRedisMixin, SimpleTestCase):
+    def worker(self):
+        # отдельный FlowLocalCache - как память другого воркера, со своим origin и подпиской
+        local = FlowLocalCache(ttl=60)
+        self.assertTrue(local.usable('reg') or local._listening.wait(5))
+        return FlowState('reg', ttl=60, local=local), local
+
+    def wait_for(self, predicate):
+        deadline = time.monotonic() + 5
+        while not predicate():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_bypass_until_subscribed(self):
+        local = FlowLocalCache()
+        with mock.patch.object(local, '_listen', lambda: None):
+            self.assertFalse(local.usable('reg', read=True))
+
+    def test_update_and_delete_invalidate_other_workers(self):
+        flow_a, local_a = self.worker()
+        flow_b, local_b = self.worker()
+        token = flow_a.create({'email': 'flow@example.com'})
+        key = auth_cache.make_key(f'reg:{token}')
+        self.assertEqual(flow_b.get(token), {'email': 'flow@example.com'})
+        self.assertIn(key, local_b._data)
+
+        flow_a.update(token, code_verified=1)
+        self.wait_for(lambda: key not in local_b._data)
+        self.assertEqual(flow_b.get(token), {'email': 'flow@example.com', 'code_verified': '1'})
+        # своё сообщение отправитель пропускает: запись уже обновлена сквозной записью.
+        # Чужое сообщение следом - признак, что A дочитал канал до него
+        local_a.set('marker', {})
+        self.redis.publish(local_a.channel, local_b.message('marker'))
+        self.wait_for(lambda: 'marker' not in local_a._data)
+        self.assertEqual(local_a.get(key, 'reg'), {'email': 'flow@example.com', 'code_verified': '1'})
+
+        flow_a.delete(token)
+        self.wait_for(lambda: key not in local_b._data)
+        self.assertIsNone(flow_b.get(token))
@@ -0,0 +1,150 @@
+import time
+import uuid
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+from account.utils.redis_client import get_redis, get_async_redis, AUTH_CACHE, auth_cache
+
+# Скользящее окно на ZSET сразу по нескольким ключам (IP, ник, почта, токен flow):
+# запрос проходит, только если ни один ключ не превысил лимит, и тогда учитывается во всех.
+# ARGV: now_ms, member, затем по паре (window_ms, limit) на каждый ключ.
+# Возвращает 0, если пропускаем, иначе сколько мс ждать до освобождения места.
+SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local window = tonumber(ARGV[1 + i * 2])
+    local limit = tonumber(ARGV[2 + i * 2])
+    redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+    if redis.call('ZCARD', key) >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        wait = math.max(wait, tonumber(oldest[2]) + window - now)
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', KEYS[i], now, ARGV[2])
+    redis.call('PEXPIRE', KEYS[i], ARGV[1 + i * 2])
+end
+return 0
+"""
+
+
+def parse_rate(rate):
+    """'5/min' -> (5, 60000 мс), тот же формат, что у DEFAULT_THROTTLE_RATES в DRF."""
+    num, period = rate.split('/')
+    duration = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+    return int(num), duration * 1000
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Redis sliding-window лимитер: все ключи запроса проверяются одним Lua-вызовом
+    (один round trip). Лимиты берутся из REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']
+    по имени `<scope>_<идентификатор>`, например 'login_ip', 'login_username'.
+    Без django-redis - неатомарный запасной вариант через cache API.
+    """
+    scope = None
+
+    def __init__(self):
+        self.wait_ms = 0
+
+    def get_identities(self, request, view):
+        """Пары (имя лимита, значение); пустые значения пропускаются."""
+        return [('ip', self.get_ident(request))]
+
+    def _limits(self, request, view):
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        limits = []
+        for name, value in self.get_identities(request, view):
+            rate = rates.get(f'{self.scope}_{name}')
+            if not value or not rate:
+                continue
+            key = auth_cache.make_key(f'throttle:{self.scope}:{name}:{str(value).lower()}')
+            limits.append((key, *parse_rate(rate)))
+        return limits
+
+    def _script_args(self, limits):
+        now = int(time.time() * 1000)
+        args = [now, f'{now}-{uuid.uuid4().hex[:8]}']
+        for _, limit, window in limits:
+            args += [window, limit]
+        return [key for key, _, _ in limits], args
+
+    def allow_request(self, request, view):
+        limits = self._limits(request, view)
+        if not limits:
+            return True
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            self.wait_ms = self._check_cache(limits)
+        else:
+            keys, args = self._script_args(limits)
+            self.wait_ms = redis.register_script(SLIDING_WINDOW_LUA)(keys=keys, args=args, client=redis)
+        return not self.wait_ms
+
+    async def aallow_request(self, request, view):
+        limits = self._limits(request, view)
+        if not limits:
+            return True
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            self.wait_ms = self._check_cache(limits)
+        else:
+            keys, args = self._script_args(limits)
+            self.wait_ms = await redis.register_script(SLIDING_WINDOW_LUA)(keys=keys, args=args)
+        return not self.wait_ms
+
+    def _check_cache(self, limits):
+        now = int(time.time() * 1000)
+        histories, wait = {}, 0
+        for key, limit, window in limits:
+            history = [ts for ts in auth_cache.get(key, []) if ts > now - window]
+            if len(history) >= limit:
+                wait = max(wait, history[0] + window - now)
+            histories[key] = (history, window)
+        if wait:
+            return wait
+        for key, (history, window) in histories.items():
+            auth_cache.set(key, history + [now], timeout=window // 1000)
+        return 0
+
+    def wait(self):
+        return self.wait_ms / 1000 if self.wait_ms else None
+
+
+def request_data(request):
+    # тело может оказаться JSON-массивом или строкой - тогда идентификаторов из него нет
+    return request.data if isinstance(request.data, dict) else {}
+
+
+class LoginThrottle(SlidingWindowThrottle):
+    # до authenticate(): перебор паролей отсекается раньше PBKDF2
+    scope = 'login'
+
+    def get_identities(self, request, view):
+        return [('ip', self.get_ident(request)), ('username', request_data(request).get('username'))]
+
+
+class RegistrationThrottle(SlidingWindowThrottle):
+    # каждый проход - письмо с кодом
+    scope = 'registration'
+
+    def get_identities(self, request, view):
+        return [
+            ('ip', self.get_ident(request)),
+            ('email', request_data(request).get('email')),
+            ('username', request_data(request).get('username')),
+        ]
+
+
+class OtpThrottle(SlidingWindowThrottle):
+    # проверка кода: по IP и по токену flow (сам код ещё и сгорает после EMAIL_CODE_MAX_ATTEMPTS)
+    scope = 'otp'
+
+    def get_identities(self, request, view):
+        return [
+            ('ip', self.get_ident(request)),
+            ('token', request_data(request).get('login_token') or request_data(request).get('reg_token')),
+        ]
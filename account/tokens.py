@@ -0,0 +1,96 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken as BaseAccessToken, RefreshToken as BaseRefreshToken
+from account.metrics import timed
+from account.utils import blacklist_jti, is_jti_blacklisted, ablacklist_jti, ais_jti_blacklisted, session_registry
+# напрямую: jwt_keys тянет модели auth, поэтому в account.utils не реэкспортируется
+from account.utils.jwt_keys import get_token_backend
+
+
+class KeyRingTokenMixin:
+    # подпись и проверка через связку ключей settings.JWT_SIGNING_KEYS
+    @property
+    def token_backend(self):
+        return get_token_backend()
+
+    def set_iat(self, claim: str = 'iat', at_time=None) -> None:
+        # iat с миллисекундами (NumericDate в JWT может быть дробным): токен, выданный сразу
+        # после выхода везде, в ту же секунду, отличается от выданных до него
+        at_time = at_time or self.current_time
+        self.payload[claim] = round(at_time.timestamp(), 3)
+
+
+class AccessToken(KeyRingTokenMixin, BaseAccessToken):
+    # подпись считаем в метриках так же, как у refresh
+    @timed('jwt_sign')
+    def __str__(self) -> str:
+        return super().__str__()
+
+
+class RefreshToken(KeyRingTokenMixin, BaseRefreshToken):
+    """
+    Refresh токен с blacklist в Redis вместо SQL-таблиц token_blacklist:
+    проверка - один EXISTS, ключ сам исчезает вместе с истечением токена.
+    Выданные refresh учитываются в реестре сессий (outstand), выход везде отзывает их разом.
+    В async-коде: RefreshToken(raw, check_blacklist=False), затем await token.acheck_blacklist().
+    """
+    access_token_class = AccessToken
+    device = None  # метаданные устройства для реестра сессий, задаёт TokenPair.for_user
+    rotated_jti = None
+
+    def __init__(self, *args, check_blacklist: bool = True, **kwargs):
+        self._check_blacklist = check_blacklist
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        # username в claims, чтобы в режиме JWT_USER_LOOKUP = 'claims' не ходить в БД
+        token['username'] = user.username
+        return token
+
+    @timed('jwt_sign')
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def verify(self, *args, **kwargs) -> None:
+        if self._check_blacklist:
+            self.check_blacklist()
+        super().verify(*args, **kwargs)
+
+    def check_blacklist(self) -> None:
+        if is_jti_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+        if session_registry.is_revoked(self.payload.get(api_settings.USER_ID_CLAIM), self.payload.get('iat')):
+            raise TokenError(_("Token is blacklisted"))
+
+    async def acheck_blacklist(self) -> None:
+        if await ais_jti_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+        if await session_registry.ais_revoked(self.payload.get(api_settings.USER_ID_CLAIM), self.payload.get('iat')):
+            raise TokenError(_("Token is blacklisted"))
+
+    def set_jti(self) -> None:
+        # при ротации запоминаем прежний jti: outstand() продолжит под новым ту же сессию
+        self.rotated_jti = self.payload.get(api_settings.JTI_CLAIM)
+        super().set_jti()
+
+    def blacklist(self) -> None:
+        blacklist_jti(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+
+    async def ablacklist(self) -> None:
+        await ablacklist_jti(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+
+    def _session_args(self):
+        return (
+            self.payload.get(api_settings.USER_ID_CLAIM), self.payload[api_settings.JTI_CLAIM],
+            self.payload['exp'], self.device, self.rotated_jti,
+        )
+
+    def outstand(self) -> None:
+        # вместо таблицы OutstandingToken - реестр сессий; simplejwt зовёт это после ротации
+        session_registry.add(*self._session_args())
+
+    async def aoutstand(self) -> None:
+        await session_registry.aadd(*self._session_args())
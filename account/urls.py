@@ -1,8 +1,17 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 from account.views import RegistrationEmailAPIView, RegistrationCodeAPIView,\
 RegistrationPasswordAPIView, LoginAPIView, LoginCodeAPIView, LogoutAPIView,\
-CheckAuthAPIView, UserViewSet
+LogoutAllAPIView, SessionsAPIView, SessionDetailAPIView, CheckAuthAPIView, UserViewSet
+
+if settings.ASYNC_AUTH_VIEWS:
+    # ASGI: async-версии регистрации, входа и проверки авторизации
+    from account.async_views import AsyncRegistrationEmailView as RegistrationEmailAPIView,\
+    AsyncRegistrationCodeView as RegistrationCodeAPIView,\
+    AsyncRegistrationPasswordView as RegistrationPasswordAPIView,\
+    AsyncLoginView as LoginAPIView, AsyncLoginCodeView as LoginCodeAPIView,\
+    AsyncCheckAuthView as CheckAuthAPIView
 
 urlpatterns = [
     # Регистрация
@@ -14,10 +23,14 @@ urlpatterns = [
     path('login/verification/', LoginCodeAPIView.as_view(), name='login_2_step'),
     # Выход
     path('logout/', LogoutAPIView.as_view(), name='logout'),
+    path('logout/all/', LogoutAllAPIView.as_view(), name='logout_all'),
+    # Сессии по устройствам
+    path('sessions/', SessionsAPIView.as_view(), name='sessions'),
+    path('sessions/<str:jti>/', SessionDetailAPIView.as_view(), name='session_detail'),
     # Проверка авторизации по JWT
     path('is_authentificated/', CheckAuthAPIView.as_view(), name='check_auth')
 ]
 
 router = DefaultRouter()
 router.register('users', UserViewSet, basename='users')
-urlpatterns += router.urls
\ No newline at end of file
+urlpatterns += router.urls
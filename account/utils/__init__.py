@@ -1 +1,11 @@
-from .auth_utils import *
\ No newline at end of file
+from .auth_utils import *
+from .user_cache import UserCache, user_cache
+from .token_blacklist import blacklist_jti, is_jti_blacklisted, ablacklist_jti, ais_jti_blacklisted
+from .flow_cache import FlowLocalCache, flow_local_cache
+from .flow_state import FlowState, registration_flow, login_flow
+from .password_hashing import password_hasher, hash_password, ahash_password, authenticate_user, aauthenticate_user
+from .user_bloom import UserBloomFilter, user_bloom
+from .profile_cache import get_profile, get_profiles, cache_profile, invalidate_profile
+from .session_registry import SessionRegistry, session_registry
+from .email_outbox import EmailOutbox, email_outbox
+from .user_io import USER_FIELDS, detect_format, read_users, write_users
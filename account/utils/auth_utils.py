@@ -1,24 +1,43 @@
 import random
 import string
-from django.core.cache import cache
+from account.metrics import timed
+from account.utils.otp_store import OtpStore, VERIFIED
+from account.utils.email_outbox import email_outbox
 
 EMAIL_CODE_TTL = 60 * 10
+EMAIL_CODE_MAX_ATTEMPTS = 5  # после стольких неверных вводов код сгорает
+
+otp_store = OtpStore(ttl=EMAIL_CODE_TTL, max_attempts=EMAIL_CODE_MAX_ATTEMPTS)
 
 def generate_code(length: int = 6) -> str:
     return (str(''.join(random.choices(string.digits, k=length))))
 
-def set_code_in_redis(email: str) -> str:
+def outbox_entry(email: str, code: str, purpose: str):
+    return email_outbox.entry(email, code, purpose, EMAIL_CODE_TTL) if purpose else None
+
+
+@timed('otp_set')
+def set_code_in_redis(email: str, purpose: str = None) -> str:
+    # с purpose письмо с кодом тем же вызовом ставится в аутбокс
     code = generate_code()
     print(code)
-    key = f'verify_code:{email}'
-    cache.set(key, code, timeout=EMAIL_CODE_TTL)  # перезапишет старый код
+    otp_store.set(email, code, outbox=outbox_entry(email, code, purpose))  # перезапишет старый код и сбросит попытки
     return code
 
 
+@timed('otp_verify')
 def check_code_in_redis(email: str, code: str) -> bool:
-    key = f'verify_code:{email}'
-    stored_code = cache.get(key)
-    if stored_code == code:
-        cache.delete(key)
-        return True
-    return False
\ No newline at end of file
+    # сравнение и удаление - одна атомарная операция, без гонки параллельных проверок
+    return otp_store.verify(email, code) == VERIFIED
+
+
+@timed('otp_set')
+async def aset_code_in_redis(email: str, purpose: str = None) -> str:
+    code = generate_code()
+    await otp_store.aset(email, code, outbox=outbox_entry(email, code, purpose))
+    return code
+
+
+@timed('otp_verify')
+async def acheck_code_in_redis(email: str, code: str) -> bool:
+    return await otp_store.averify(email, code) == VERIFIED
@@ -0,0 +1,20 @@
+import json
+import pickle
+from django_redis.serializers.base import BaseSerializer
+
+
+class CompactJSONSerializer(BaseSerializer):
+    """
+    Сериализатор django-redis: компактный JSON вместо pickle. В кеше лежат только
+    простые dict/str (профили, флаги), в JSON они короче и читаются из redis-cli.
+    Значения, записанные pickle до переключения, читаются, пока не истекут.
+    """
+
+    def dumps(self, value) -> bytes:
+        return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode()
+
+    def loads(self, value: bytes):
+        # pickle протокола 2+ начинается с PROTO-опкода 0x80, JSON с него начаться не может
+        if value[:1] == b'\x80':
+            return pickle.loads(value)
+        return json.loads(value)
@@ -0,0 +1,155 @@
+import json
+import time
+from django.conf import settings
+from account.utils.redis_client import get_redis, AUTH_CACHE, auth_cache
+
+# Забираем пачку из аутбокса в список обработки: упавший relay её не потеряет
+CLAIM_LUA = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+# Повторы, которым пора, - обратно в хвост аутбокса
+PROMOTE_RETRIES_LUA = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #items > 0 then
+    redis.call('ZREM', KEYS[1], unpack(items))
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return #items
+"""
+
+# После падения relay: недоотправленная пачка возвращается в голову аутбокса в прежнем порядке
+RECOVER_LUA = """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+for i = #items, 1, -1 do
+    redis.call('LPUSH', KEYS[2], items[i])
+end
+redis.call('DEL', KEYS[1])
+return #items
+"""
+
+# Лок relay на назначение продлевается, только пока его держит тот же relay
+RENEW_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+DEAD_LIMIT = 1000  # сколько последних недоставленных писем держать для разбора
+RELAY_LOCK_TTL = 30  # секунд: упавший relay держит назначение не дольше
+
+
+class EmailOutbox:
+    """
+    Аутбокс писем с кодами в Redis алиаса auth: `email:outbox:<purpose>` - list JSON-записей
+    {email, code, expires_at, attempts}. Запись кладётся тем же Lua-вызовом, что и сам код
+    (OtpStore.set), поэтому запрос не ждёт брокер, а код не теряется, пока брокер лежит.
+    Разбирает аутбокс relay (manage.py relay_email_outbox): claim -> отправка -> ack или retry.
+    Пачка в работе лежит в `:processing`, повторы - в zset `:retry` по времени, исчерпавшие
+    попытки - в `:dead`. Relay берёт по пачке на назначение (purpose) за проход, login первым.
+    `:processing` у назначения один, поэтому relay на назначение - строго один: его держит
+    лок `:relay` (lock/renew/unlock), второй relay на то же назначение не запускается.
+    """
+
+    def __init__(self):
+        self._scripts = {}
+
+    @property
+    def enabled(self) -> bool:
+        return settings.EMAIL_OUTBOX and get_redis(AUTH_CACHE) is not None
+
+    def key(self, purpose: str, part: str = None) -> str:
+        name = f'email:outbox:{purpose}'
+        return auth_cache.make_key(f'{name}:{part}' if part else name)
+
+    def _script(self, redis, lua: str):
+        if lua not in self._scripts:
+            self._scripts[lua] = redis.register_script(lua)
+        return self._scripts[lua]
+
+    def entry(self, email: str, code: str, purpose: str, ttl: int) -> tuple:
+        """(ключ аутбокса, запись) для OtpStore.set; письмо живёт не дольше кода."""
+        item = {'email': email, 'code': code, 'expires_at': time.time() + ttl, 'attempts': 0}
+        return self.key(purpose), json.dumps(item)
+
+    def claim(self, purpose: str, count: int) -> list:
+        redis = get_redis(AUTH_CACHE)
+        items = self._script(redis, CLAIM_LUA)(
+            keys=[self.key(purpose), self.key(purpose, 'processing')], args=[count], client=redis
+        )
+        return [json.loads(item) for item in items]
+
+    def ack(self, purpose: str) -> None:
+        get_redis(AUTH_CACHE).delete(self.key(purpose, 'processing'))
+
+    def retry(self, purpose: str, items: list) -> int:
+        """Пачка не ушла: повтор с удвоением задержки, после EMAIL_OUTBOX_MAX_ATTEMPTS - в dead."""
+        now = time.time()
+        dead = 0
+        pipe = get_redis(AUTH_CACHE).pipeline()
+        for item in items:
+            item = {**item, 'attempts': item['attempts'] + 1}
+            due = now + settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (item['attempts'] - 1)
+            if item['attempts'] >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS or due >= item['expires_at']:
+                pipe.lpush(self.key(purpose, 'dead'), json.dumps(item))
+                dead += 1
+            else:
+                pipe.zadd(self.key(purpose, 'retry'), {json.dumps(item): due})
+        pipe.ltrim(self.key(purpose, 'dead'), 0, DEAD_LIMIT - 1)
+        pipe.delete(self.key(purpose, 'processing'))
+        pipe.execute()
+        return dead
+
+    def promote_retries(self, purpose: str, count: int) -> int:
+        redis = get_redis(AUTH_CACHE)
+        return self._script(redis, PROMOTE_RETRIES_LUA)(
+            keys=[self.key(purpose, 'retry'), self.key(purpose)], args=[time.time(), count], client=redis
+        )
+
+    def recover(self, purpose: str) -> int:
+        redis = get_redis(AUTH_CACHE)
+        return self._script(redis, RECOVER_LUA)(
+            keys=[self.key(purpose, 'processing'), self.key(purpose)], client=redis
+        )
+
+    def lock(self, purpose: str, owner: str) -> bool:
+        return bool(get_redis(AUTH_CACHE).set(self.key(purpose, 'relay'), owner, nx=True, ex=RELAY_LOCK_TTL))
+
+    def renew(self, purpose: str, owner: str) -> bool:
+        """False - лок истёк и, возможно, уже у другого relay: дальше разбирать нельзя."""
+        redis = get_redis(AUTH_CACHE)
+        return bool(self._script(redis, RENEW_LOCK_LUA)(
+            keys=[self.key(purpose, 'relay')], args=[owner, RELAY_LOCK_TTL * 1000], client=redis
+        ))
+
+    def unlock(self, purpose: str, owner: str) -> None:
+        redis = get_redis(AUTH_CACHE)
+        self._script(redis, RELEASE_LOCK_LUA)(keys=[self.key(purpose, 'relay')], args=[owner], client=redis)
+
+    def lock_owner(self, purpose: str):
+        owner = get_redis(AUTH_CACHE).get(self.key(purpose, 'relay'))
+        return owner.decode() if owner else None
+
+    def depth(self, purpose: str) -> dict:
+        pipe = get_redis(AUTH_CACHE).pipeline(transaction=False)
+        pipe.llen(self.key(purpose))
+        pipe.llen(self.key(purpose, 'processing'))
+        pipe.zcard(self.key(purpose, 'retry'))
+        pipe.llen(self.key(purpose, 'dead'))
+        return dict(zip(('pending', 'processing', 'retry', 'dead'), pipe.execute()))
+
+
+email_outbox = EmailOutbox()
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+
+from account.metrics import flow_local_cache_reads
+from account.utils.redis_client import get_redis, AUTH_CACHE, auth_cache
+
+PING_INTERVAL = 5  # секунд: обрыв подписки без ошибки сокета замечаем не позже
+
+
+class FlowLocalCache:
+    """
+    Второй уровень перед Redis для состояния flow: LRU в памяти процесса с коротким TTL.
+    Ключ - полный ключ Redis (`<prefix>:<token>` с префиксом кеша), значение - dict полей.
+    FlowState пишет сквозь: сначала Redis, затем память; изменения и удаления публикует
+    в канал `flow:invalidate`, остальные воркеры выкидывают ключ у себя. Слушает канал
+    фоновый поток (один на процесс, после fork поднимается заново). Пока подписка
+    не подтверждена, `usable()` - False и чтения идут мимо памяти: пропущенное
+    сообщение не оставит устаревший flow дольше TTL.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._origin = None
+        self._listening = threading.Event()
+
+    @property
+    def channel(self) -> str:
+        return auth_cache.make_key('flow:invalidate')
+
+    @property
+    def enabled(self) -> bool:
+        return getattr(settings, 'FLOW_LOCAL_CACHE', False) and get_redis(AUTH_CACHE) is not None
+
+    def usable(self, flow: str, read: bool = False) -> bool:
+        if not self.enabled:
+            return False
+        self._ensure_listener()
+        if not self._listening.is_set():
+            if read:
+                flow_local_cache_reads.inc(flow=flow, result='bypass')
+            return False
+        return True
+
+    def get(self, key: str, flow: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] < time.monotonic():
+                del self._data[key]
+                item = None
+            if item is not None:
+                self._data.move_to_end(key)
+        flow_local_cache_reads.inc(flow=flow, result='miss' if item is None else 'hit')
+        # копия: вьюха не должна менять запись в кеше
+        return None if item is None else dict(item[1])
+
+    def set(self, key: str, data: dict) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, dict(data))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update(self, key: str, fields: dict) -> None:
+        """Поля после успешного обновления в Redis; чужие записи не создаём."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                self._data[key] = (time.monotonic() + self.ttl, {**item[1], **fields})
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def message(self, key: str) -> str:
+        # отправитель свою запись уже обновил - своё сообщение он пропустит
+        return f'{self._origin} {key}'
+
+    def stats(self, flow: str) -> dict:
+        hits = flow_local_cache_reads.value(flow=flow, result='hit')
+        misses = flow_local_cache_reads.value(flow=flow, result='miss')
+        bypass = flow_local_cache_reads.value(flow=flow, result='bypass')
+        reads = hits + misses + bypass
+        return {'hit': hits, 'miss': misses, 'bypass': bypass, 'hit_rate': hits / reads if reads else 0.0}
+
+    def _ensure_listener(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # после fork: данные и подписка родителя не наши
+            self._data.clear()
+            self._origin = uuid.uuid4().hex
+            self._listening = threading.Event()
+            self._pid = os.getpid()
+            threading.Thread(target=self._listen, name='flow-cache-invalidation', daemon=True).start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                self._subscribe_and_read()
+            except Exception:
+                pass
+            # подписка оборвалась: сообщения за это время потеряны
+            self._listening.clear()
+            self.clear()
+            time.sleep(1)
+
+    def _subscribe_and_read(self) -> None:
+        pubsub = get_redis(AUTH_CACHE).pubsub()
+        try:
+            pubsub.subscribe(self.channel)
+            last_ping = time.monotonic()
+            while True:
+                # get_message с timeout не упирается в SOCKET_TIMEOUT пула, в отличие от listen()
+                message = pubsub.get_message(timeout=1)
+                if time.monotonic() - last_ping > PING_INTERVAL:
+                    pubsub.ping()
+                    last_ping = time.monotonic()
+                if message is None:
+                    continue
+                if message['type'] == 'subscribe':
+                    self.clear()
+                    self._listening.set()
+                elif message['type'] == 'message':
+                    origin, _, key = message['data'].decode().partition(' ')
+                    if origin != self._origin:
+                        self.invalidate(key)
+        finally:
+            pubsub.close()
+
+
+flow_local_cache = FlowLocalCache(
+    maxsize=getattr(settings, 'FLOW_LOCAL_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'FLOW_LOCAL_CACHE_TTL', 5),
+)
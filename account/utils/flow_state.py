@@ -0,0 +1,207 @@
+import uuid
+from asgiref.sync import sync_to_async
+from account.metrics import timed
+from account.utils.flow_cache import flow_local_cache
+from account.utils.redis_client import get_redis, get_async_redis, AUTH_CACHE, auth_cache
+
+# Обновляем поля только у живого flow, иначе HSET воскресил бы истёкший ключ без TTL
+UPDATE_FLOW_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+class FlowState:
+    """
+    Состояние многошагового flow (регистрация, вход) в одном Redis hash
+    `<prefix>:<token>` с одним TTL. Каждый шаг - один round trip, поля
+    обновляются по отдельности, без пересериализации всего словаря.
+    Значения полей - строки. Без django-redis работает через cache API.
+    С FLOW_LOCAL_CACHE повторное чтение на том же воркере обходится без Redis
+    (см. FlowLocalCache), изменение и удаление - тот же один round trip с PUBLISH.
+    Методы с префиксом `a` - то же самое для async-вьюх.
+    """
+
+    def __init__(self, prefix: str, ttl: int, local=flow_local_cache):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local = local
+        self._update_script = None
+
+    def _key(self, token: str) -> str:
+        return f'{self.prefix}:{token}'
+
+    def _local(self, read: bool = False):
+        return self.local if self.local is not None and self.local.usable(self.prefix, read) else None
+
+    def _update_args(self, ttl, fields) -> list:
+        args = [ttl]
+        for field, value in fields.items():
+            args += [field, value]
+        return args
+
+    def _apply_update(self, local, key, updated, fields) -> None:
+        if updated:
+            local.update(key, {k: str(v) for k, v in fields.items()})
+        else:
+            local.invalidate(key)
+
+    @timed('flow_create')
+    def create(self, data: dict, ttl: int = None) -> str:
+        token = str(uuid.uuid4())
+        ttl = ttl or self.ttl
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            auth_cache.set(self._key(token), {k: str(v) for k, v in data.items()}, timeout=ttl)
+            return token
+        key = auth_cache.make_key(self._key(token))
+        pipe = redis.pipeline()
+        pipe.hset(key, mapping=data)
+        pipe.expire(key, ttl)
+        pipe.execute()
+        local = self._local()
+        if local:
+            # следующий шаг обычно приходит на этот же воркер
+            local.set(key, {k: str(v) for k, v in data.items()})
+        return token
+
+    @timed('flow_get')
+    def get(self, token: str):
+        if not token:
+            return None
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            return auth_cache.get(self._key(token))
+        key = auth_cache.make_key(self._key(token))
+        local = self._local(read=True)
+        if local:
+            data = local.get(key, self.prefix)
+            if data is not None:
+                return data
+        data = redis.hgetall(key)
+        if not data:
+            return None
+        data = {k.decode(): v.decode() for k, v in data.items()}
+        if local:
+            local.set(key, data)
+        return data
+
+    @timed('flow_update')
+    def update(self, token: str, ttl: int = None, **fields) -> bool:
+        ttl = ttl or self.ttl
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            data = auth_cache.get(self._key(token))
+            if data is None:
+                return False
+            data.update({k: str(v) for k, v in fields.items()})
+            auth_cache.set(self._key(token), data, timeout=ttl)
+            return True
+        if self._update_script is None:
+            self._update_script = redis.register_script(UPDATE_FLOW_LUA)
+        key = auth_cache.make_key(self._key(token))
+        local = self._local()
+        if not local:
+            return bool(self._update_script(keys=[key], args=self._update_args(ttl, fields), client=redis))
+        pipe = redis.pipeline()
+        self._update_script(keys=[key], args=self._update_args(ttl, fields), client=pipe)
+        pipe.publish(local.channel, local.message(key))
+        updated = bool(pipe.execute()[0])
+        self._apply_update(local, key, updated, fields)
+        return updated
+
+    @timed('flow_delete')
+    def delete(self, token: str) -> None:
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            auth_cache.delete(self._key(token))
+            return
+        key = auth_cache.make_key(self._key(token))
+        local = self._local()
+        if not local:
+            redis.delete(key)
+            return
+        local.invalidate(key)
+        pipe = redis.pipeline()
+        pipe.delete(key)
+        pipe.publish(local.channel, local.message(key))
+        pipe.execute()
+
+    @timed('flow_create')
+    async def acreate(self, data: dict, ttl: int = None) -> str:
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            return await sync_to_async(self.create)(data, ttl)
+        token = str(uuid.uuid4())
+        key = auth_cache.make_key(self._key(token))
+        pipe = redis.pipeline()
+        pipe.hset(key, mapping=data)
+        pipe.expire(key, ttl or self.ttl)
+        await pipe.execute()
+        local = self._local()
+        if local:
+            local.set(key, {k: str(v) for k, v in data.items()})
+        return token
+
+    @timed('flow_get')
+    async def aget(self, token: str):
+        if not token:
+            return None
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            return await sync_to_async(self.get)(token)
+        key = auth_cache.make_key(self._key(token))
+        local = self._local(read=True)
+        if local:
+            data = local.get(key, self.prefix)
+            if data is not None:
+                return data
+        data = await redis.hgetall(key)
+        if not data:
+            return None
+        data = {k.decode(): v.decode() for k, v in data.items()}
+        if local:
+            local.set(key, data)
+        return data
+
+    @timed('flow_update')
+    async def aupdate(self, token: str, ttl: int = None, **fields) -> bool:
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            return await sync_to_async(self.update)(token, ttl, **fields)
+        args = self._update_args(ttl or self.ttl, fields)
+        script = redis.register_script(UPDATE_FLOW_LUA)
+        key = auth_cache.make_key(self._key(token))
+        local = self._local()
+        if not local:
+            return bool(await script(keys=[key], args=args))
+        pipe = redis.pipeline()
+        await script(keys=[key], args=args, client=pipe)
+        pipe.publish(local.channel, local.message(key))
+        updated = bool((await pipe.execute())[0])
+        self._apply_update(local, key, updated, fields)
+        return updated
+
+    @timed('flow_delete')
+    async def adelete(self, token: str) -> None:
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            return await sync_to_async(self.delete)(token)
+        key = auth_cache.make_key(self._key(token))
+        local = self._local()
+        if not local:
+            await redis.delete(key)
+            return
+        local.invalidate(key)
+        pipe = redis.pipeline()
+        pipe.delete(key)
+        pipe.publish(local.channel, local.message(key))
+        await pipe.execute()
+
+
+registration_flow = FlowState('reg', ttl=60 * 15)
+login_flow = FlowState('login', ttl=60 * 5)
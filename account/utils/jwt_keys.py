@@ -0,0 +1,150 @@
+import functools
+import jwt
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from jwt import ExpiredSignatureError, InvalidAlgorithmError, InvalidTokenError
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenBackendExpiredToken
+from rest_framework_simplejwt.settings import api_settings
+from account.utils.profile_cache import make_etag
+
+
+def _read(entry: dict, name: str):
+    if entry.get(name):
+        return entry[name]
+    if entry.get(f'{name}_path'):
+        return Path(entry[f'{name}_path']).read_text()
+    return None
+
+
+class JwtKey:
+    """
+    Один ключ связки из settings.JWT_SIGNING_KEYS:
+    {'kid': '2026-10', 'private_key_path': '...'} или {'kid': ..., 'public_key': PEM}.
+    Без private_key ключ только проверяет подпись (выведенный из ротации).
+    """
+
+    def __init__(self, entry: dict):
+        from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
+
+        self.kid = entry['kid']
+        private_pem = _read(entry, 'private_key')
+        self.private_key = load_pem_private_key(private_pem.encode(), password=None) if private_pem else None
+        if self.private_key is not None:
+            self.public_key = self.private_key.public_key()
+        else:
+            self.public_key = load_pem_public_key(_read(entry, 'public_key').encode())
+
+        if 'algorithm' in entry:
+            self.algorithm = entry['algorithm']
+        elif isinstance(self.public_key, rsa.RSAPublicKey):
+            self.algorithm = 'RS256'
+        elif isinstance(self.public_key, ed25519.Ed25519PublicKey):
+            self.algorithm = 'EdDSA'
+        else:
+            raise ValueError(f'JWT key {self.kid}: укажите algorithm')
+
+    def to_jwk(self) -> dict:
+        jwk = jwt.PyJWS().get_algorithm_by_name(self.algorithm).to_jwk(self.public_key, as_dict=True)
+        return {**jwk, 'kid': self.kid, 'alg': self.algorithm, 'use': 'sig'}
+
+
+class KeyRingTokenBackend(TokenBackend):
+    """
+    Backend simplejwt со связкой ключей: подписывает активным ключом и кладёт его kid
+    в заголовок, проверяет ключом по kid из заголовка. Токены без kid (выданные до
+    перехода, HS256 на SECRET_KEY) принимаются через legacy, пока включён JWT_ACCEPT_HS256.
+    """
+
+    def __init__(self, keys, legacy=None):
+        self.keys = {key.kid: key for key in keys}
+        self.active = next((key for key in keys if key.private_key is not None), None)
+        if self.active is None:
+            raise ImproperlyConfigured('JWT_SIGNING_KEYS: нет ни одного ключа с private_key, подписывать нечем')
+        self.legacy = legacy
+        super().__init__(
+            self.active.algorithm,
+            audience=api_settings.AUDIENCE,
+            issuer=api_settings.ISSUER,
+            leeway=api_settings.LEEWAY,
+            json_encoder=api_settings.JSON_ENCODER,
+        )
+
+    def encode(self, payload: dict) -> str:
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload['aud'] = self.audience
+        if self.issuer is not None:
+            jwt_payload['iss'] = self.issuer
+        return jwt.encode(
+            jwt_payload,
+            self.active.private_key,
+            algorithm=self.active.algorithm,
+            headers={'kid': self.active.kid},
+            json_encoder=self.json_encoder,
+        )
+
+    def decode(self, token, verify: bool = True) -> dict:
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+        except InvalidTokenError as ex:
+            raise TokenBackendError(_('Token is invalid')) from ex
+        if kid is None and self.legacy is not None:
+            return self.legacy.decode(token, verify=verify)
+        key = self.keys.get(kid)
+        if key is None:
+            raise TokenBackendError(_('Token is invalid'))
+        try:
+            return jwt.decode(
+                token,
+                key.public_key,
+                algorithms=[key.algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options={
+                    'verify_aud': self.audience is not None,
+                    'verify_signature': verify,
+                },
+            )
+        except InvalidAlgorithmError as ex:
+            raise TokenBackendError(_('Invalid algorithm specified')) from ex
+        except ExpiredSignatureError as ex:
+            raise TokenBackendExpiredToken(_('Token is expired')) from ex
+        except InvalidTokenError as ex:
+            raise TokenBackendError(_('Token is invalid')) from ex
+
+    def jwks(self) -> dict:
+        return {'keys': [key.to_jwk() for key in self.keys.values()]}
+
+
+@functools.cache
+def get_token_backend():
+    """Backend для токенов account.tokens: связка ключей или стандартный HS256 simplejwt."""
+    from rest_framework_simplejwt.state import token_backend
+
+    entries = getattr(settings, 'JWT_SIGNING_KEYS', [])
+    if not entries:
+        return token_backend
+    legacy = token_backend if getattr(settings, 'JWT_ACCEPT_HS256', True) else None
+    return KeyRingTokenBackend([JwtKey(entry) for entry in entries], legacy=legacy)
+
+
+@functools.cache
+def get_jwks():
+    """Публичные ключи в формате JWKS и их ETag; считаются один раз на процесс."""
+    backend = get_token_backend()
+    document = backend.jwks() if isinstance(backend, KeyRingTokenBackend) else {'keys': []}
+    return document, make_etag(document)
+
+
+@receiver(setting_changed)
+def reset_key_ring(setting, **kwargs):
+    if setting in ('JWT_SIGNING_KEYS', 'JWT_ACCEPT_HS256', 'SIMPLE_JWT'):
+        get_token_backend.cache_clear()
+        get_jwks.cache_clear()
@@ -0,0 +1,99 @@
+import gzip
+import hashlib
+from pathlib import Path
+from django.conf import settings
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+
+# Форматы как у SpectacularAPIView: ?format=yaml|json или Accept
+RENDERERS = {'yaml': OpenApiYamlRenderer, 'json': OpenApiJsonRenderer}
+
+_loaded = {}  # (каталог, mtime и размеры файлов схемы) -> {формат: SchemaFile}
+
+
+class SchemaFile:
+    """Готовое представление схемы: тело, оно же в gzip, и ETag."""
+
+    def __init__(self, body: bytes, compressed: bytes):
+        self.body = body
+        self.compressed = compressed
+        self.etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+        # у сжатого варианта свой ETag: это другие байты
+        self.gzip_etag = self.etag[:-1] + '-gzip"'
+
+
+def schema_dir() -> Path:
+    return Path(settings.OPENAPI_SCHEMA_DIR)
+
+
+def schema_path(fmt: str) -> Path:
+    return schema_dir() / f'schema.{fmt}'
+
+
+def render_schema() -> dict:
+    """Обход всех вьюх и сериализаторов, как у `spectacular`: {формат: байты}. Долго - только при сборке."""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(request=None, public=True)
+    return {fmt: renderer().render(schema, renderer_context={}) for fmt, renderer in RENDERERS.items()}
+
+
+def write_schema_artifact(rendered: dict) -> bool:
+    """Пишет схему и её .gz рядом; совпадает с уже собранной - файлы не трогаем. True - схема изменилась."""
+    if all(_read(schema_path(fmt)) == body for fmt, body in rendered.items()):
+        return False
+    schema_dir().mkdir(parents=True, exist_ok=True)
+    for fmt, body in rendered.items():
+        path = schema_path(fmt)
+        # mtime=0: одинаковая схема даёт одинаковый .gz
+        _write(path.with_name(path.name + '.gz'), gzip.compress(body, compresslevel=9, mtime=0))
+        _write(path, body)
+    return True
+
+
+def load_schema_artifact():
+    """
+    {формат: SchemaFile} из OPENAPI_SCHEMA_DIR или None, если схема не собрана.
+    Файлы читаются один раз на сборку (по mtime), на запрос - только stat. Отсутствие
+    не запоминается: схема, собранная уже после старта воркера, подхватится без рестарта.
+    """
+    stamp = _stamp()
+    if stamp is None:
+        return None
+    if stamp not in _loaded:
+        files = {}
+        for fmt in RENDERERS:
+            path = schema_path(fmt)
+            body = _read(path)
+            if body is None:
+                return None
+            compressed = _read(path.with_name(path.name + '.gz'))
+            files[fmt] = SchemaFile(body, compressed or gzip.compress(body, mtime=0))
+        _loaded.clear()
+        _loaded[stamp] = files
+    return _loaded[stamp]
+
+
+def _stamp():
+    stamp = [str(schema_dir())]
+    for fmt in RENDERERS:
+        try:
+            stat = schema_path(fmt).stat()
+        except FileNotFoundError:
+            return None
+        # размер тоже: на ФС с грубым mtime две сборки подряд могут получить одно время
+        stamp += [stat.st_mtime_ns, stat.st_size]
+    return tuple(stamp)
+
+
+def _read(path: Path):
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def _write(path: Path, data: bytes) -> None:
+    # через временный файл: воркер не прочитает недописанную схему
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(data)
+    tmp.replace(path)
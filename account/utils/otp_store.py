@@ -0,0 +1,111 @@
+from asgiref.sync import sync_to_async
+from account.utils.redis_client import get_redis, get_async_redis, AUTH_CACHE, auth_cache
+
+# Код и счётчик попыток лежат в одном hash: {code, attempts}.
+# С KEYS[2] письмо с кодом тем же вызовом ложится в аутбокс (EmailOutbox).
+SET_CODE_LUA = """
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'code', ARGV[1], 'attempts', 0)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if KEYS[2] then
+    redis.call('RPUSH', KEYS[2], ARGV[3])
+end
+return 1
+"""
+
+# 1 - код верный (ключ удалён), 0 - неверный, -1 - кода нет или попытки кончились
+VERIFY_CODE_LUA = """
+local code = redis.call('HGET', KEYS[1], 'code')
+if not code then
+    return -1
+end
+if code == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+if attempts >= tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1])
+    return -1
+end
+return 0
+"""
+
+VERIFIED = 1
+WRONG_CODE = 0
+NO_CODE = -1
+
+
+class OtpStore:
+    """
+    Хранилище одноразовых кодов: запись с TTL, проверка с удалением и счётчик
+    неверных попыток - каждая операция один атомарный Lua-скрипт (один round trip).
+    Без django-redis (LocMemCache в разработке) работает через cache API, но не атомарно.
+    Методы с префиксом `a` - то же самое для async-вьюх.
+    """
+
+    def __init__(self, ttl: int, max_attempts: int):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._scripts = {}
+
+    def key(self, email: str) -> str:
+        return auth_cache.make_key(f'verify_code:{email}')
+
+    def _script(self, redis, lua: str):
+        if lua not in self._scripts:
+            self._scripts[lua] = redis.register_script(lua)
+        return self._scripts[lua]
+
+    def _set_args(self, email, code, outbox):
+        # outbox - (ключ, запись) из EmailOutbox.entry
+        if outbox is None:
+            return [self.key(email)], [code, self.ttl]
+        return [self.key(email), outbox[0]], [code, self.ttl, outbox[1]]
+
+    def set(self, email: str, code: str, outbox: tuple = None) -> None:
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            auth_cache.set(f'verify_code:{email}', {'code': code, 'attempts': 0}, timeout=self.ttl)
+            return
+        keys, args = self._set_args(email, code, outbox)
+        self._script(redis, SET_CODE_LUA)(keys=keys, args=args, client=redis)
+
+    def verify(self, email: str, code: str) -> int:
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            return self._verify_cache(email, code)
+        return self._script(redis, VERIFY_CODE_LUA)(
+            keys=[self.key(email)], args=[code, self.max_attempts], client=redis
+        )
+
+    async def aset(self, email: str, code: str, outbox: tuple = None) -> None:
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            return await sync_to_async(self.set)(email, code, outbox)
+        keys, args = self._set_args(email, code, outbox)
+        script = redis.register_script(SET_CODE_LUA)
+        await script(keys=keys, args=args)
+
+    async def averify(self, email: str, code: str) -> int:
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            return await sync_to_async(self.verify)(email, code)
+        script = redis.register_script(VERIFY_CODE_LUA)
+        return await script(keys=[self.key(email)], args=[code, self.max_attempts])
+
+    def _verify_cache(self, email: str, code: str) -> int:
+        key = f'verify_code:{email}'
+        data = auth_cache.get(key)
+        if not data:
+            return NO_CODE
+        if data['code'] == code:
+            auth_cache.delete(key)
+            return VERIFIED
+        data['attempts'] += 1
+        if data['attempts'] >= self.max_attempts:
+            auth_cache.delete(key)
+            return NO_CODE
+        auth_cache.set(key, data, timeout=self.ttl)
+        return WRONG_CODE
+
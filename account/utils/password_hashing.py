@@ -0,0 +1,120 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from account.exceptions import ServiceOverloaded
+from account.metrics import timed
+
+
+class PasswordHashingExecutor:
+    """
+    Пул для PBKDF2: ограничивает число одновременных хешей (workers) и очередь к ним
+    (max_pending); сверх этого запрос сразу получает 503, а не копится в воркере.
+    Sync-вьюхи (run) ждут результат в потоке запроса: поток занят так же, как без пула,
+    выигрыш - только предел параллельных хешей и быстрый отказ при перегрузке.
+    Поток освобождают лишь async-вьюхи (arun): event loop ждёт future, не блокируясь.
+    kind='thread' - hashlib.pbkdf2_hmac отпускает GIL, потоков хватает;
+    kind='process' - отдельные процессы, если хешер держит GIL (например argon2 на чистом Python).
+    """
+
+    def __init__(self, kind: str = 'thread', workers: int = 4, max_pending: int = 16, timeout: float = 5):
+        self.kind = kind
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    pool_class = ProcessPoolExecutor if self.kind == 'process' else ThreadPoolExecutor
+                    self._executor = pool_class(max_workers=self.workers)
+        return self._executor
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise ServiceOverloaded()
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # слот освобождается, когда хеш реально посчитан, даже если запрос уже ушёл по таймауту
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        # блокирует вызывающий поток до результата или таймаута
+        try:
+            return self.submit(fn, *args).result(timeout=self.timeout)
+        except TimeoutError:
+            raise ServiceOverloaded()
+
+    async def arun(self, fn, *args):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.submit(fn, *args)), self.timeout)
+        except asyncio.TimeoutError:
+            raise ServiceOverloaded()
+
+
+password_hasher = PasswordHashingExecutor(
+    kind=getattr(settings, 'PASSWORD_HASHING_EXECUTOR', 'thread'),
+    workers=getattr(settings, 'PASSWORD_HASHING_WORKERS', 4),
+    max_pending=getattr(settings, 'PASSWORD_HASHING_MAX_PENDING', 16),
+    timeout=getattr(settings, 'PASSWORD_HASHING_TIMEOUT', 5),
+)
+
+
+@timed('password_hash')
+def hash_password(raw_password: str) -> str:
+    return password_hasher.run(make_password, raw_password)
+
+
+@timed('password_hash')
+async def ahash_password(raw_password: str) -> str:
+    return await password_hasher.arun(make_password, raw_password)
+
+
+def _needs_rehash(encoded: str) -> bool:
+    try:
+        return identify_hasher(encoded).must_update(encoded)
+    except ValueError:
+        return False
+
+
+@timed('authenticate')
+def authenticate_user(user_model, username: str, password: str):
+    """
+    То же, что ModelBackend.authenticate, но проверка пароля идёт через пул.
+    Для несуществующего ника хешируем впустую, чтобы время ответа его не выдавало.
+    """
+    try:
+        user = user_model._default_manager.get_by_natural_key(username)
+    except user_model.DoesNotExist:
+        hash_password(password)
+        return None
+    if not password_hasher.run(check_password, password, user.password) or not user.is_active:
+        return None
+    if _needs_rehash(user.password):
+        user.password = hash_password(password)
+        user.save(update_fields=['password'])
+    return user
+
+
+@timed('authenticate')
+async def aauthenticate_user(user_model, username: str, password: str):
+    try:
+        user = await user_model._default_manager.aget_by_natural_key(username)
+    except user_model.DoesNotExist:
+        await ahash_password(password)
+        return None
+    if not await password_hasher.arun(check_password, password, user.password) or not user.is_active:
+        return None
+    if _needs_rehash(user.password):
+        user.password = await ahash_password(password)
+        await user.asave(update_fields=['password'])
+    return user
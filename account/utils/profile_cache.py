@@ -0,0 +1,106 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from account.db_routers import read_replica
+from account.utils.redis_client import get_redis
+
+PROFILE_NOT_FOUND = 'not_found'
+
+
+def profile_key(pk) -> str:
+    return f'profile:{pk}'
+
+
+def make_etag(data: dict) -> str:
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False).encode()
+    return '"%s"' % hashlib.md5(payload).hexdigest()
+
+
+def profile_entry(user) -> dict:
+    from account.serializers import UserSerializer
+    data = UserSerializer(user).data
+    return {'data': dict(data), 'etag': make_etag(data)}
+
+
+def get_profile(pk):
+    """
+    Read-through кеш публичного профиля: {'data': {...}, 'etag': '"..."'} или None.
+    Промах - один SELECT только username/bio (с реплики, если она есть); несуществующие id
+    тоже кешируются, чтобы перебор id не долбил БД. При сохранении User сигнал
+    кладёт в кеш свежий профиль (set), а промах заполняет кеш только через add: чтение
+    с отстающей реплики не перетрёт уже записанный сигналом профиль.
+    """
+    key = profile_key(pk)
+    entry = cache.get(key)
+    if entry == PROFILE_NOT_FOUND:
+        return None
+    if entry is not None:
+        return entry
+
+    from account.models import User
+    with read_replica():
+        user = User.objects.only('username', 'bio').filter(pk=pk).first()
+    if user is None:
+        cache.add(key, PROFILE_NOT_FOUND, timeout=settings.PROFILE_NOT_FOUND_CACHE_TTL)
+        return None
+    entry = profile_entry(user)
+    cache.add(key, entry, timeout=settings.PROFILE_CACHE_TTL)
+    return entry
+
+
+def get_profiles(pks) -> dict:
+    """
+    Пакетная версия get_profile: один get_many из кеша и один in_bulk по промахам.
+    Возвращает {pk: entry или None}.
+    """
+    keys = {pk: profile_key(pk) for pk in pks}
+    cached = cache.get_many(keys.values())
+    result, missing = {}, []
+    for pk, key in keys.items():
+        entry = cached.get(key)
+        if entry is None:
+            missing.append(pk)
+        else:
+            result[pk] = None if entry == PROFILE_NOT_FOUND else entry
+    if not missing:
+        return result
+
+    from account.models import User
+    with read_replica():
+        users = User.objects.only('username', 'bio').in_bulk(missing)
+    found, not_found = {}, {}
+    for pk in missing:
+        user = users.get(pk)
+        if user is None:
+            result[pk] = None
+            not_found[keys[pk]] = PROFILE_NOT_FOUND
+            continue
+        result[pk] = found[keys[pk]] = profile_entry(user)
+    if found:
+        add_many(found, timeout=settings.PROFILE_CACHE_TTL)
+    if not_found:
+        add_many(not_found, timeout=settings.PROFILE_NOT_FOUND_CACHE_TTL)
+    return result
+
+
+def add_many(entries: dict, timeout) -> None:
+    """cache.add по каждому ключу (как в get_profile), на django-redis - SET NX одним pipeline."""
+    redis = get_redis()
+    if redis is None:
+        for key, entry in entries.items():
+            cache.add(key, entry, timeout=timeout)
+        return
+    pipe = redis.pipeline(transaction=False)
+    for key, entry in entries.items():
+        cache.client.set(key, entry, timeout=timeout, nx=True, client=pipe)
+    pipe.execute()
+
+
+def cache_profile(user) -> None:
+    # авторитетная запись после сохранения: перетирает то, что успел положить промах
+    cache.set(profile_key(user.pk), profile_entry(user), timeout=settings.PROFILE_CACHE_TTL)
+
+
+def invalidate_profile(pk) -> None:
+    cache.delete(profile_key(pk))
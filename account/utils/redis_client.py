@@ -0,0 +1,76 @@
+import asyncio
+import weakref
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from django.utils.connection import ConnectionProxy
+from redis import asyncio as aioredis
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.retry import Retry
+
+# Горячее состояние входа и регистрации (OTP, flow, blacklist, лимиты) живёт в отдельном
+# алиасе кеша со своей базой и пулом: общий кеш и Celery не отнимают у него соединения
+AUTH_CACHE = 'auth'
+auth_cache = ConnectionProxy(caches, AUTH_CACHE)
+
+# redis.asyncio-клиенты привязаны к event loop, поэтому держим свой на каждый loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis(alias: str = 'default'):
+    """
+    Сырой redis-клиент django-redis для атомарных операций (Lua, pipeline).
+    None, если кеш не на django-redis (например LocMemCache локально) -
+    тогда вызывающий код работает через обычный cache API.
+    """
+    cache = caches[alias]
+    client = getattr(cache, 'client', None)
+    if client is None or not hasattr(client, 'get_client'):
+        return None
+    return client.get_client(write=True)
+
+
+def get_async_redis(alias: str = 'default'):
+    """
+    redis.asyncio-клиент на тот же сервер, что и кеш `alias`, для async-вьюх.
+    None в тех же случаях, что и get_redis().
+    """
+    cache = caches[alias]
+    client = getattr(cache, 'client', None)
+    if client is None or not hasattr(client, 'get_client'):
+        return None
+    loop_clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if alias not in loop_clients:
+        loop_clients[alias] = aioredis.Redis(connection_pool=_async_pool(alias, client))
+    return loop_clients[alias]
+
+
+def _async_pool(alias: str, client):
+    """
+    Пул redis.asyncio с теми же настройками, что у sync-клиента алиаса: CONNECTION_POOL_KWARGS
+    (SSL, пароль, retry...) как есть, тот же класс пула и таймауты. Sync-классы соединения
+    и retry в asyncio не годятся: класс соединения берётся из OPTIONS['ASYNC_CONNECTION_CLASS']
+    (например fakeredis.aioredis.FakeConnection в тестах), retry пересобирается.
+    """
+    options = client._options
+    pool_kwargs = dict(options.get('CONNECTION_POOL_KWARGS', {}))
+    if 'connection_class' in pool_kwargs or 'ASYNC_CONNECTION_CLASS' in options:
+        connection_class = options.get('ASYNC_CONNECTION_CLASS')
+        if connection_class is None:
+            raise ImproperlyConfigured(
+                f"CACHES['{alias}']: при connection_class в CONNECTION_POOL_KWARGS нужен "
+                f"OPTIONS['ASYNC_CONNECTION_CLASS'] для async-клиента"
+            )
+        pool_kwargs['connection_class'] = (
+            import_string(connection_class) if isinstance(connection_class, str) else connection_class
+        )
+    if isinstance(pool_kwargs.get('retry'), Retry):
+        retry = pool_kwargs['retry']
+        pool_kwargs['retry'] = AsyncRetry(retry._backoff, retry._retries, retry._supported_errors)
+    if options.get('PASSWORD'):
+        pool_kwargs.setdefault('password', options['PASSWORD'])
+    pool_kwargs.setdefault('socket_timeout', options.get('SOCKET_TIMEOUT'))
+    pool_kwargs.setdefault('socket_connect_timeout', options.get('SOCKET_CONNECT_TIMEOUT'))
+    blocking = str(options.get('CONNECTION_POOL_CLASS', '')).endswith('BlockingConnectionPool')
+    pool_class = aioredis.BlockingConnectionPool if blocking else aioredis.ConnectionPool
+    return pool_class.from_url(client._server[0], **pool_kwargs)
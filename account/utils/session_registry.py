@@ -0,0 +1,182 @@
+import json
+import time
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.settings import api_settings
+from account.utils.redis_client import get_redis, get_async_redis, AUTH_CACHE, auth_cache
+from account.utils.token_blacklist import blacklist_jti, blacklist_key
+
+# Добавление сессии (или замена при ротации refresh) с чисткой истёкших.
+# KEYS: zset jti->exp, hash jti->метаданные. ARGV: now, ttl, jti, exp, meta, старый jti или ''.
+# При ротации метаданные устройства переезжают со старого jti на новый.
+ADD_SESSION_LUA = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #expired > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+    redis.call('HDEL', KEYS[2], unpack(expired))
+end
+local meta = ARGV[5]
+if ARGV[6] ~= '' then
+    meta = redis.call('HGET', KEYS[2], ARGV[6]) or meta
+    redis.call('ZREM', KEYS[1], ARGV[6])
+    redis.call('HDEL', KEYS[2], ARGV[6])
+end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[3], meta)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+# Выход везде: все живые refresh в blacklist, реестр удаляем, ставим отметку отзыва.
+# KEYS: zset, hash, отметка. ARGV: now, префикс ключей blacklist, ttl отметки.
+# Ключи blacklist собираются из префикса внутри скрипта - для Redis Cluster не годится.
+REVOKE_ALL_LUA = """
+local sessions = redis.call('ZRANGEBYSCORE', KEYS[1], '(' .. ARGV[1], '+inf', 'WITHSCORES')
+for i = 1, #sessions, 2 do
+    local ttl = math.ceil(tonumber(sessions[i + 1]) - tonumber(ARGV[1]))
+    redis.call('SET', ARGV[2] .. sessions[i], 1, 'EX', ttl)
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('SET', KEYS[3], ARGV[1], 'EX', ARGV[3])
+return #sessions / 2
+"""
+
+
+class SessionRegistry:
+    """
+    Реестр активных сессий пользователя: refresh JTI с метаданными устройства.
+    `sessions:<user_id>` - zset jti -> exp, `sessions_meta:<user_id>` - hash jti -> JSON.
+    Выход везде - O(сессий): их refresh уходят в blacklist, а отметка
+    `revoked_before:<user_id>` (время с миллисекундами) отсекает все токены с iat не позже неё,
+    в том числе access и refresh, выданные до появления реестра. Отметка проверяется одним GET.
+    Без django-redis работает через cache API, но не атомарно.
+    """
+
+    def __init__(self):
+        self._scripts = {}
+
+    @property
+    def ttl(self) -> int:
+        # позже всех истекает refresh, выданный прямо сейчас
+        return int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+
+    def _keys(self, user_id):
+        return [
+            auth_cache.make_key(f'sessions:{user_id}'),
+            auth_cache.make_key(f'sessions_meta:{user_id}'),
+        ]
+
+    def _watermark_key(self, user_id) -> str:
+        return f'revoked_before:{user_id}'
+
+    def _script(self, redis, lua: str):
+        if lua not in self._scripts:
+            self._scripts[lua] = redis.register_script(lua)
+        return self._scripts[lua]
+
+    def _add_args(self, jti, exp, device, old_jti):
+        return [int(time.time()), self.ttl, jti, exp, json.dumps(device or {}, ensure_ascii=False), old_jti or '']
+
+    def add(self, user_id, jti: str, exp: int, device: dict = None, old_jti: str = None) -> None:
+        """Новая сессия; с old_jti - ротация refresh внутри той же сессии."""
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            return self._add_cache(user_id, jti, exp, device, old_jti)
+        self._script(redis, ADD_SESSION_LUA)(
+            keys=self._keys(user_id), args=self._add_args(jti, exp, device, old_jti), client=redis
+        )
+
+    async def aadd(self, user_id, jti: str, exp: int, device: dict = None, old_jti: str = None) -> None:
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            return await sync_to_async(self.add)(user_id, jti, exp, device, old_jti)
+        script = redis.register_script(ADD_SESSION_LUA)
+        await script(keys=self._keys(user_id), args=self._add_args(jti, exp, device, old_jti))
+
+    def remove(self, user_id, jti: str) -> None:
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            sessions = auth_cache.get(f'sessions:{user_id}', {})
+            sessions.pop(jti, None)
+            auth_cache.set(f'sessions:{user_id}', sessions, timeout=self.ttl)
+            return
+        zset, meta = self._keys(user_id)
+        pipe = redis.pipeline()
+        pipe.zrem(zset, jti)
+        pipe.hdel(meta, jti)
+        pipe.execute()
+
+    def sessions(self, user_id) -> list:
+        """Живые сессии, свежие первыми: [{jti, expires_at, last_seen, **метаданные}]."""
+        now = time.time()
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            items = [(jti, exp, meta) for jti, (exp, meta) in auth_cache.get(f'sessions:{user_id}', {}).items()]
+        else:
+            zset, meta_key = self._keys(user_id)
+            pipe = redis.pipeline()
+            pipe.zrangebyscore(zset, f'({int(now)}', '+inf', withscores=True)
+            pipe.hgetall(meta_key)
+            entries, metas = pipe.execute()
+            items = [
+                (jti.decode(), exp, json.loads(metas.get(jti, b'{}')))
+                for jti, exp in entries
+            ]
+        return [
+            # exp сдвигается на время жизни refresh при каждом обновлении - отсюда последняя активность
+            {'jti': jti, 'expires_at': int(exp), 'last_seen': int(exp) - self.ttl, **meta}
+            for jti, exp, meta in sorted(items, key=lambda item: item[1], reverse=True)
+            if exp > now
+        ]
+
+    def revoke(self, user_id, jti: str) -> bool:
+        """Выход на одном устройстве. False - такой живой сессии нет."""
+        session = next((item for item in self.sessions(user_id) if item['jti'] == jti), None)
+        if session is None:
+            return False
+        blacklist_jti(jti, session['expires_at'])
+        self.remove(user_id, jti)
+        return True
+
+    def revoke_all(self, user_id) -> int:
+        """Выход везде. Возвращает, сколько сессий было в реестре."""
+        now = round(time.time(), 3)
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            sessions = auth_cache.get(f'sessions:{user_id}', {})
+            for jti, (exp, _) in sessions.items():
+                blacklist_jti(jti, exp)
+            auth_cache.delete(f'sessions:{user_id}')
+            auth_cache.set(self._watermark_key(user_id), now, timeout=self.ttl)
+            return len(sessions)
+        return self._script(redis, REVOKE_ALL_LUA)(
+            keys=[*self._keys(user_id), auth_cache.make_key(self._watermark_key(user_id))],
+            args=[now, auth_cache.make_key(blacklist_key('')), self.ttl],
+            client=redis,
+        )
+
+    def is_revoked(self, user_id, issued_at) -> bool:
+        # наши токены несут iat с миллисекундами (KeyRingTokenMixin.set_iat), как и отметка;
+        # у старых iat целый - токен той же секунды, что и отзыв, но выданный раньше, отсекается
+        revoked_before = auth_cache.get(self._watermark_key(user_id))
+        return revoked_before is not None and float(issued_at or 0) <= float(revoked_before)
+
+    async def ais_revoked(self, user_id, issued_at) -> bool:
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            return await sync_to_async(self.is_revoked)(user_id, issued_at)
+        revoked_before = await redis.get(auth_cache.make_key(self._watermark_key(user_id)))
+        return revoked_before is not None and float(issued_at or 0) <= float(revoked_before)
+
+    def _add_cache(self, user_id, jti, exp, device, old_jti) -> None:
+        now = time.time()
+        sessions = {
+            key: value for key, value in auth_cache.get(f'sessions:{user_id}', {}).items() if value[0] > now
+        }
+        if old_jti and old_jti in sessions:
+            device = sessions.pop(old_jti)[1]
+        sessions[jti] = (exp, device or {})
+        auth_cache.set(f'sessions:{user_id}', sessions, timeout=self.ttl)
+
+
+session_registry = SessionRegistry()
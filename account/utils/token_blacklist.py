@@ -0,0 +1,35 @@
+import time
+from account.utils.redis_client import get_async_redis, AUTH_CACHE, auth_cache
+
+
+def blacklist_key(jti: str) -> str:
+    return f'blacklist:{jti}'
+
+
+def blacklist_jti(jti: str, exp: int) -> None:
+    # ключ живёт ровно столько, сколько живёт сам токен
+    ttl = int(exp - time.time())
+    if ttl > 0:
+        auth_cache.set(blacklist_key(jti), 1, timeout=ttl)
+
+
+def is_jti_blacklisted(jti: str) -> bool:
+    return auth_cache.has_key(blacklist_key(jti))
+
+
+async def ablacklist_jti(jti: str, exp: int) -> None:
+    ttl = int(exp - time.time())
+    if ttl <= 0:
+        return
+    redis = get_async_redis(AUTH_CACHE)
+    if redis is None:
+        await auth_cache.aset(blacklist_key(jti), 1, timeout=ttl)
+        return
+    await redis.set(auth_cache.make_key(blacklist_key(jti)), 1, ex=ttl)
+
+
+async def ais_jti_blacklisted(jti: str) -> bool:
+    redis = get_async_redis(AUTH_CACHE)
+    if redis is None:
+        return await auth_cache.ahas_key(blacklist_key(jti))
+    return bool(await redis.exists(auth_cache.make_key(blacklist_key(jti))))
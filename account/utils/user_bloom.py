@@ -0,0 +1,89 @@
+import hashlib
+from django.conf import settings
+from account.utils.redis_client import get_redis, get_async_redis, AUTH_CACHE, auth_cache
+
+BLOOM_KEY = 'users:bloom'
+BLOOM_READY_KEY = 'users:bloom:ready'
+
+
+class UserBloomFilter:
+    """
+    Bloom-фильтр занятых ников и почт в Redis-битмапе. Отвечает "точно свободно"
+    без запроса в БД; "возможно занято" - идём в БД. Фильтру верим только после
+    `manage.py rebuild_user_bloom` (ключ users:bloom:ready), новые пользователи
+    добавляются сигналом post_save. Удаление не поддерживается - удалённые
+    пользователи дают лишь ложные "возможно занято".
+    """
+
+    def __init__(self, bits: int, hashes: int):
+        self.bits = bits
+        self.hashes = hashes
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _values(self, email: str = None, username: str = None):
+        values = []
+        if email:
+            values.append(f'email:{email.lower()}')
+        if username:
+            values.append(f'username:{username}')
+        return values
+
+    def add(self, pipe, email: str = None, username: str = None, key: str = BLOOM_KEY) -> None:
+        key = auth_cache.make_key(key)
+        for value in self._values(email, username):
+            for position in self._positions(value):
+                pipe.setbit(key, position, 1)
+
+    def _read_pipeline(self, pipe, values):
+        pipe.exists(auth_cache.make_key(BLOOM_READY_KEY))
+        key = auth_cache.make_key(BLOOM_KEY)
+        for value in values:
+            for position in self._positions(value):
+                pipe.getbit(key, position)
+
+    def _might_contain(self, results, values) -> bool:
+        ready, bits = results[0], results[1:]
+        if not ready:
+            return True
+        for i in range(len(values)):
+            if all(bits[i * self.hashes:(i + 1) * self.hashes]):
+                return True
+        return False
+
+    def might_contain(self, email: str = None, username: str = None) -> bool:
+        # один round trip на любое число значений; без Redis - всегда "возможно"
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            return True
+        values = self._values(email, username)
+        pipe = redis.pipeline(transaction=False)
+        self._read_pipeline(pipe, values)
+        return self._might_contain(pipe.execute(), values)
+
+    async def amight_contain(self, email: str = None, username: str = None) -> bool:
+        redis = get_async_redis(AUTH_CACHE)
+        if redis is None:
+            return True
+        values = self._values(email, username)
+        pipe = redis.pipeline(transaction=False)
+        self._read_pipeline(pipe, values)
+        return self._might_contain(await pipe.execute(), values)
+
+    def add_user(self, email: str = None, username: str = None) -> None:
+        redis = get_redis(AUTH_CACHE)
+        if redis is None:
+            return
+        pipe = redis.pipeline(transaction=False)
+        self.add(pipe, email, username)
+        pipe.execute()
+
+
+user_bloom = UserBloomFilter(
+    bits=getattr(settings, 'USER_BLOOM_BITS', 2 ** 24),
+    hashes=getattr(settings, 'USER_BLOOM_HASHES', 7),
+)
@@ -0,0 +1,57 @@
+import csv
+import json
+
+# Поля выгрузки и загрузки пользователей; password - готовый хеш в формате Django (<algorithm>$...).
+# Права (is_staff, is_superuser) и last_login переносятся тоже: без них админы после миграции - обычные
+# пользователи. Группы и user_permissions не переносятся.
+USER_FIELDS = (
+    'username', 'email', 'password', 'first_name', 'last_name', 'bio',
+    'is_active', 'is_staff', 'is_superuser', 'date_joined', 'last_login',
+)
+
+
+def detect_format(path: str, fmt: str = None) -> str:
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_users(stream, fmt: str):
+    """
+    Строки файла по одной: (номер строки, dict или None, если строка не разбирается).
+    Файл не читается целиком - память не зависит от его размера.
+    """
+    if fmt == 'csv':
+        # первая строка - заголовок
+        for number, row in enumerate(csv.DictReader(stream), start=2):
+            yield number, row
+        return
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def _plain(value):
+    # даты - в ISO 8601, как их ждёт import_users
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def write_users(stream, fmt: str, rows) -> int:
+    """Пишет кортежи в порядке USER_FIELDS по мере поступления, возвращает их число."""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(USER_FIELDS)
+        for row in rows:
+            writer.writerow(_plain(value) for value in row)
+            count += 1
+        return count
+    for row in rows:
+        stream.write(json.dumps(dict(zip(USER_FIELDS, map(_plain, row))), ensure_ascii=False) + '\n')
+        count += 1
+    return count
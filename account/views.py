@@ -1,12 +1,16 @@
-from django.core.cache import cache
-from django.contrib.auth import authenticate
+import re
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from drf_spectacular.views import SpectacularAPIView
 from django.shortcuts import get_object_or_404
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
-import uuid
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework import viewsets
 from rest_framework.decorators import action
@@ -18,25 +22,41 @@ from account.serializers import (
     UserSerializer,
 )
 from account.permissions import IsOwner
-from account.models import User
-from account.utils import set_code_in_redis, check_code_in_redis
-from account.tasks import send_code_to_email
+from account.throttling import LoginThrottle, RegistrationThrottle, OtpThrottle
+from account.models import User, email_ci
+from account.utils import (
+    check_code_in_redis, registration_flow, login_flow,
+    hash_password, authenticate_user, get_profile, get_profiles, session_registry,
+)
+from account.utils.jwt_keys import get_jwks
+from account.utils.openapi_schema import load_schema_artifact
+from account.tasks import send_code
+from account.tokens import RefreshToken
+from account.issuance import TokenPair, token_response, set_token_cookies, delete_token_cookies
+
+
+GZIP_RE = re.compile(r'\bgzip\b')
+
+
+def etag_matches(request, etag: str) -> bool:
+    if_none_match = request.headers.get('If-None-Match', '')
+    etags = [value.strip().removeprefix('W/') for value in if_none_match.split(',')]
+    return etag in etags or '*' in etags
 
 # Регистрация — email
 class RegistrationEmailAPIView(GenericAPIView):
     serializer_class = UsernameEmailSerializer
+    throttle_classes = [RegistrationThrottle]
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             email = serializer.validated_data['email']
             username = serializer.validated_data['username']
-            code = set_code_in_redis(email)
+            # код и письмо с ним - в аутбокс одним вызовом, брокер запрос не держит
+            code = send_code(email, purpose='registration')
 
-            reg_token = str(uuid.uuid4())
-            cache.set(f'reg:{reg_token}', {'email': email, 'username': username}, timeout=900)
-
-            send_code_to_email.delay(email, code)
+            reg_token = registration_flow.create({'email': email, 'username': username})
             print(email, code)
             return Response({'message': 'Код отправлен на почту', 'reg_token': reg_token})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -45,6 +65,7 @@ class RegistrationEmailAPIView(GenericAPIView):
 # Регистрация — код
 class RegistrationCodeAPIView(GenericAPIView):
     serializer_class = EmailCodeSerializer
+    throttle_classes = [OtpThrottle]
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -53,7 +74,7 @@ class RegistrationCodeAPIView(GenericAPIView):
             if not reg_token:
                 return Response({'message': 'Нужен токен регистрации'}, status=status.HTTP_403_FORBIDDEN)
 
-            reg_data = cache.get(f'reg:{reg_token}')
+            reg_data = registration_flow.get(reg_token)
             if not reg_data:
                 return Response({'message': 'Истёк токен регистрации'}, status=status.HTTP_403_FORBIDDEN)
 
@@ -61,7 +82,8 @@ class RegistrationCodeAPIView(GenericAPIView):
             if not check_code_in_redis(reg_data['email'], serializer.validated_data['code']):
                 return Response({'message': 'Неверный код'}, status=status.HTTP_403_FORBIDDEN)
 
-            cache.set(f'reg:{reg_token}', {**reg_data, 'code_verified': True}, timeout=1800)
+            # меняем одно поле и продлеваем TTL, остальной flow не трогаем
+            registration_flow.update(reg_token, ttl=1800, code_verified=1)
             return Response({'message': 'Код принят, придумайте пароль!', 'reg_token': reg_token})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -74,131 +96,76 @@ class RegistrationPasswordAPIView(GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             reg_token = request.data.get('reg_token')
-            reg_data = cache.get(f'reg:{reg_token}')
+            reg_data = registration_flow.get(reg_token)
 
             if not reg_data or not reg_data.get('code_verified'):
                 return Response({'message': 'Регистрация не подтверждена'}, status=status.HTTP_403_FORBIDDEN)
 
-            user = User.objects.create(username=reg_data['username'], email=reg_data['email'])
-            user.set_password(serializer.validated_data['password'])
-            user.save()
-            cache.delete(f'reg:{reg_token}')
-
-            refresh = RefreshToken.for_user(user)
-            access = refresh.access_token
-            # проверяем: мобилка или веб
-            client_type = request.headers.get('X-Client-Type', 'web')
-            if client_type == 'mobile':
-                # для мобильного клиента возвращаем токены в JSON
-                return Response({
-                    'message': 'Аккаунт создан!',
-                    'access_token': str(access),
-                    'refresh_token': str(refresh),
-                }, status=status.HTTP_201_CREATED)
-            else:
-                # для браузера ставим куки (HttpOnly!)
-                response = Response({'message': 'Аккаунт создан!'}, status=status.HTTP_201_CREATED)
-                response.set_cookie(
-                    key='refresh_token',
-                    value=str(refresh),
-                    httponly=True,
-                    secure=True,
-                    samesite="Lax",
-                    max_age=7 * 24 * 3600,
-                    domain="localhost"
-                )
-                response.set_cookie(
-                    key='access_token',
-                    value=str(access),
-                    httponly=True,
-                    secure=True,
-                    samesite="Lax",
-                    max_age=60 * 15,
-                    domain="localhost"
-                )
-                return response
+            # PBKDF2 считается в пуле хеширования, при его перегрузке - сразу 503
+            password = hash_password(serializer.validated_data['password'])
+            try:
+                user = User.objects.create(username=reg_data['username'], email=reg_data['email'], password=password)
+            except IntegrityError:
+                # ник или почту заняли, пока шла регистрация
+                return Response({'message': 'Этот ник или почта уже используется'}, status=status.HTTP_400_BAD_REQUEST)
+            registration_flow.delete(reg_token)
+
+            # мобилка - токены в JSON, веб - HttpOnly куки
+            return token_response(
+                {'message': 'Аккаунт создан!'},
+                TokenPair.for_user(user, request),
+                request.headers.get('X-Client-Type', 'web'),
+                status=status.HTTP_201_CREATED,
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # Вход — логин + пароль
 class LoginAPIView(GenericAPIView):
     serializer_class = UsernamePasswordSerializer
+    throttle_classes = [LoginThrottle]
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            user = authenticate(
+            user = authenticate_user(
+                User,
                 username=serializer.validated_data['username'],
                 password=serializer.validated_data['password']
             )
             if not user:
                 return Response({'message': 'Неверный логин или пароль'}, status=status.HTTP_403_FORBIDDEN)
 
-            login_token = str(uuid.uuid4())
-            code = set_code_in_redis(user.email)
-            cache.set(f'login:{login_token}', user.email, timeout=300)
-
-            send_code_to_email.delay(user.email, code)
+            send_code(user.email, purpose='login')
+            login_token = login_flow.create({'email': user.email})
             return Response({'message': 'Код отправлен на почту', 'login_token': login_token})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # Вход - код
 class LoginCodeAPIView(GenericAPIView):
     serializer_class = EmailCodeSerializer
+    throttle_classes = [OtpThrottle]
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             login_token = request.data.get('login_token')
-            email = cache.get(f'login:{login_token}')
-            if not login_token or not email:
+            login_data = login_flow.get(login_token)
+            if not login_data:
                 return Response({'message': 'Истёк токен или не указан'}, status=status.HTTP_403_FORBIDDEN)
+            email = login_data['email']
 
             if not check_code_in_redis(email, serializer.validated_data['code']):
                 return Response({'message': 'Неверный код'}, status=status.HTTP_403_FORBIDDEN)
 
-            user = User.objects.get(email=email)
-            refresh = RefreshToken.for_user(user)
-            cache.delete(f'login:{login_token}')
-
-            # определяем клиент
-            client_type = request.headers.get('X-Client-Type', 'web')
+            user = User.objects.get(email_ci(email))
+            tokens = TokenPair.for_user(user, request)
+            login_flow.delete(login_token)
 
-            if client_type == 'mobile':
-                # мобильный → возвращаем токены в JSON
-                return Response({
-                    'message': 'Успешный вход!',
-                    'user_id': user.id,
-                    'username': user.username,
-                    'access_token': str(refresh.access_token),
-                    'refresh_token': str(refresh),
-                }, status=status.HTTP_200_OK)
-            else:
-                # веб
-                response = Response({
-                    'message': 'Успешный вход!',
-                    'user_id': user.id,
-                    'username': user.username,
-                }, status=status.HTTP_200_OK)
-
-                response.set_cookie(
-                    key='refresh_token',
-                    value=str(refresh),
-                    httponly=True,
-                    secure=True,
-                    samesite="Lax",
-                    max_age=604800,  # 7 дней
-                    domain="localhost"
-                )
-                response.set_cookie(
-                    key='access_token',
-                    value=str(refresh.access_token),
-                    httponly=True,
-                    secure=True,
-                    samesite="Lax",
-                    max_age=60 * 15,  # 15 минут
-                    domain="localhost"
-                )
-                return response
+            return token_response(
+                {'message': 'Успешный вход!', 'user_id': user.id, 'username': user.username},
+                tokens,
+                request.headers.get('X-Client-Type', 'web'),
+            )
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -220,16 +187,20 @@ class LogoutAPIView(GenericAPIView):
             if refresh_token:
                 try:
                     token = RefreshToken(refresh_token)
+                except TokenError:
+                    token = None  # уже недействителен
+                # чужой refresh (утёкший или подсунутый) не даёт выкинуть чужую сессию
+                if token is not None and str(token[api_settings.USER_ID_CLAIM]) != str(request.user.pk):
+                    return Response({'message': 'Токен принадлежит другому пользователю'},
+                                    status=status.HTTP_403_FORBIDDEN)
+                if token is not None:
                     token.blacklist()
-                except Exception:
-                    pass  # уже недействителен
+                    session_registry.remove(token[api_settings.USER_ID_CLAIM], token[api_settings.JTI_CLAIM])
 
             # Веб → удаляем куки
             if client_type == 'web':
                 response = Response({'message': 'Вы вышли из аккаунта'}, status=status.HTTP_202_ACCEPTED)
-                response.delete_cookie('access_token')
-                response.delete_cookie('refresh_token')
-                return response
+                return delete_token_cookies(response)
 
             # Мобилка просто ответ
             return Response({'message': 'Вы вышли из аккаунта'}, status=status.HTTP_202_ACCEPTED)
@@ -237,6 +208,34 @@ class LogoutAPIView(GenericAPIView):
         except Exception as e:
             return Response({'message': 'Ошибка при выходе'}, status=status.HTTP_400_BAD_REQUEST)
 
+# Выход на всех устройствах: все refresh в blacklist, выданные раньше access тоже перестают работать
+class LogoutAllAPIView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        revoked = session_registry.revoke_all(request.user.id)
+        response = Response({'message': 'Вы вышли на всех устройствах', 'sessions': revoked},
+                            status=status.HTTP_202_ACCEPTED)
+        if request.headers.get('X-Client-Type', 'web') == 'web':
+            return delete_token_cookies(response)
+        return response
+
+# Активные сессии (устройства) пользователя
+class SessionsAPIView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({'sessions': session_registry.sessions(request.user.id)})
+
+# Выход на одном устройстве по jti из списка сессий
+class SessionDetailAPIView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request, jti):
+        if not session_registry.revoke(request.user.id, jti):
+            return Response({'message': 'Сессия не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 # Проверка авторизации
 class CheckAuthAPIView(GenericAPIView):
     permission_classes = [IsAuthenticated]
@@ -270,18 +269,9 @@ class CustomTokenRefreshView(TokenRefreshView):
             response = super().post(request, *args, **kwargs)
 
             if response.status_code == 200:
-                # сетим новые куки
-                response.set_cookie(
-                    key='access_token',
-                    value=response.data['access'],
-                    httponly=True,
-                    secure=True,
-                    samesite="Lax",
-                    max_age=60 * 15,
-                    domain="localhost"
-                )
-                # refresh_token не обновляем (по стандарту SimpleJWT он статичен)
-                del response.data['access']  # убираем из тела ответа
+                # сетим новые куки: при ROTATE_REFRESH_TOKENS старый refresh уже в blacklist,
+                # поэтому новый refresh тоже уходит в куку, а не в тело ответа
+                set_token_cookies(response, TokenPair(response.data.pop('access'), response.data.pop('refresh', None)))
             return response
 
         else:
@@ -309,10 +299,46 @@ class UserViewSet(viewsets.ViewSet):
         return [AllowAny()]
 
     def retrieve(self, request, pk=None):
-        queryset = User.objects.all()
-        user = get_object_or_404(queryset, pk=pk)
-        serializer = UserSerializer(user)
-        return Response(serializer.data)
+        # профиль из кеша; совпал ETag - 304 без БД и без тела
+        profile = get_profile(pk) if str(pk).isdigit() else None
+        if profile is None:
+            raise Http404
+        if etag_matches(request, profile['etag']):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(profile['data'])
+        response['ETag'] = profile['etag']
+        return response
+
+    @action(detail=False, methods=['get', 'post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Профили пачкой: GET ?ids=1,2,3 или POST {"ids": [1, 2, 3]}.
+        Ответ: {"results": {"1": {...}, "2": null}, "not_found": [2]}
+        """
+        if request.method == 'GET':
+            raw_ids = request.query_params.get('ids', '').split(',')
+        else:
+            raw_ids = request.data.get('ids', [])
+        if not isinstance(raw_ids, list):
+            return Response({'message': 'ids должен быть списком'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids = list(dict.fromkeys(int(pk) for pk in raw_ids if str(pk).strip()))
+        except (TypeError, ValueError):
+            return Response({'message': 'ids должны быть числами'}, status=status.HTTP_400_BAD_REQUEST)
+        if not ids:
+            return Response({'message': 'Не переданы ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > settings.PROFILE_BULK_MAX_IDS:
+            return Response(
+                {'message': f'Не больше {settings.PROFILE_BULK_MAX_IDS} id за запрос'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        profiles = get_profiles(ids)
+        return Response({
+            'results': {str(pk): profiles[pk]['data'] if profiles[pk] else None for pk in ids},
+            'not_found': [pk for pk in ids if profiles[pk] is None],
+        })
 
     def update(self, request, pk=None):
         queryset = User.objects.all()
@@ -323,3 +349,44 @@ class UserViewSet(viewsets.ViewSet):
             serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+# Публичные ключи подписи JWT для проверки токенов в других сервисах
+class JWKSAPIView(GenericAPIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        document, etag = get_jwks()
+        if etag_matches(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(document)
+        response['ETag'] = etag
+        response['Cache-Control'] = f'public, max-age={settings.JWKS_MAX_AGE}'
+        return response
+
+
+# OpenAPI-схема из файла, собранного `manage.py build_openapi_schema`, без обхода вьюх на запрос
+class OpenApiSchemaView(SpectacularAPIView):
+    authentication_classes = []
+
+    def get(self, request, *args, **kwargs):
+        artifact = load_schema_artifact()
+        # схема не собрана или нужен другой язык/версия - генерируем на лету, как раньше
+        if artifact is None or request.GET.get('lang') or request.GET.get('version'):
+            return super().get(request, *args, **kwargs)
+
+        renderer = request.accepted_renderer
+        schema = artifact[renderer.format]
+        if etag_matches(request, schema.etag) or etag_matches(request, schema.gzip_etag):
+            response = HttpResponseNotModified()
+        elif GZIP_RE.search(request.headers.get('Accept-Encoding', '')):
+            response = HttpResponse(schema.compressed, content_type=f'{renderer.media_type}; charset=utf-8')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(schema.body, content_type=f'{renderer.media_type}; charset=utf-8')
+        response['ETag'] = schema.gzip_etag if response.get('Content-Encoding') else schema.etag
+        response['Cache-Control'] = f'public, max-age={settings.OPENAPI_SCHEMA_MAX_AGE}'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
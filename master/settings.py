@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from datetime import timedelta
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -22,6 +23,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'account.middleware.MetricsMiddleware',  # время запросов для /metrics
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,6 +51,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'master.wsgi.application'
+# True - регистрация, вход, refresh и проверка авторизации обслуживаются async-вьюхами
+# (account/async_views.py). Включать только при запуске под ASGI (uvicorn/daphne):
+# под WSGI каждый async-запрос наоборот получает лишний переход в event loop
+ASYNC_AUTH_VIEWS = False
 
 DATABASES = {
     'default': {
@@ -56,35 +62,107 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
-# PostgreSQL если нада будет
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql',
-#         'NAME': 'name',
-#         'USER': 'user', 
-#         'PASSWORD': 'password',
-#         'HOST': 'host',
-#         'PORT': '5432',
-#     }
-# }
-
-# Настройка REDIS
+# PostgreSQL для production: включается переменной окружения POSTGRES_DB.
+# Соединения берутся из пула psycopg (Django 5.1+), а не открываются на каждый запрос.
+# POSTGRES_POOL_MAX_SIZE - на процесс: воркеры * max_size должно влезать в max_connections сервера.
+# POSTGRES_POOL=0 - без пула, постоянные соединения на поток (CONN_MAX_AGE) с проверкой перед запросом.
+if os.environ.get('POSTGRES_DB'):
+    def postgres(host):
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': host,
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,  # мёртвое соединение заменяется до запроса, а не падает в нём
+        }
+        if os.environ.get('POSTGRES_POOL', '1') == '1':
+            database['OPTIONS'] = {'pool': {
+                'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10)),
+                'timeout': 10,  # секунд ждать свободное соединение
+            }}
+        else:
+            database['CONN_MAX_AGE'] = int(os.environ.get('POSTGRES_CONN_MAX_AGE', 60))
+        return database
+
+    DATABASES = {'default': postgres(os.environ.get('POSTGRES_HOST', 'localhost'))}
+    if os.environ.get('POSTGRES_REPLICA_HOST'):
+        # реплика только для чтений, явно помеченных read_replica() (account/db_routers.py)
+        DATABASES['replica'] = {**postgres(os.environ['POSTGRES_REPLICA_HOST']), 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['account.db_routers.ReplicaRouter']
+
+# Настройка REDIS: отдельные базы и пулы соединений под разную нагрузку
+# 'auth'    - горячее состояние входа/регистрации: OTP, flow-токены, blacklist, лимиты (db 1)
+# 'default' - общий кеш: профили, очередь писем и прочее (db 0)
+# брокер Celery - db 2, результаты задач не храним (CELERY_RESULT_BACKEND)
+REDIS_AUTH_MAX_CONNECTIONS = 100  # на процесс; при исчерпании ждём REDIS_POOL_TIMEOUT, а не открываем новые
+REDIS_CACHE_MAX_CONNECTIONS = 50
+REDIS_POOL_TIMEOUT = 1  # секунд ждать свободное соединение из пула
+REDIS_SOCKET_TIMEOUT = 1  # секунд на операцию: зависший Redis не держит воркер
+REDIS_SOCKET_CONNECT_TIMEOUT = 1
+# Компактный JSON вместо pickle; сжатие не включаем - на значениях в сотню байт zlib экономит единицы байт ценой CPU
+REDIS_SERIALIZER = 'account.utils.cache_serializers.CompactJSONSerializer'
+# TTL по умолчанию для set() без timeout: забытый ключ не живёт вечно
+CACHE_DEFAULT_TIMEOUT = 60 * 60 * 24
+AUTH_CACHE_DEFAULT_TIMEOUT = 60 * 15  # самый длинный flow - регистрация
 CACHES = {
     'default': {
         'BACKEND': 'django_redis.cache.RedisCache',
         'LOCATION': 'redis://localhost:6379/0',
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'CONNECTION_POOL_CLASS': 'redis.BlockingConnectionPool',
+            'CONNECTION_POOL_KWARGS': {
+                'max_connections': REDIS_CACHE_MAX_CONNECTIONS,
+                'timeout': REDIS_POOL_TIMEOUT,
+            },
+            'SOCKET_TIMEOUT': REDIS_SOCKET_TIMEOUT,
+            'SOCKET_CONNECT_TIMEOUT': REDIS_SOCKET_CONNECT_TIMEOUT,
+            'SERIALIZER': REDIS_SERIALIZER,
         },
-        'TIMEOUT': None  # Ключи живут вечно
-    }
+        'TIMEOUT': CACHE_DEFAULT_TIMEOUT,
+    },
+    'auth': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'CONNECTION_POOL_CLASS': 'redis.BlockingConnectionPool',
+            'CONNECTION_POOL_KWARGS': {
+                'max_connections': REDIS_AUTH_MAX_CONNECTIONS,
+                'timeout': REDIS_POOL_TIMEOUT,
+            },
+            'SOCKET_TIMEOUT': REDIS_SOCKET_TIMEOUT,
+            'SOCKET_CONNECT_TIMEOUT': REDIS_SOCKET_CONNECT_TIMEOUT,
+            'SERIALIZER': REDIS_SERIALIZER,
+        },
+        'TIMEOUT': AUTH_CACHE_DEFAULT_TIMEOUT,
+    },
 }
+# Второй уровень для reg:/login: flow (account/utils/flow_cache.py): LRU в памяти процесса
+# с записью сквозь в Redis. Изменения и удаления рассылаются другим воркерам через pub/sub,
+# пока подписка не поднята - читаем из Redis. Каждому процессу - одно соединение под подписку
+FLOW_LOCAL_CACHE = False
+FLOW_LOCAL_CACHE_SIZE = 10000  # flow на процесс
+FLOW_LOCAL_CACHE_TTL = 5  # секунд, ограничивает устаревание, если сообщение об изменении потерялось
 # CELERY SETTINGS
-CELERY_BROKER_URL = 'redis://localhost:6379/0'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+CELERY_BROKER_URL = 'redis://localhost:6379/2'  # своя база, не делит ключи и соединения с кешем
+CELERY_BROKER_POOL_LIMIT = 10  # соединений с брокером на процесс
+# Задачи писем ничего не возвращают: результаты не пишем, отдельный backend не нужен
+CELERY_RESULT_BACKEND = None
+CELERY_TASK_IGNORE_RESULT = True
 CELERY_TIMEZONE = "Europe/Moscow"
-CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+# Письма с кодами - в свои очереди, у каждой свой воркер (см. README):
+# коды входа не ждут за наплывом регистраций
+EMAIL_QUEUES = {
+    'login': 'email_login',
+    'registration': 'email_registration',
+}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # короткие задачи: воркер не набирает себе чужую очередь
 
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 # Локально(для теста)
@@ -92,6 +170,16 @@ EMAIL_HOST = 'sandbox.smtp.mailtrap.io' # Для теста mailtrap
 EMAIL_HOST_USER = 'hostuser'
 EMAIL_HOST_PASSWORD = 'urhost'
 EMAIL_PORT = '2525'
+# Письма с кодами копятся и уходят пачкой по одному SMTP-соединению:
+# как только набралось EMAIL_BATCH_SIZE или через EMAIL_BATCH_WINDOW секунд после первого
+EMAIL_BATCH_SIZE = 50
+EMAIL_BATCH_WINDOW = 2
+# Аутбокс: код и письмо с ним пишутся в Redis одним Lua-вызовом, запрос не ждёт брокер.
+# Письма разбирает отдельный процесс `python manage.py relay_email_outbox`.
+# False - как раньше, задача в Celery прямо из запроса
+EMAIL_OUTBOX = True
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5  # после стольких неудачных отправок письмо уходит в email:outbox:<purpose>:dead
+EMAIL_OUTBOX_RETRY_DELAY = 2  # секунд до первого повтора, дальше задержка удваивается
 # ^^^^^^^^^ Настройка EMAIL ^^^^^^^^^
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -109,6 +197,31 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Пул для хеширования паролей (PBKDF2) в логине и регистрации, см. account/utils/password_hashing.py:
+# ограничивает параллельные хеши и отвечает 503 при перегрузке; поток запроса освобождают только async-вьюхи
+PASSWORD_HASHING_EXECUTOR = 'thread'  # 'thread' или 'process'
+PASSWORD_HASHING_WORKERS = 4
+PASSWORD_HASHING_MAX_PENDING = 16  # сверх workers + max_pending запрос сразу получает 503
+PASSWORD_HASHING_TIMEOUT = 5  # секунд ожидания результата
+
+# Bloom-фильтр занятых ников/почт в Redis (account/utils/user_bloom.py):
+# 2**24 бит = 2 МБ, 7 хешей - ~1% ложных "возможно занято" на 1.7 млн пользователей
+USER_BLOOM_BITS = 2 ** 24
+USER_BLOOM_HASHES = 7
+
+# Кеш публичных профилей (UserViewSet.retrieve), сбрасывается при сохранении User
+PROFILE_CACHE_TTL = 60 * 10
+PROFILE_NOT_FOUND_CACHE_TTL = 60
+PROFILE_BULK_MAX_IDS = 300  # /api/users/bulk/
+
+# Метрики /metrics (account/metrics.py). 'redis' - воркеры раз в METRICS_FLUSH_INTERVAL секунд
+# сливают приросты в кеш default, любой воркер отдаёт сумму; 'memory' - только свой процесс
+METRICS_STORE = 'redis'
+METRICS_FLUSH_INTERVAL = 10
+# Кому отдавать /metrics: адреса и подсети (по REMOTE_ADDR) или заголовок Authorization: Bearer <токен>
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -125,19 +238,56 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication', # Для mobile app (у них в acync storage)
-        'account.authentication.CookieJWTAuthentication',  # Кастомная проверка JWT access из кук
+        # mobile - access из заголовка (у них в acync storage), web - access из кук
+        'account.authentication.ClientJWTAuthentication',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Сколько своих прокси стоит перед Django. От него зависит IP клиента для лимитов 'ip':
+    # 0 - REMOTE_ADDR, N - N-й адрес с конца X-Forwarded-For. Без настройки DRF верит всему
+    # заголовку, и клиент обходит лимит по IP подставным X-Forwarded-For. За nginx - 1.
+    'NUM_PROXIES': 0,
+    # Лимиты скользящего окна (account/throttling.py): <scope>_<ключ>
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': '20/min',
+        'login_username': '5/min',
+        'registration_ip': '10/min',
+        'registration_email': '3/min',
+        'registration_username': '5/min',
+        'otp_ip': '30/min',
+        'otp_token': '5/min',
+    },
 }
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,  # Новый refresh при каждом обновлении
     'BLACKLIST_AFTER_ROTATION': True,  # Старые refresh больше не работают
+    # blacklist хранится в Redis (account.tokens.RefreshToken), а не в таблицах token_blacklist
+    'TOKEN_OBTAIN_SERIALIZER': 'account.serializers.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'account.serializers.TokenRefreshSerializer',
+    'AUTH_TOKEN_CLASSES': ('account.tokens.AccessToken',),  # проверка access через связку ключей
 }
+# Асимметричная подпись JWT (RS256/EdDSA): другие сервисы проверяют токены сами по /.well-known/jwks.json.
+# Первый ключ с private_key подписывает, все ключи списка проверяют подпись и публикуются в JWKS.
+# Ротация: новый ключ ставим первым, старый оставляем (можно только public_key) на REFRESH_TOKEN_LIFETIME.
+# Ключ создаётся командой `python manage.py generate_jwt_key`. Пустой список - HS256 на SECRET_KEY.
+JWT_SIGNING_KEYS = [
+    # {'kid': '2026-10', 'private_key_path': BASE_DIR / 'keys' / '2026-10.pem'},
+    # {'kid': '2026-04', 'public_key_path': BASE_DIR / 'keys' / '2026-04.pub.pem'},
+]
+JWT_ACCEPT_HS256 = True  # принимать токены без kid, выданные до перехода; выключить через REFRESH_TOKEN_LIFETIME
+JWKS_MAX_AGE = 60 * 5  # секунд кеширования JWKS у клиентов
+# Откуда брать request.user для валидного access токена:
+# 'db' - SELECT на каждый запрос, 'cache' - LRU кеш в памяти процесса, 'claims' - только claims токена.
+# 'cache' сбрасывается при User.save() только в том процессе, где был save: в остальных воркерах
+# заблокированный (is_active=False) или изменённый пользователь проходит ещё до JWT_USER_CACHE_TTL
+# секунд. Включать, только если такое окно допустимо; 'claims' - то же на весь срок access токена.
+JWT_USER_LOOKUP = 'db'
+JWT_USER_CACHE_SIZE = 1024  # пользователей на процесс
+JWT_USER_CACHE_TTL = 60  # секунд, максимальное устаревание между процессами в режиме 'cache'
 JWT_COOKIE_SECURE = not DEBUG  # False для разработки, True для production
 JWT_COOKIE_SAMESITE = 'Lax'
+JWT_COOKIE_DOMAIN = 'localhost'
 SPECTACULAR_SETTINGS = {
     'TITLE': 'E-Commerce API',
     'DESCRIPTION': 'A simple Product & Order API that helps us learn Django REST Framework',
@@ -145,3 +295,7 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
     # OTHER SETTINGS
 }
+# Собранная схема (`python manage.py build_openapi_schema`), её отдаёт /api/schema/.
+# Нет файлов - схема генерируется на каждый запрос
+OPENAPI_SCHEMA_DIR = BASE_DIR / 'openapi'
+OPENAPI_SCHEMA_MAX_AGE = 60 * 5  # клиенты перепроверяют по ETag, в ответ - 304 без тела
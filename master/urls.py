@@ -16,12 +16,17 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from drf_spectacular.views import SpectacularRedocView, SpectacularSwaggerView
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
-from account.views import CustomTokenRefreshView
+from django.conf import settings
+from account.metrics import metrics_view
+from account.views import CustomTokenRefreshView, JWKSAPIView, OpenApiSchemaView
+
+if settings.ASYNC_AUTH_VIEWS:
+    from account.async_views import AsyncTokenRefreshView as CustomTokenRefreshView
 
 urlpatterns = [ 
     path('admin/', admin.site.urls),
@@ -30,8 +35,11 @@ urlpatterns = [
     # JWT
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
+    path('.well-known/jwks.json', JWKSAPIView.as_view(), name='jwks'),
     # SPECTACULAR
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
+    path('api/schema/', OpenApiSchemaView.as_view(), name='schema'),
     path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    # METRICS (Prometheus)
+    path('metrics', metrics_view, name='metrics'),
 ]